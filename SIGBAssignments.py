@@ -1,9 +1,12 @@
+from __future__ import print_function
 import cv2
+import time
 import numpy as np
-from pylab import *
 from math import *
 from SIGBTools import *
 from SIGBSolutions import *
+from SIGBBatch import processVideo
+from SIGBStore import ResultStore, getParams, getStoredEye, interpolateInferred
 
 from os.path import basename
 
@@ -14,34 +17,85 @@ from os.path import basename
 # Most of the get*() functions have a "show" parameter that can be set to True
 # in which case the function will draw intermediate steps as well
 
-def processSequence(windows):
-    imageCount = windows.getTotalVideoFrames()
-    writer = windows.getVideoWriter("Sequences/Processed/" + basename(windows.videoFile))
+def processSequence(windows, outputFile=None, show=None, storeDirectory="Sequences/Results", progressInterval=50, gate=None, interpolate=False):
+    # processes the whole video open in windows and writes the results into
+    # outputFile (Sequences/Processed/<video> by default). Shows the frames
+    # unless the windows are headless (or show=False), prints progress and fps
+    # gate (dict of MotionGate arguments) only detects the eye on frames where
+    # it moved, the other frames reuse the last detection. interpolate then
+    # interpolates the reused eyes between the detections into the
+    # interpolated columns of the store and the returned eyes, the video
+    # shows the reused ones
+    if outputFile is None:
+        outputFile = "Sequences/Processed/" + basename(windows.videoFile)
+    if show is None:
+        show = not windows.headless
+
+    writer = windows.getVideoWriter(outputFile)
+    frameCount = windows.getTotalVideoFrames()
+
+    # results of earlier runs are read from the store, only frames and
+    # stages that are missing or whose parameters changed are computed.
+    # consecutive frames, so the pupil can be tracked instead of detected every time
+    pupilParams = {'tracker': True}
+    if gate is not None:
+        pupilParams['gate'] = gate
+    store = ResultStore(windows.videoFile, frameCount, getParams(pupil=pupilParams), directory=storeDirectory)
+
+    # the frames, intermediates and result images are the same size for the
+    # whole video, so they are computed into the same arrays every frame
+    buffers = BufferPool()
+
+    eyes = []
+    startTime = time.time()
+    for frameId, image in windows.getVideoFrames(reuse=True):
+        # gray, kmeans and gradients are shared between the detectors
+        context = FrameContext(image, buffers)
+
+        eye = getStoredEye(store, frameId, context)
+        result = drawEye(image, eye, buffers.get("result", image.shape))
+        eyes.append(eye)
+
+        if show:
+            cv2.imshow("Temp", image)
+            cv2.imshow("Results", result)
 
-    for frameId in range(imageCount):
-        image = windows.getVideoFrame(frameId)
+        writer.write(result)
 
-        result = np.copy(image)
+        if show:
+            cv2.waitKey(1)
 
-        pupils = getPupils(image, show=False)
-        result = drawPupils(result, pupils)
+        if progressInterval and len(eyes) % progressInterval == 0:
+            elapsed = time.time() - startTime
+            print("Processed {}/{} frames ({:.1f} fps)".format(len(eyes), frameCount, len(eyes) / elapsed))
 
-        if len(pupils) > 0:
-            iris = getIrisForPupil(image, pupils[0], show=False)
-            result = drawIris(result, iris)
+    writer.release()
 
-            glints = getGlints(image, iris)
-            result = drawGlints(result, glints)
+    if interpolate:
+        interpolateInferred(store)
+        eyes = [store.getEye(frameId, interpolated=True) for frameId in range(len(eyes))]
 
-        cv2.imshow("Temp", image)
-        cv2.imshow("Results", result)
+    store.flush()
 
-        writer.write(result)
+    elapsed = time.time() - startTime
+    print("Done: {} frames in {:.1f}s ({:.1f} fps), written to {}".format(len(eyes), elapsed, len(eyes) / elapsed if elapsed > 0 else 0.0, outputFile))
 
-        cv2.waitKey(1)
+    tracker = store.tracker
+    if tracker is not None:
+        print("Pupil tracking: {} frames, {} tracked, {} lost, {} full frame detections".format(tracker.frameCount, tracker.trackedCount, tracker.lostCount, tracker.fallbackCount))
 
-    writer.release()
-    exit()
+    gate = store.gate
+    if gate is not None:
+        print("Motion gate: {} frames, {} detected, {} inferred, {} forced, {} large motion".format(gate.frameCount, gate.detectedCount, gate.inferredCount, gate.forcedCount, gate.movedCount))
+
+    return eyes
+
+def processSequenceBatch(windows, outputFile=None, processes=None):
+    # same as processSequence, but headless and spread over all cores
+    if outputFile is None:
+        outputFile = "Sequences/Processed/" + basename(windows.videoFile)
+
+    return processVideo(windows.videoFile, outputFile, processes=processes)
 
 
 
@@ -52,15 +106,11 @@ def allTogether(windows):
         # want to use it for further detections steps
         result = np.copy(image)
 
-        pupils = getPupils(image, show=False)
-        result = drawPupils(result, pupils)
-
-        if len(pupils) > 0:
-            iris = getIrisForPupil(image, pupils[0], show=False)
-            result = drawIris(result, iris)
+        # gray, kmeans and gradients are shared between the detectors
+        context = FrameContext(image)
 
-            glints = getGlints(image, iris)
-            result = drawGlints(result, glints)
+        eye = getEye(context)
+        result = drawEye(result, eye)
 
         return result
 
@@ -159,14 +209,16 @@ def gradient(windows):
 #        result = cv2.cvtColor(hsv, cv2.COLOR_HSV2BGR)
 #        return result
 
-        fig = figure()
+        import matplotlib.pyplot as plt
+        fig = plt.figure()
         res = 5
-        quiver(h[::-res, ::res], -v[::-res, ::res])
-        show()
+        plt.quiver(h[::-res, ::res], -v[::-res, ::res])
+        plt.show()
 
         return result
 
-    windows.registerOnUpdateCallback("gradient", gradientCallback, "Temp")
+    # plt.show() has to run on the GUI thread
+    windows.registerOnUpdateCallback("gradient", gradientCallback, "Temp", background=False)
 
 
 
@@ -187,11 +239,10 @@ def hough(windows):
 
 #        gray = cv2.Canny(gray, 100, 128)
 
-        circles = cv2.HoughCircles(gray, cv2.cv.CV_HOUGH_GRADIENT, dp, minDist, None, param1, param2, minRadius, maxRadius)
+        circles = getHoughCircles(image, dp, minDist, param1, param2, minRadius, maxRadius)
 
         result = image
-        if circles is not None:
-            circles = circles[0]
+        if len(circles) > 0:
             for circle in circles:
                 center = (int(circle[0]), int(circle[1]))
                 radius = int(circle[2])
@@ -200,7 +251,7 @@ def hough(windows):
                 cv2.circle(result, center, radius, color)
 
 
-            circle = circles[0, :]
+            circle = circles[0]
             center = (int(circle[0]), int(circle[1]))
             radius = int(circle[2])
             color = (0, 0, 255)
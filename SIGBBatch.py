@@ -0,0 +1,125 @@
+from __future__ import print_function
+import cv2
+import time
+import multiprocessing
+from SIGBSolutions import *
+from SIGBVideo import FrameSource
+from SIGBCompat import CAP_PROP_FPS, CAP_PROP_FRAME_HEIGHT, CAP_PROP_FRAME_WIDTH, getFourCC
+
+# Headless batch processing of whole videos
+# The video is split into chunks of consecutive frames, each chunk is processed
+# by one worker process (pupil -> iris -> glints), the results are collected
+# in order and drawn into the output video.
+#
+# Usage:
+#    > python SIGBBatch.py Sequences/eye1.avi Sequences/Processed/eye1.avi
+
+def getVideoChunks(frameCount, chunkSize):
+    '''
+    Split frames of a video into chunks of consecutive frames
+    
+    Params:
+        frameCount (int): number of frames in the video
+        chunkSize (int): number of frames in one chunk
+    
+    Returns:
+        list of (start, stop) frame ranges
+    '''
+    return [(start, min(start + chunkSize, frameCount)) for start in range(0, frameCount, chunkSize)]
+
+def processChunk(task):
+    '''
+    Worker function, runs the pipeline over a range of consecutive frames
+    
+    The frames are decoded sequentially by FrameSource, so there is only one
+    seek per chunk, and the pupil is tracked within the chunk using PupilTracker
+    
+    Params:
+        task (tuple (videoFile, start, stop)): video and range of frames to process
+    
+    Returns:
+        (start, eyes): eyes is a list of getEye() results, None for frames that could not be read
+    '''
+    videoFile, start, stop = task
+
+    source = FrameSource(videoFile)
+    tracker = PupilTracker()
+
+    eyes = []
+    for frameId, image in source.getFrames(start, stop):
+        eyes.append(getEye(image, tracker))
+
+    source.release()
+
+    # frames after the first one that could not be read
+    eyes.extend([None] * (stop - start - len(eyes)))
+
+    return start, eyes
+
+def processVideo(videoFile, outputFile, processes=None, chunkSize=100, verbose=True):
+    '''
+    Process a whole video on a pool of worker processes and write the
+    results into outputFile
+    
+    The workers only send back detections, the frames are decoded again and
+    drawn here, in order, as the chunks finish
+    
+    Params:
+        videoFile (string): path to the video to process
+        outputFile (string): path to the video to write (XVID)
+        processes (int): number of worker processes, defaults to the number of cores
+        chunkSize (int): number of consecutive frames processed by one task
+        verbose (bool): print progress
+    
+    Returns:
+        list of getEye() results for every frame (None for unreadable frames)
+    '''
+    source = FrameSource(videoFile)
+    video = source.video
+    frameCount = source.getFrameCount()
+    size = (int(video.get(CAP_PROP_FRAME_WIDTH)), int(video.get(CAP_PROP_FRAME_HEIGHT)))
+    fps = video.get(CAP_PROP_FPS)
+
+    writer = cv2.VideoWriter(outputFile, getFourCC("XVID"), fps, size)
+
+    tasks = [(videoFile, start, stop) for start, stop in getVideoChunks(frameCount, chunkSize)]
+
+    pool = multiprocessing.Pool(processes)
+    startTime = time.time()
+
+    frames = source.getFrames()
+
+    results = []
+    # imap keeps the order of the chunks, so the frames can be written as they come
+    for start, eyes in pool.imap(processChunk, tasks):
+        for eye, (frameId, image) in zip(eyes, frames):
+            if eye is not None:
+                image = drawEye(image, eye)
+
+            writer.write(image)
+
+        results.extend(eyes)
+
+        if verbose:
+            elapsed = time.time() - startTime
+            print("Processed {}/{} frames ({:.1f} fps)".format(len(results), frameCount, len(results) / elapsed))
+
+    pool.close()
+    pool.join()
+
+    writer.release()
+    source.release()
+
+    return results
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Process a video on all cores without any GUI")
+    parser.add_argument("input", help="video to process")
+    parser.add_argument("output", help="video to write the results to")
+    parser.add_argument("-p", "--processes", type=int, default=None, help="number of worker processes (default: number of cores)")
+    parser.add_argument("-c", "--chunk-size", type=int, default=100, help="number of consecutive frames per task")
+    args = parser.parse_args()
+
+    processVideo(args.input, args.output, processes=args.processes, chunkSize=args.chunk_size)
@@ -0,0 +1,986 @@
+from __future__ import print_function
+import cv2
+import os
+import sys
+import json
+import time
+import shutil
+import tempfile
+import subprocess
+import numpy as np
+import SIGBTrace
+from SIGBSolutions import *
+from SIGBVideo import FrameSource
+from SIGBCompat import getFourCC
+from SIGBStore import ResultStore, getParams, getStoredEye, interpolateInferred
+
+# Benchmarks for the eye tracker
+#
+# pipeline: runs getPupils, getIrisForPupil and getGlints headless over a set of
+#           frames and reports wall time, fps and latency percentiles per stage.
+#           Frames come from the test sequences (SIGBTests.sequences), a video,
+#           or synthetic eye images when the Sequences dir is not available.
+#           With --trace the detector internals (SIGBTrace) are written per frame
+#
+# kmeans: compares the k-means backends (SIGBTools.kmeansMethods) against the
+#         scipy one, reports latency and how much the thresholds derived from
+#         the centroids differ from the scipy ones
+#
+# blobs: compares the blob extraction backends (SIGBTools.blobMethods) used by
+#        getPupils and getGlints, reports latency and how far the results are
+#        from the findContours ones
+#
+# pyramid: compares getPupilsPyramid at several pyramid depths with the full
+#          resolution getPupils, reports latency and the error of the pupil
+#
+# allocations: runs the pipeline with and without a BufferPool and reports the
+#              memory allocated per frame (tracemalloc, Python 3 with OpenCV 3+) and the
+#              arrays the pool allocated after the first frames. With --check
+#              it exits with an error when the pooled pipeline still
+#              allocates pool arrays or more than --max-kb per frame
+#
+# imports: time to import the modules in a fresh interpreter, which every
+#          worker process and batch job pays, and which optional dependencies
+#          (scipy, matplotlib) got loaded by the import. They should only be
+#          loaded when they are used (k-means "scipy", show=True)
+#
+# gate: runs processSequence()'s pipeline (tracker and store) with and without
+#       a MotionGate, reports the cost per frame, how many frames were
+#       detected and the error of the pupils of the inferred frames against
+#       detecting every frame, reused and interpolated. --fixation makes the
+#       synthetic eye hold still like in fixations
+#
+# Usage:
+#    > python SIGBBenchmark.py pipeline -o results.json
+#    > python SIGBBenchmark.py pipeline --video Sequences/eye1.avi
+#    > python SIGBBenchmark.py pipeline --synthetic 200
+#    > python SIGBBenchmark.py kmeans Sequences/eye1.avi
+#    > python SIGBBenchmark.py blobs --synthetic 50
+#    > python SIGBBenchmark.py pyramid -l 1 2 3
+#    > python SIGBBenchmark.py allocations --video Sequences/eye1.avi --check
+#    > python SIGBBenchmark.py imports SIGBSolutions SIGBJobs
+#    > python SIGBBenchmark.py gate --synthetic 300 --fixation 20 -t 1 2 4
+
+def getVideoSample(videoFile, count=50):
+    '''
+    Load frames evenly spread over the video
+    
+    Params:
+        videoFile (string): path to the video
+        count (int): how many frames to load
+    
+    Returns:
+        list of images
+    '''
+    source = FrameSource(videoFile)
+    step = max(1, source.getFrameCount() // count)
+
+    frames = [image for frameId, image in source.getFrames() if frameId % step == 0]
+    source.release()
+
+    return frames[:count]
+
+def getSequenceFrames(sequences, directory="Sequences"):
+    '''
+    Load the hand picked frames of the test sequences
+    
+    Params:
+        sequences (dict): video name -> list of frame ids, see SIGBTests.sequences
+        directory (string): where the videos are
+    
+    Returns:
+        list of images, frames that could not be loaded are skipped
+    '''
+    frames = []
+    for sequence in sorted(sequences.keys()):
+        source = FrameSource(os.path.join(directory, sequence))
+
+        for frameId in sorted(sequences[sequence]):
+            image = source.getFrame(frameId)
+            if image is not None:
+                frames.append(image)
+
+        source.release()
+
+    return frames
+
+def getSyntheticEyeFrames(count=100, size=(640, 480), seed=0, fixation=0):
+    '''
+    Generate close-up images of an eye: dark pupil inside an iris with slow
+    gradient edge, bright glint, skin getting darker towards the top, noisy.
+    The eye slowly moves around the image and the pupil changes size
+    
+    Params:
+        count (int): how many frames
+        size (tuple (width, height)): size of the frames
+        seed (int): seed for the noise
+        fixation (int): keep the eye still for this many frames at a time and
+                        then jump to where it would be (fixations and saccades),
+                        0 for smooth motion
+    
+    Returns:
+        generator of BGR images
+    '''
+    random = np.random.RandomState(seed)
+    width, height = size
+    scale = width / 640.0
+
+    Y, X = np.mgrid[0:height, 0:width]
+
+    for frameId in range(count):
+        t = frameId - frameId % fixation if fixation > 0 else frameId
+
+        center = (width / 2 + 60 * scale * np.sin(t / 10.0), height / 2 + 30 * scale * np.cos(t / 13.0))
+        irisRadius = 130 * scale
+        pupilRadius = (45 + 5 * np.sin(t / 7.0)) * scale
+
+        # iris edge is a slow gradient going from sclera to iris over ~36 pixels
+        distance = np.sqrt((X - center[0]) ** 2 + (Y - center[1]) ** 2)
+        gray = np.clip(200 - (irisRadius + 18 * scale - distance) * 2.5 / scale, 110, 200)
+        # darker skin and eyelashes towards the top of the image
+        gray = np.minimum(gray, 60 + 200 * Y / float(height))
+        image = np.dstack([gray, gray, gray]).astype(np.uint8)
+
+        intCenter = (int(center[0]), int(center[1]))
+        cv2.ellipse(image, intCenter, (int(pupilRadius), int(0.95 * pupilRadius)), 0, 0, 360, (15, 15, 15), -1)
+
+        glint = (int(center[0] + 1.5 * pupilRadius), int(center[1] - pupilRadius))
+        cv2.circle(image, glint, max(1, int(4 * scale)), (255, 255, 255), -1)
+
+        image = cv2.GaussianBlur(image, (5, 5), 1)
+        noise = random.randint(0, 16, image.shape).astype(np.uint8)
+
+        yield cv2.add(image, noise)
+
+def writeSyntheticEyeVideo(filename, count=100, size=(640, 480), fps=30, fixation=0):
+    '''
+    Write getSyntheticEyeFrames() into a video file (XVID)
+    
+    Params:
+        filename (string): path of the video to write
+        count (int): how many frames
+        size (tuple (width, height)): size of the frames
+        fps (float): frame rate of the video
+        fixation (int): frames the eye stays still, see getSyntheticEyeFrames()
+    '''
+    writer = cv2.VideoWriter(filename, getFourCC("XVID"), fps, size)
+
+    for image in getSyntheticEyeFrames(count, size, fixation=fixation):
+        writer.write(image)
+
+    writer.release()
+
+def timeCall(function, *args, **kwargs):
+    '''
+    Call function and measure how long it took
+    
+    Returns:
+        (result, seconds)
+    '''
+    start = time.time()
+    result = function(*args, **kwargs)
+
+    return result, time.time() - start
+
+def getLatencyStats(times):
+    '''
+    Summary statistics of a list of latencies
+    
+    Params:
+        times (list): latencies in ms
+    
+    Returns:
+        dict with mean, p50, p95, p99 and max (ms)
+    '''
+    if len(times) == 0:
+        return {'count': 0}
+
+    return {
+        'count': len(times),
+        'mean': float(np.mean(times)),
+        'p50': float(np.percentile(times, 50)),
+        'p95': float(np.percentile(times, 95)),
+        'p99': float(np.percentile(times, 99)),
+        'max': float(np.max(times))
+    }
+
+def getEnvironment():
+    '''
+    Information identifying the run, so reports from different commits can be compared
+    
+    Returns:
+        dict
+    '''
+    try:
+        commit = subprocess.check_output(["git", "rev-parse", "HEAD"], stderr=subprocess.STDOUT).strip().decode("ascii")
+    except Exception:
+        commit = None
+
+    return {
+        'commit': commit,
+        'time': time.strftime("%Y-%m-%dT%H:%M:%S"),
+        'python': sys.version.split()[0],
+        'opencv': cv2.__version__,
+        'numpy': np.__version__
+    }
+
+def timePipeline(image):
+    '''
+    Run the pipeline on one frame and time every stage, the times are
+    also reported to the active SIGBTrace tracer
+    
+    Params:
+        image (numpy array): BGR image
+    
+    Returns:
+        dict stage -> ms, stages that did not run are missing
+    '''
+    times = dict()
+    frameStart = time.time()
+
+    context = FrameContext(image)
+
+    pupils, seconds = timeCall(getPupils, context)
+    times["getPupils"] = seconds * 1000.0
+
+    if len(pupils) > 0:
+        iris, seconds = timeCall(getIrisForPupil, context, pupils[0])
+        times["getIrisForPupil"] = seconds * 1000.0
+
+        glints, seconds = timeCall(getGlints, context, iris)
+        times["getGlints"] = seconds * 1000.0
+
+    times["frame"] = (time.time() - frameStart) * 1000.0
+
+    for stage in times:
+        SIGBTrace.record(stage + ".ms", times[stage])
+
+    return times
+
+def benchmarkPipeline(frames, tracer=None):
+    '''
+    Run the pipeline over frames without any GUI and time every stage
+    
+    Params:
+        frames (iterable): BGR images
+        tracer (SIGBTrace.Tracer): active tracer to collect the detector internals per frame into
+    
+    Returns:
+        dict with frame count, detections, wall time (s), fps and latency
+        statistics (ms) for getPupils, getIrisForPupil, getGlints and the whole frame
+    '''
+    stages = ["getPupils", "getIrisForPupil", "getGlints", "frame"]
+    times = dict((stage, []) for stage in stages)
+
+    frameCount = 0
+    detections = 0
+
+    wallStart = time.time()
+    for image in frames:
+        if tracer is not None:
+            with tracer.frame(frameCount):
+                frameTimes = timePipeline(image)
+        else:
+            frameTimes = timePipeline(image)
+
+        for stage in frameTimes:
+            times[stage].append(frameTimes[stage])
+
+        # iris only runs when a pupil was found
+        if "getIrisForPupil" in frameTimes:
+            detections += 1
+
+        frameCount += 1
+
+    wallTime = time.time() - wallStart
+
+    return {
+        'frames': frameCount,
+        'detections': detections,
+        'wallTime': wallTime,
+        'fps': frameCount / wallTime if wallTime > 0 else 0.0,
+        'stages': dict((stage, getLatencyStats(times[stage])) for stage in stages)
+    }
+
+def printPipelineReport(report):
+    '''
+    Print the output of benchmarkPipeline() as a table
+    '''
+    print("Frames: {} Detections: {} Wall time: {:.2f}s ({:.2f} fps)".format(report['frames'], report['detections'], report['wallTime'], report['fps']))
+    print("{:<18}{:>8}{:>10}{:>10}{:>10}{:>10}{:>10}".format("stage", "count", "mean ms", "p50 ms", "p95 ms", "p99 ms", "max ms"))
+    for stage in ["getPupils", "getIrisForPupil", "getGlints", "frame"]:
+        r = report['stages'][stage]
+        if r['count'] == 0:
+            print("{:<18}{:>8}".format(stage, 0))
+            continue
+        print("{:<18}{:>8}{:>10.2f}{:>10.2f}{:>10.2f}{:>10.2f}{:>10.2f}".format(stage, r['count'], r['mean'], r['p50'], r['p95'], r['p99'], r['max']))
+
+def getKMeansThresholds(gray, equalized, method):
+    '''
+    Thresholds the detectors derive from k-means, same parameters as
+    getPupils() and getGlints()
+    
+    Returns:
+        (pupilThreshold, glintThreshold, seconds)
+    '''
+    (centroids, variance), pupilTime = timeCall(getKMeans, equalized, featureCount=5, distanceWeight=14, smallSize=(100, 75), method=method)
+    pupilThreshold = min(centroid[0] for centroid in centroids)
+
+    (centroids, variance), glintTime = timeCall(getKMeans, gray, featureCount=5, distanceWeight=14, smallSize=(100, 75), method=method)
+    brightest = max(centroids, key=lambda centroid: centroid[0])
+    glintThreshold = brightest[0] - brightest[1]
+
+    return pupilThreshold, glintThreshold, pupilTime + glintTime
+
+def benchmarkKMeans(frames, methods=None, repeats=3):
+    '''
+    Parity benchmark of the k-means backends against scipy
+    
+    The first scipy run is the reference, the remaining scipy runs show how
+    much scipy differs from itself (it is randomly initialized)
+    
+    Params:
+        frames (list): BGR images
+        methods (list): names of the backends, all of kmeansMethods when None
+        repeats (int): how many times to run each backend per frame
+    
+    Returns:
+        dict method -> {meanTime, stdTime, maxTime, pupilThresholdError, glintThresholdError}
+        times are in ms per frame (pupil + glint k-means), errors are mean absolute differences
+    '''
+    if methods is None:
+        methods = sorted(kmeansMethods.keys())
+
+    times = dict((method, []) for method in methods)
+    pupilErrors = dict((method, []) for method in methods)
+    glintErrors = dict((method, []) for method in methods)
+
+    for image in frames:
+        gray = getGray(image)
+        equalized = cv2.equalizeHist(gray)
+
+        pupilReference, glintReference, seconds = getKMeansThresholds(gray, equalized, "scipy")
+
+        for method in methods:
+            for repeat in range(repeats):
+                pupilThreshold, glintThreshold, seconds = getKMeansThresholds(gray, equalized, method)
+
+                times[method].append(seconds * 1000.0)
+                pupilErrors[method].append(abs(pupilThreshold - pupilReference))
+                glintErrors[method].append(abs(glintThreshold - glintReference))
+
+    report = dict()
+    for method in methods:
+        report[method] = {
+            'meanTime': float(np.mean(times[method])),
+            'stdTime': float(np.std(times[method])),
+            'maxTime': float(np.max(times[method])),
+            'pupilThresholdError': float(np.mean(pupilErrors[method])),
+            'glintThresholdError': float(np.mean(glintErrors[method]))
+        }
+
+    return report
+
+def printKMeansReport(report):
+    '''
+    Print the output of benchmarkKMeans() as a table
+    '''
+    print("{:<12}{:>12}{:>12}{:>12}{:>16}{:>16}".format("method", "mean ms", "std ms", "max ms", "pupil err", "glint err"))
+    for method in sorted(report.keys()):
+        r = report[method]
+        print("{:<12}{:>12.2f}{:>12.2f}{:>12.2f}{:>16.2f}{:>16.2f}".format(method, r['meanTime'], r['stdTime'], r['maxTime'], r['pupilThresholdError'], r['glintThresholdError']))
+
+def benchmarkBlobs(frames, methods=None, repeats=3):
+    '''
+    Compare the blob extraction backends against "contours"
+    
+    k-means uses the deterministic histogram backend and runs once per
+    frame (it is kept in the FrameContext), so the times are the threshold,
+    morphology and blob analysis part of getPupils and getGlints. All
+    backends look for glints in the iris found from the "contours" pupil
+    
+    Params:
+        frames (list): BGR images
+        methods (list): names of the backends, all of blobMethods when None
+        repeats (int): how many times to run each backend per frame
+    
+    Returns:
+        dict method -> {pupilTime, glintTime, pupilError, pupilMissed, glintCountError}
+        times are mean ms per call, pupilError is the mean distance (pixels) of
+        the best pupil from the reference one, pupilMissed counts frames where
+        only one of them found a pupil, glintCountError is the mean absolute
+        difference of the number of glints
+    '''
+    if methods is None:
+        methods = sorted(blobMethods.keys())
+
+    pupilTimes = dict((method, []) for method in methods)
+    glintTimes = dict((method, []) for method in methods)
+    pupilErrors = dict((method, []) for method in methods)
+    pupilMissed = dict((method, 0) for method in methods)
+    glintErrors = dict((method, []) for method in methods)
+
+    for image in frames:
+        context = FrameContext(image)
+
+        referencePupils = getPupils(context, kmeansMethod="histogram")
+        iris = None
+        referenceGlints = []
+        if len(referencePupils) > 0:
+            iris = getIrisForPupil(context, referencePupils[0])
+            referenceGlints = getGlints(image.copy(), iris, kmeansMethod="histogram")
+
+        for method in methods:
+            for repeat in range(repeats):
+                pupils, seconds = timeCall(getPupils, context, kmeansMethod="histogram", blobMethod=method)
+                pupilTimes[method].append(seconds * 1000.0)
+
+                if iris is not None:
+                    glints, seconds = timeCall(getGlints, image.copy(), iris, kmeansMethod="histogram", blobMethod=method)
+                    glintTimes[method].append(seconds * 1000.0)
+
+            if (len(pupils) > 0) != (len(referencePupils) > 0):
+                pupilMissed[method] += 1
+            elif len(pupils) > 0:
+                pupilErrors[method].append(np.hypot(pupils[0][0][0] - referencePupils[0][0][0], pupils[0][0][1] - referencePupils[0][0][1]))
+
+            if iris is not None:
+                glintErrors[method].append(abs(len(glints) - len(referenceGlints)))
+
+    def mean(values):
+        return float(np.mean(values)) if len(values) > 0 else 0.0
+
+    report = dict()
+    for method in methods:
+        report[method] = {
+            'pupilTime': mean(pupilTimes[method]),
+            'glintTime': mean(glintTimes[method]),
+            'pupilError': mean(pupilErrors[method]),
+            'pupilMissed': pupilMissed[method],
+            'glintCountError': mean(glintErrors[method])
+        }
+
+    return report
+
+def printBlobsReport(report):
+    '''
+    Print the output of benchmarkBlobs() as a table
+    '''
+    if not componentsAvailable:
+        print("cv2.connectedComponentsWithStats not available in OpenCV {}, components falls back to contours".format(cv2.__version__))
+    print("{:<12}{:>12}{:>12}{:>12}{:>14}{:>14}".format("method", "pupils ms", "glints ms", "pupil err", "pupil missed", "glint err"))
+    for method in sorted(report.keys()):
+        r = report[method]
+        print("{:<12}{:>12.2f}{:>12.2f}{:>12.2f}{:>14}{:>14.2f}".format(method, r['pupilTime'], r['glintTime'], r['pupilError'], r['pupilMissed'], r['glintCountError']))
+
+def benchmarkPyramid(frames, levels=(1, 2), repeats=3):
+    '''
+    Accuracy and latency of getPupilsPyramid() against full resolution getPupils()
+    
+    k-means runs once per frame (it is kept in the FrameContext), so every
+    depth uses the same thresholds and the times are the threshold,
+    morphology and blob analysis part of the detection
+    
+    Params:
+        frames (list): BGR images
+        levels (list): pyramid depths to compare, 0 (full resolution) is always included
+        repeats (int): how many times to run each depth per frame
+    
+    Returns:
+        dict depth -> {time, centerError, maxCenterError, axesError, missed}
+        time is mean ms per call, errors are in pixels against depth 0 and
+        missed counts frames where only one of them found a pupil
+    '''
+    levels = sorted(set([0] + list(levels)))
+
+    times = dict((level, []) for level in levels)
+    centerErrors = dict((level, []) for level in levels)
+    axesErrors = dict((level, []) for level in levels)
+    missed = dict((level, 0) for level in levels)
+
+    for image in frames:
+        context = FrameContext(image)
+        reference = getPupils(context)
+
+        for level in levels:
+            for repeat in range(repeats):
+                pupils, seconds = timeCall(getPupilsPyramid, context, levels=level)
+                times[level].append(seconds * 1000.0)
+
+            if (len(pupils) > 0) != (len(reference) > 0):
+                missed[level] += 1
+            elif len(pupils) > 0:
+                (x, y), axes, angle = pupils[0]
+                (rx, ry), referenceAxes, referenceAngle = reference[0]
+                centerErrors[level].append(np.hypot(x - rx, y - ry))
+                axesErrors[level].append(max(abs(axes[0] - referenceAxes[0]), abs(axes[1] - referenceAxes[1])))
+
+    def mean(values):
+        return float(np.mean(values)) if len(values) > 0 else 0.0
+
+    report = dict()
+    for level in levels:
+        report[level] = {
+            'time': mean(times[level]),
+            'centerError': mean(centerErrors[level]),
+            'maxCenterError': float(np.max(centerErrors[level])) if len(centerErrors[level]) > 0 else 0.0,
+            'axesError': mean(axesErrors[level]),
+            'missed': missed[level]
+        }
+
+    return report
+
+def printPyramidReport(report):
+    '''
+    Print the output of benchmarkPyramid() as a table
+    '''
+    print("{:<8}{:>12}{:>14}{:>14}{:>12}{:>10}".format("levels", "mean ms", "center err", "max center", "axes err", "missed"))
+    for level in sorted(report.keys()):
+        r = report[level]
+        print("{:<8}{:>12.2f}{:>14.2f}{:>14.2f}{:>12.2f}{:>10}".format(level, r['time'], r['centerError'], r['maxCenterError'], r['axesError'], r['missed']))
+
+def runPooledFrame(image, buffers):
+    '''
+    Pipeline of processSequence() for one frame: detect and draw into a result
+    image, with all the arrays taken from buffers
+    '''
+    eye = getEye(FrameContext(image, buffers))
+
+    return drawEye(image, eye, buffers.get("result", image.shape))
+
+def runUnpooledFrame(image):
+    '''
+    Same as runPooledFrame(), allocating every array
+    '''
+    eye = getEye(FrameContext(image))
+
+    return drawEye(np.copy(image), eye)
+
+def benchmarkAllocations(frames, warmup=5):
+    '''
+    Memory allocated per frame by the pipeline, with and without a BufferPool
+    
+    The first warmup frames fill the pool (and the caches of SIGBCache) and
+    are not measured. Allocations are measured with tracemalloc, which numpy
+    reports its arrays to, so it is only available on Python 3
+    
+    Params:
+        frames (list): BGR images, all the same size
+        warmup (int): frames run before measuring
+    
+    Returns:
+        dict with the frame size (KB), per mode (pooled, unpooled) the mean and
+        max KB allocated per frame (peak while processing it, None without
+        tracemalloc) and the arrays the pool allocated after the warmup
+    '''
+    try:
+        import tracemalloc
+    except ImportError:
+        tracemalloc = None
+
+    buffers = BufferPool()
+    modes = [("pooled", lambda image: runPooledFrame(image, buffers)), ("unpooled", runUnpooledFrame)]
+
+    report = {
+        'frameKB': frames[0].nbytes / 1024.0,
+        'frames': max(0, len(frames) - warmup),
+        'tracemalloc': tracemalloc is not None
+    }
+
+    for mode, function in modes:
+        # same seed for both modes, so scipy k-means finds the same thresholds
+        np.random.seed(0)
+        for image in frames[:warmup]:
+            function(image)
+
+        allocations = buffers.allocations
+        peaks = []
+
+        for image in frames[warmup:]:
+            if tracemalloc is not None:
+                tracemalloc.start()
+
+            function(image)
+
+            if tracemalloc is not None:
+                peaks.append(tracemalloc.get_traced_memory()[1] / 1024.0)
+                tracemalloc.stop()
+
+        report[mode] = {
+            'meanKB': float(np.mean(peaks)) if len(peaks) > 0 else None,
+            'maxKB': float(np.max(peaks)) if len(peaks) > 0 else None,
+            'poolAllocations': buffers.allocations - allocations
+        }
+
+    return report
+
+def printAllocationsReport(report):
+    '''
+    Print the output of benchmarkAllocations() as a table
+    '''
+    print("{} frames of {:.0f} KB".format(report['frames'], report['frameKB']))
+    if not report['tracemalloc']:
+        print("tracemalloc not available (Python {}), only the pool is checked".format(sys.version.split()[0]))
+
+    print("{:<10}{:>14}{:>14}{:>18}".format("mode", "mean KB", "max KB", "pool allocations"))
+    for mode in ["pooled", "unpooled"]:
+        r = report[mode]
+        meanKB = "-" if r['meanKB'] is None else "{:.1f}".format(r['meanKB'])
+        maxKB = "-" if r['maxKB'] is None else "{:.1f}".format(r['maxKB'])
+        print("{:<10}{:>14}{:>14}{:>18}".format(mode, meanKB, maxKB, r['poolAllocations'] if mode == "pooled" else "-"))
+
+def checkAllocations(report, maxKB):
+    '''
+    Params:
+        report (dict): output of benchmarkAllocations()
+        maxKB (float): max KB the pooled pipeline may allocate per frame
+    
+    Returns:
+        list of failures, empty when the pooled pipeline stayed within maxKB
+        and the pool did not allocate after the warmup
+    '''
+    failures = []
+    pooled = report['pooled']
+
+    if pooled['poolAllocations'] > 0:
+        failures.append("the pool allocated {} arrays after the warmup".format(pooled['poolAllocations']))
+
+    if pooled['maxKB'] is not None and pooled['maxKB'] > maxKB:
+        failures.append("a frame allocated {:.1f} KB, more than {:.1f} KB".format(pooled['maxKB'], maxKB))
+
+    return failures
+
+# imports one module in a fresh interpreter, prints the seconds it took and
+# which of the optional dependencies are loaded afterwards
+importScript = """
+import sys, time
+start = time.time()
+import {module}
+print(time.time() - start)
+print(" ".join(name for name in {optional} if name in sys.modules))
+"""
+
+# dependencies that are only needed by some of the code paths
+optionalModules = ["scipy", "matplotlib", "pylab"]
+
+def timeImport(module, repeats=5):
+    '''
+    Import time of module in a fresh interpreter
+    
+    Params:
+        module (string): module name
+        repeats (int): number of interpreters started
+    
+    Returns:
+        dict with median and min ms and the optional dependencies the import loaded
+    '''
+    directory = os.path.dirname(os.path.abspath(__file__))
+    script = importScript.format(module=module, optional=optionalModules)
+
+    times = []
+    for repeat in range(repeats):
+        output = subprocess.check_output([sys.executable, "-c", script], cwd=directory).decode("ascii").splitlines()
+        times.append(float(output[0]) * 1000.0)
+        loaded = output[1].split() if len(output) > 1 else []
+
+    return {
+        'median': float(np.median(times)),
+        'min': float(np.min(times)),
+        'loaded': loaded
+    }
+
+def benchmarkImports(modules=None, repeats=5):
+    '''
+    Import times of the modules, cv2 and numpy alone are the baseline every
+    module pays
+    
+    Params:
+        modules (list): module names, SIGBTools and SIGBSolutions when None
+        repeats (int): interpreters started per module
+    
+    Returns:
+        dict module -> output of timeImport()
+    '''
+    if modules is None:
+        modules = ["SIGBTools", "SIGBSolutions"]
+
+    report = dict()
+    for module in ["cv2, numpy"] + list(modules):
+        report[module] = timeImport(module, repeats)
+
+    return report
+
+def printImportsReport(report):
+    '''
+    Print the output of benchmarkImports() as a table
+    '''
+    print("{:<20}{:>12}{:>12}  {}".format("module", "median ms", "min ms", "optional dependencies loaded"))
+    for module in sorted(report.keys(), key=lambda module: report[module]['median']):
+        r = report[module]
+        print("{:<20}{:>12.1f}{:>12.1f}  {}".format(module, r['median'], r['min'], ", ".join(r['loaded']) or "-"))
+
+def runStoredEyes(frames, params, directory):
+    '''
+    Run getStoredEye() over frames with a new store
+    
+    Returns:
+        (store, seconds)
+    '''
+    store = ResultStore("benchmark.avi", len(frames), params, directory=directory)
+
+    startTime = time.time()
+    for frameId, image in enumerate(frames):
+        getStoredEye(store, frameId, FrameContext(image))
+
+    return store, time.time() - startTime
+
+def getPupilErrors(eyes, reference, frameIds):
+    '''
+    Distance of the pupil centers of frameIds to the reference eyes, frames
+    where only one of them found a pupil count as misses
+    
+    Params:
+        eyes (list): (pupils, iris, glints) for every frame
+        reference (list): reference (pupils, iris, glints) for every frame
+        frameIds (list): frames to compare
+    
+    Returns:
+        (mean, max, misses)
+    '''
+    errors = []
+    misses = 0
+    for frameId in frameIds:
+        pupil = eyes[frameId][0][0] if len(eyes[frameId][0]) > 0 else None
+        referencePupil = reference[frameId][0][0] if len(reference[frameId][0]) > 0 else None
+
+        if (pupil is None) != (referencePupil is None):
+            misses += 1
+        elif pupil is not None:
+            errors.append(np.hypot(pupil[0][0] - referencePupil[0][0], pupil[0][1] - referencePupil[0][1]))
+
+    if len(errors) == 0:
+        return 0.0, 0.0, misses
+
+    return float(np.mean(errors)), float(np.max(errors)), misses
+
+def benchmarkGate(frames, thresholds=(1.0, 2.0, 4.0), maxSkip=15):
+    '''
+    Cost and accuracy of the MotionGate against detecting every frame
+    
+    Both run the pipeline of processSequence(): PupilTracker and a
+    ResultStore, in a temporary directory
+    
+    Params:
+        frames (list): consecutive BGR frames
+        thresholds (list): MotionGate thresholds to compare
+        maxSkip (int): MotionGate maxSkip
+    
+    Returns:
+        dict str(threshold) -> {threshold, msPerFrame, speedup, detected,
+        inferred, reuseError, reuseMaxError, interpolatedError,
+        interpolatedMaxError, misses}, errors are pupil center distances in
+        pixels over the inferred frames, the key "every frame" is the
+        reference. The keys are strings so the report can be written as JSON
+    '''
+    directory = tempfile.mkdtemp()
+
+    try:
+        np.random.seed(0)
+        referenceStore, seconds = runStoredEyes(frames, getParams(pupil={'tracker': True}), os.path.join(directory, "reference"))
+        reference = [referenceStore.getEye(frameId) for frameId in range(len(frames))]
+        referenceMs = seconds * 1000.0 / len(frames)
+
+        report = {"every frame": {'msPerFrame': referenceMs, 'speedup': 1.0, 'detected': len(frames), 'inferred': 0}}
+
+        for threshold in thresholds:
+            np.random.seed(0)
+            gate = {'threshold': threshold, 'maxSkip': maxSkip}
+            store, seconds = runStoredEyes(frames, getParams(pupil={'tracker': True, 'gate': gate}), os.path.join(directory, str(threshold)))
+            msPerFrame = seconds * 1000.0 / len(frames)
+
+            inferred = np.flatnonzero(store.inferred)
+            eyes = [store.getEye(frameId) for frameId in range(len(frames))]
+            reuseError, reuseMaxError, misses = getPupilErrors(eyes, reference, inferred)
+
+            interpolateInferred(store)
+            eyes = [store.getEye(frameId, interpolated=True) for frameId in range(len(frames))]
+            interpolatedError, interpolatedMaxError, interpolatedMisses = getPupilErrors(eyes, reference, inferred)
+
+            report[str(threshold)] = {
+                'threshold': threshold,
+                'msPerFrame': msPerFrame,
+                'speedup': referenceMs / msPerFrame if msPerFrame > 0 else 0.0,
+                'detected': len(frames) - len(inferred),
+                'inferred': len(inferred),
+                'reuseError': reuseError,
+                'reuseMaxError': reuseMaxError,
+                'interpolatedError': interpolatedError,
+                'interpolatedMaxError': interpolatedMaxError,
+                'misses': misses
+            }
+    finally:
+        shutil.rmtree(directory)
+
+    return report
+
+def printGateReport(report):
+    '''
+    Print the output of benchmarkGate() as a table
+    '''
+    print("{:<12}{:>10}{:>10}{:>10}{:>10}{:>18}{:>18}{:>8}".format("threshold", "ms/frame", "speedup", "detected", "inferred", "reuse err (max)", "interp err (max)", "missed"))
+
+    r = report["every frame"]
+    print("{:<12}{:>10.2f}{:>10.1f}{:>10}{:>10}".format("every frame", r['msPerFrame'], r['speedup'], r['detected'], r['inferred']))
+
+    rows = sorted((report[key] for key in report if key != "every frame"), key=lambda r: r['threshold'])
+    for r in rows:
+        threshold = r['threshold']
+        reuse = "{:.2f} ({:.1f})".format(r['reuseError'], r['reuseMaxError'])
+        interpolated = "{:.2f} ({:.1f})".format(r['interpolatedError'], r['interpolatedMaxError'])
+        print("{:<12}{:>10.2f}{:>10.1f}{:>10}{:>10}{:>18}{:>18}{:>8}".format(threshold, r['msPerFrame'], r['speedup'], r['detected'], r['inferred'], reuse, interpolated, r['misses']))
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Eye tracker benchmarks")
+    subparsers = parser.add_subparsers(dest="benchmark")
+
+    pipelineParser = subparsers.add_parser("pipeline", help="time the detection pipeline per stage")
+    pipelineParser.add_argument("--video", default=None, help="use all frames of this video")
+    pipelineParser.add_argument("--synthetic", type=int, default=None, help="use this many synthetic frames")
+    pipelineParser.add_argument("--size", type=int, nargs=2, default=(640, 480), help="size of the synthetic frames")
+    pipelineParser.add_argument("-o", "--output", default=None, help="write the report as JSON")
+    pipelineParser.add_argument("-t", "--trace", default=None, help="write the detector internals per frame (.csv or .json)")
+
+    kmeansParser = subparsers.add_parser("kmeans", help="compare k-means backends against scipy")
+    kmeansParser.add_argument("video", help="video to take the frames from")
+    kmeansParser.add_argument("-n", "--frames", type=int, default=50, help="number of frames")
+    kmeansParser.add_argument("-r", "--repeats", type=int, default=3, help="runs per backend and frame")
+    kmeansParser.add_argument("-m", "--methods", nargs="+", default=None, help="backends to compare")
+    kmeansParser.add_argument("-o", "--output", default=None, help="write the report as JSON")
+
+    blobsParser = subparsers.add_parser("blobs", help="compare blob extraction backends against findContours")
+    blobsParser.add_argument("--video", default=None, help="take the frames from this video")
+    blobsParser.add_argument("--synthetic", type=int, default=None, help="use this many synthetic frames")
+    blobsParser.add_argument("-n", "--frames", type=int, default=50, help="number of frames taken from the video")
+    blobsParser.add_argument("-r", "--repeats", type=int, default=3, help="runs per backend and frame")
+    blobsParser.add_argument("-m", "--methods", nargs="+", default=None, help="backends to compare")
+    blobsParser.add_argument("-o", "--output", default=None, help="write the report as JSON")
+
+    pyramidParser = subparsers.add_parser("pyramid", help="compare coarse to fine pupil detection with full resolution")
+    pyramidParser.add_argument("--video", default=None, help="take the frames from this video")
+    pyramidParser.add_argument("--synthetic", type=int, default=None, help="use this many synthetic frames")
+    pyramidParser.add_argument("-n", "--frames", type=int, default=50, help="number of frames taken from the video")
+    pyramidParser.add_argument("-l", "--levels", type=int, nargs="+", default=[1, 2], help="pyramid depths to compare")
+    pyramidParser.add_argument("-r", "--repeats", type=int, default=3, help="runs per depth and frame")
+    pyramidParser.add_argument("-o", "--output", default=None, help="write the report as JSON")
+
+    allocationsParser = subparsers.add_parser("allocations", help="memory allocated per frame with and without a BufferPool")
+    allocationsParser.add_argument("--video", default=None, help="take the frames from this video")
+    allocationsParser.add_argument("--synthetic", type=int, default=None, help="use this many synthetic frames")
+    allocationsParser.add_argument("-n", "--frames", type=int, default=50, help="number of frames taken from the video")
+    allocationsParser.add_argument("-w", "--warmup", type=int, default=5, help="frames run before measuring")
+    allocationsParser.add_argument("--check", action="store_true", help="exit with an error when the pooled pipeline allocates too much")
+    allocationsParser.add_argument("--max-kb", type=float, default=1024, help="max KB per frame for --check (k-means and contours need a few hundred KB at any resolution)")
+    allocationsParser.add_argument("-o", "--output", default=None, help="write the report as JSON")
+
+    importsParser = subparsers.add_parser("imports", help="time to import the modules in a fresh interpreter")
+    importsParser.add_argument("modules", nargs="*", default=None, help="modules to import (default: SIGBTools SIGBSolutions)")
+    importsParser.add_argument("-r", "--repeats", type=int, default=5, help="interpreters started per module")
+    importsParser.add_argument("-o", "--output", default=None, help="write the report as JSON")
+
+    gateParser = subparsers.add_parser("gate", help="cost and accuracy of skipping frames where the eye did not move")
+    gateParser.add_argument("--video", default=None, help="take consecutive frames from this video")
+    gateParser.add_argument("--synthetic", type=int, default=None, help="use this many synthetic frames")
+    gateParser.add_argument("--fixation", type=int, default=0, help="frames the synthetic eye holds still")
+    gateParser.add_argument("-n", "--frames", type=int, default=300, help="number of frames taken from the video")
+    gateParser.add_argument("-t", "--thresholds", type=float, nargs="+", default=[1.0, 2.0, 4.0], help="MotionGate thresholds to compare")
+    gateParser.add_argument("--max-skip", type=int, default=15, help="MotionGate maxSkip")
+    gateParser.add_argument("-o", "--output", default=None, help="write the report as JSON")
+
+    args = parser.parse_args()
+
+    if args.benchmark == "pipeline":
+        if args.video is not None:
+            source = "video"
+            frames = (image for frameId, image in FrameSource(args.video).getFrames())
+        elif args.synthetic is None and os.path.isdir("Sequences"):
+            from SIGBTests import sequences
+            source = "sequences"
+            frames = getSequenceFrames(sequences)
+        else:
+            source = "synthetic"
+            frames = getSyntheticEyeFrames(args.synthetic or 100, tuple(args.size))
+
+        if args.trace is not None:
+            with SIGBTrace.Tracer() as tracer:
+                report = benchmarkPipeline(frames, tracer)
+
+            if args.trace.endswith(".json"):
+                tracer.writeJSON(args.trace)
+            else:
+                tracer.writeCSV(args.trace)
+        else:
+            report = benchmarkPipeline(frames)
+
+        report['source'] = source
+        report['environment'] = getEnvironment()
+        printPipelineReport(report)
+
+    if args.benchmark == "kmeans":
+        report = benchmarkKMeans(getVideoSample(args.video, args.frames), methods=args.methods, repeats=args.repeats)
+        printKMeansReport(report)
+
+    if args.benchmark == "blobs":
+        if args.video is not None:
+            frames = getVideoSample(args.video, args.frames)
+        else:
+            frames = list(getSyntheticEyeFrames(args.synthetic or 50))
+
+        report = benchmarkBlobs(frames, methods=args.methods, repeats=args.repeats)
+        printBlobsReport(report)
+
+    if args.benchmark == "pyramid":
+        if args.video is not None:
+            frames = getVideoSample(args.video, args.frames)
+        elif args.synthetic is None and os.path.isdir("Sequences"):
+            from SIGBTests import sequences
+            frames = getSequenceFrames(sequences)
+        else:
+            frames = list(getSyntheticEyeFrames(args.synthetic or 50))
+
+        report = benchmarkPyramid(frames, levels=args.levels, repeats=args.repeats)
+        printPyramidReport(report)
+
+    if args.benchmark == "allocations":
+        if args.video is not None:
+            frames = getVideoSample(args.video, args.frames)
+        else:
+            frames = list(getSyntheticEyeFrames(args.synthetic or 50))
+
+        report = benchmarkAllocations(frames, warmup=args.warmup)
+        printAllocationsReport(report)
+
+    if args.benchmark == "imports":
+        report = benchmarkImports(args.modules or None, repeats=args.repeats)
+        printImportsReport(report)
+
+    if args.benchmark == "gate":
+        if args.video is not None:
+            frames = [image for frameId, image in FrameSource(args.video).getFrames(0, args.frames)]
+        else:
+            frames = list(getSyntheticEyeFrames(args.synthetic or 300, fixation=args.fixation))
+
+        report = benchmarkGate(frames, thresholds=args.thresholds, maxSkip=args.max_skip)
+        printGateReport(report)
+
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+
+    if args.benchmark == "allocations" and args.check:
+        failures = checkAllocations(report, args.max_kb)
+        for failure in failures:
+            print("FAILED: " + failure)
+
+        sys.exit(1 if len(failures) > 0 else 0)
@@ -0,0 +1,118 @@
+import cv2
+import numpy as np
+
+# Cache of kernels and sampling geometry that only depend on sizes
+#
+# The detectors run on frames of the same resolution with the same parameters
+# over and over, so structuring elements, trigonometry of the circle samples,
+# position features for k-means and the vignette mask are computed once per
+# (shape, size) and reused. The arrays are shared between all callers, so they
+# are returned read only.
+
+# key -> cached array, keys are (function name, arguments)
+cache = dict()
+
+def cached(function):
+    '''
+    Decorator memoizing function by its (hashable) arguments, numpy results
+    are made read only
+    '''
+    def wrapper(*args):
+        key = (function.__name__,) + args
+
+        if key not in cache:
+            result = function(*args)
+            if isinstance(result, np.ndarray):
+                result.flags.writeable = False
+            cache[key] = result
+
+        return cache[key]
+
+    wrapper.__name__ = function.__name__
+    wrapper.__doc__ = function.__doc__
+
+    return wrapper
+
+def clear():
+    '''
+    Forget everything that has been cached
+    '''
+    cache.clear()
+
+@cached
+def getStructuringElement(shape, size):
+    '''
+    Cached cv2.getStructuringElement
+    
+    Params:
+        shape (int): cv2.MORPH_RECT, cv2.MORPH_ELLIPSE or cv2.MORPH_CROSS
+        size (tuple (int, int)): size of the kernel
+    
+    Returns:
+        (numpy array) kernel
+    '''
+    return cv2.getStructuringElement(shape, size)
+
+@cached
+def getCircleDirections(nPoints):
+    '''
+    Unit vectors for nPoints angles evenly spaced over 0 - 2pi (both included),
+    used by getCircleSamples()
+    
+    Params:
+        nPoints (int): how many samples
+    
+    Returns:
+        (numpy array nPoints x 2) columns cos, sin
+    '''
+    s = np.linspace(0, 2 * np.pi, nPoints)
+
+    return np.column_stack([np.cos(s), np.sin(s)])
+
+@cached
+def getPositionFeatures(smallSize, distanceWeight):
+    '''
+    Position columns of the k-means features (see getKMeansFeatures()) for
+    an image of size smallSize
+    
+    Original Author: Dan Witzner Hansen, IT University
+    
+    Params:
+        smallSize (tuple (int, int)): size of the image k-means runs on
+        distanceWeight (int): > 0 weight of the position parameters
+    
+    Returns:
+        (numpy array float32, width * height x 2) columns y, x
+    '''
+    width, height = smallSize
+    X, Y = np.meshgrid(range(height), range(width))
+    x = X.flatten()
+    y = Y.flatten()
+
+    positions = np.zeros((len(x), 2))
+    positions[:, 0] = y / distanceWeight
+    positions[:, 1] = x / distanceWeight
+
+    return np.array(positions, 'f')
+
+@cached
+def getGradientMask(shape):
+    '''
+    Radial gradient added by applyGradient(), 0 in the center of the image
+    and 255 in the corners
+    
+    Params:
+        shape (tuple (height, width)): shape of the image
+    
+    Returns:
+        (numpy array uint8) the mask
+    '''
+    height, width = shape
+    center = (width // 2, height // 2)
+
+    Y, X = np.mgrid[0:height, 0:width]
+    dx = (X - center[0]) / float(center[0])
+    dy = (Y - center[1]) / float(center[1])
+    weight = np.sqrt((dx ** 2 + dy ** 2) * 0.5)
+
+    return np.minimum(255, np.floor(255 * weight)).astype(np.uint8)
@@ -0,0 +1,49 @@
+import cv2
+
+# Names that moved between OpenCV versions
+# OpenCV 2.4 has some constants only in the legacy cv2.cv module, which was
+# removed in OpenCV 3, where they live in cv2 under a new name. Use the names
+# below instead of cv2.cv.* so the code runs on both
+#
+# Example:
+#    from SIGBCompat import CAP_PROP_FPS, getFourCC
+#    fps = video.get(CAP_PROP_FPS)
+#    writer = cv2.VideoWriter(filename, getFourCC("XVID"), fps, size)
+
+def getConstant(name, legacyName):
+    '''
+    OpenCV constant by its cv2 name, or by its cv2.cv name on OpenCV 2.4
+
+    Params:
+        name (string): name in cv2, e.g. "CAP_PROP_FPS"
+        legacyName (string): name in cv2.cv, e.g. "CV_CAP_PROP_FPS"
+
+    Returns:
+        (int) value of the constant
+    '''
+    if hasattr(cv2, name):
+        return getattr(cv2, name)
+
+    return getattr(cv2.cv, legacyName)
+
+CAP_PROP_POS_FRAMES = getConstant("CAP_PROP_POS_FRAMES", "CV_CAP_PROP_POS_FRAMES")
+CAP_PROP_FRAME_WIDTH = getConstant("CAP_PROP_FRAME_WIDTH", "CV_CAP_PROP_FRAME_WIDTH")
+CAP_PROP_FRAME_HEIGHT = getConstant("CAP_PROP_FRAME_HEIGHT", "CV_CAP_PROP_FRAME_HEIGHT")
+CAP_PROP_FPS = getConstant("CAP_PROP_FPS", "CV_CAP_PROP_FPS")
+CAP_PROP_FRAME_COUNT = getConstant("CAP_PROP_FRAME_COUNT", "CV_CAP_PROP_FRAME_COUNT")
+HOUGH_GRADIENT = getConstant("HOUGH_GRADIENT", "CV_HOUGH_GRADIENT")
+
+def getFourCC(code):
+    '''
+    Video codec code for cv2.VideoWriter
+
+    Params:
+        code (string): four characters, e.g. "XVID"
+
+    Returns:
+        (int) fourcc
+    '''
+    if hasattr(cv2, "VideoWriter_fourcc"):
+        return cv2.VideoWriter_fourcc(*code)
+
+    return cv2.cv.FOURCC(*code)
@@ -0,0 +1,213 @@
+from __future__ import print_function
+import os
+import cv2
+import json
+import time
+import multiprocessing
+import numpy as np
+from SIGBSolutions import *
+from SIGBVideo import FrameSource
+
+# Runs the pipeline over many videos at once
+# A manifest lists the videos and which of their frames to process, every
+# video is split into units of at most chunkSize frames and the units of all
+# the videos are handed to a pool of worker processes one at a time, the
+# biggest ones first. A worker that is done takes the next unit, so one long
+# video is spread over all the cores instead of keeping one of them busy
+# while the others wait. The results are summed up per sequence and reported
+# the same way SIGBTests.py does.
+#
+# The manifest is JSON, video name -> frames, where frames are either a list
+# of frame ids, {"start": 0, "stop": 100} for a range or null for all frames:
+#    {"eye1.avi": [8, 87, 223], "eye2.avi": {"start": 0, "stop": 300}, "eye3.avi": null}
+#
+# Usage:
+#    > python SIGBJobs.py
+#    > python SIGBJobs.py manifest.json -p 4 -r Results
+
+def loadManifest(filename):
+    '''
+    Read a manifest file
+
+    Params:
+        filename (string): path to the JSON manifest
+
+    Returns:
+        dict video name -> frames, see the top of SIGBJobs.py
+    '''
+    with open(filename) as f:
+        return json.load(f)
+
+def getManifestFrames(frames, videoFile):
+    '''
+    Frame ids of one manifest entry
+
+    Params:
+        frames (list, dict or None): value of the manifest entry
+        videoFile (string): path to the video, for the frame count when all frames are wanted
+
+    Returns:
+        sorted list of frame ids
+    '''
+    if frames is None:
+        source = FrameSource(videoFile)
+        frameCount = source.getFrameCount()
+        source.release()
+
+        return list(range(frameCount))
+
+    if isinstance(frames, dict):
+        return list(range(frames.get('start', 0), frames['stop']))
+
+    return sorted(frames)
+
+def getUnits(manifest, directory="Sequences", chunkSize=50):
+    '''
+    Split the manifest into units of work
+
+    Params:
+        manifest (dict): video name -> frames
+        directory (string): where the videos are
+        chunkSize (int): max number of frames in one unit
+
+    Returns:
+        list of (sequence, videoFile, frameIds), biggest units first
+    '''
+    units = []
+    for sequence in sorted(manifest.keys()):
+        videoFile = os.path.join(directory, sequence)
+        frameIds = getManifestFrames(manifest[sequence], videoFile)
+
+        for start in range(0, len(frameIds), chunkSize):
+            units.append((sequence, videoFile, frameIds[start:start + chunkSize]))
+
+    # longest first, so the short ones fill the gaps at the end
+    units.sort(key=lambda unit: len(unit[2]), reverse=True)
+
+    return units
+
+def processUnit(task):
+    '''
+    Worker function, runs the pipeline over the frames of one unit
+
+    Params:
+        task (tuple (sequence, videoFile, frameIds, resultDirectory)): unit from
+            getUnits() and where to write the images with the results drawn in,
+            nothing is written when resultDirectory is None
+
+    Returns:
+        (sequence, detections, seconds): detections has one bool per frame that
+        could be read (was a pupil found), seconds is how long the unit took
+    '''
+    sequence, videoFile, frameIds, resultDirectory = task
+
+    startTime = time.time()
+    source = FrameSource(videoFile)
+
+    buffers = BufferPool()
+
+    detections = []
+    for frameId in frameIds:
+        frame = source.getFrame(frameId)
+        if frame is None:
+            continue
+
+        eye = getEye(FrameContext(frame, buffers))
+        detections.append(len(eye[0]) > 0)
+
+        if resultDirectory is not None:
+            cv2.imwrite(os.path.join(resultDirectory, "{}_{}.png".format(sequence, frameId)), drawEye(frame, eye, buffers.get("result", frame.shape)))
+
+    source.release()
+
+    return sequence, detections, time.time() - startTime
+
+def runJobs(manifest, directory="Sequences", processes=None, chunkSize=50, resultDirectory=None, verbose=True):
+    '''
+    Process all the frames of the manifest on a pool of worker processes
+
+    Params:
+        manifest (dict): video name -> frames, see the top of SIGBJobs.py
+        directory (string): where the videos are
+        processes (int): number of worker processes, defaults to the number of cores
+        chunkSize (int): max number of frames in one unit
+        resultDirectory (string): write the images with the results drawn in here
+        verbose (bool): print progress
+
+    Returns:
+        dict with per sequence frames, detections and seconds (summed over its
+        units), the wall time and the number of units
+    '''
+    units = getUnits(manifest, directory, chunkSize)
+    tasks = [unit + (resultDirectory,) for unit in units]
+
+    sequences = dict((sequence, {'frames': 0, 'detections': 0, 'seconds': 0.0}) for sequence in manifest)
+
+    pool = multiprocessing.Pool(processes)
+    startTime = time.time()
+
+    # chunksize=1 hands out one unit at a time, idle workers take the next one
+    for done, (sequence, detections, seconds) in enumerate(pool.imap_unordered(processUnit, tasks, chunksize=1)):
+        sequences[sequence]['frames'] += len(detections)
+        sequences[sequence]['detections'] += sum(detections)
+        sequences[sequence]['seconds'] += seconds
+
+        if verbose:
+            print("Finished unit {}/{}: {} ({} frames, {:.1f}s)".format(done + 1, len(tasks), sequence, len(detections), seconds))
+
+    pool.close()
+    pool.join()
+
+    return {
+        'sequences': sequences,
+        'wallTime': time.time() - startTime,
+        'units': len(tasks)
+    }
+
+def printJobsReport(report):
+    '''
+    Print the output of runJobs(), same as SIGBTests.py plus timing
+    '''
+    totalFrameCount = 0
+    totalDetections = 0
+    totalSeconds = 0.0
+
+    for sequence in sorted(report['sequences'].keys()):
+        r = report['sequences'][sequence]
+        success = float(r['detections']) / float(r['frames']) * 100.0 if r['frames'] > 0 else 0.0
+        print("Sequence: {} Got {} detections out of {} frames ({}% success rate) in {:.1f}s".format(sequence, r['detections'], r['frames'], success, r['seconds']))
+
+        totalFrameCount += r['frames']
+        totalDetections += r['detections']
+        totalSeconds += r['seconds']
+
+    totalSuccess = float(totalDetections) / float(totalFrameCount) * 100.0 if totalFrameCount > 0 else 0.0
+    wallTime = report['wallTime']
+    print("--------------------------------------------")
+    print("Total: Frames: {} Detections: {} ({}% success rate)".format(totalFrameCount, totalDetections, totalSuccess))
+    print("Time: {:.1f}s wall, {:.1f}s in workers ({:.1f}x), {:.1f} fps".format(wallTime, totalSeconds, totalSeconds / wallTime if wallTime > 0 else 0.0, totalFrameCount / wallTime if wallTime > 0 else 0.0))
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Run the pipeline over many videos on all cores")
+    parser.add_argument("manifest", nargs="?", default=None, help="JSON manifest (default: the sequences of SIGBTests.py)")
+    parser.add_argument("-d", "--directory", default="Sequences", help="where the videos are")
+    parser.add_argument("-p", "--processes", type=int, default=None, help="number of worker processes (default: number of cores)")
+    parser.add_argument("-c", "--chunk-size", type=int, default=50, help="max number of frames per unit")
+    parser.add_argument("-r", "--results", default=None, help="write the images with the results drawn in to this directory")
+    parser.add_argument("-o", "--output", default=None, help="write the report as JSON")
+    args = parser.parse_args()
+
+    if args.manifest is None:
+        from SIGBTests import sequences
+        manifest = sequences
+    else:
+        manifest = loadManifest(args.manifest)
+
+    report = runJobs(manifest, args.directory, processes=args.processes, chunkSize=args.chunk_size, resultDirectory=args.results)
+    printJobsReport(report)
+
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2, sort_keys=True)
@@ -0,0 +1,339 @@
+from __future__ import print_function
+import cv2
+import time
+import threading
+import numpy as np
+from collections import deque
+from SIGBCompat import CAP_PROP_FPS, getFourCC
+
+# Live processing of a camera stream
+# Capture, detection and display run concurrently: a capture thread reads the
+# camera into a small queue, a worker thread takes the newest frame from it and
+# runs the detection, and the thread that owns the windows (the consumer)
+# displays and records the results. When the detection is slower than the
+# camera the oldest waiting frames are dropped, so the shown result is never
+# more than a couple of frames behind the camera. When the capture or the
+# detection raises, its thread stops, the pipeline finishes and the consumer
+# re-raises the exception with raiseError().
+#
+# Usage:
+#    > python SIGBLive.py 1
+#    > python SIGBLive.py Sequences/eye1.avi --output live.avi
+
+class FrameQueue:
+    '''Bounded queue dropping the oldest item when full
+
+    Thread safe, one or more producers and consumers
+
+    Counters:
+        dropped: items that were dropped because the queue was full
+    '''
+    def __init__(self, maxSize=2):
+        '''
+        Params:
+            maxSize (int): max number of waiting items
+        '''
+        self.maxSize = maxSize
+        self.items = deque()
+        self.condition = threading.Condition()
+        self.closed = False
+        self.dropped = 0
+
+    def put(self, item):
+        '''
+        Add item, dropping the oldest waiting one when the queue is full
+        '''
+        with self.condition:
+            if len(self.items) >= self.maxSize:
+                self.items.popleft()
+                self.dropped += 1
+
+            self.items.append(item)
+            self.condition.notify()
+
+    def get(self, timeout=None):
+        '''
+        Take the oldest waiting item
+
+        Params:
+            timeout (float): seconds to wait for an item, forever when None
+
+        Returns:
+            the item, None when there was nothing to take in time
+        '''
+        with self.condition:
+            if len(self.items) == 0 and not self.closed:
+                self.condition.wait(timeout)
+
+            if len(self.items) == 0:
+                return None
+
+            return self.items.popleft()
+
+    def close(self):
+        '''
+        Nothing else will be put in, wakes up waiting consumers
+        '''
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+
+    def isFinished(self):
+        '''
+        Returns:
+            (bool) closed and empty
+        '''
+        with self.condition:
+            return self.closed and len(self.items) == 0
+
+class LivePipeline:
+    '''Runs capture and detection on two threads, hands results to the consumer
+
+    The consumer (the thread showing the windows, OpenCV wants all the GUI
+    calls in one thread) polls getResult() and calls displayed() once the
+    result is on screen, which measures the latency from capture to display.
+    Values the detection depends on, like the slider positions, are read by
+    the consumer and passed in through setParams(), the worker never touches
+    the GUI.
+
+    error: exception that stopped the capture or worker thread, None when
+        they did not fail, see raiseError()
+
+    Counters:
+        capturedCount: frames read from the capture
+        processedCount: frames the detection ran on
+        displayedCount: results reported by displayed()
+        frames.dropped: captured frames dropped before the detection
+        results.dropped: results dropped before the consumer took them
+
+    Example:
+        live = LivePipeline(cv2.VideoCapture(1), process)
+        live.start()
+        while not live.isFinished():
+            item = live.getResult(0.1)
+            if item is not None:
+                frameId, captureTime, image, result = item
+                cv2.imshow("Results", result)
+                live.displayed(captureTime)
+            cv2.waitKey(1)
+        live.stop()
+        live.raiseError()
+    '''
+    def __init__(self, capture, process, queueSize=1, latencyWindow=300):
+        '''
+        Params:
+            capture (cv2.VideoCapture): opened capture, anything with read()
+            process (function): process(image, params) -> result, runs on the worker thread
+            queueSize (int): max number of frames waiting for the detection
+                             and results waiting for the consumer
+            latencyWindow (int): number of latest latencies kept for getStats()
+        '''
+        self.capture = capture
+        self.process = process
+
+        self.frames = FrameQueue(queueSize)
+        self.results = FrameQueue(queueSize)
+
+        self.params = dict()
+        self.running = False
+        self.threads = []
+        self.error = None
+
+        self.capturedCount = 0
+        self.processedCount = 0
+        self.displayedCount = 0
+        self.latencies = deque(maxlen=latencyWindow)
+        self.startTime = None
+
+    def start(self):
+        '''
+        Start the capture and worker threads
+        '''
+        self.running = True
+        self.startTime = time.time()
+        self.threads = [threading.Thread(target=self.captureLoop), threading.Thread(target=self.processLoop)]
+
+        for thread in self.threads:
+            thread.daemon = True
+            thread.start()
+
+    def stop(self):
+        '''
+        Stop the threads and wait for them to finish
+        '''
+        self.running = False
+        self.frames.close()
+        self.results.close()
+
+        for thread in self.threads:
+            thread.join()
+
+    def setParams(self, params):
+        '''
+        Parameters passed to process() for the next frames
+
+        Params:
+            params (dict): e.g. slider values, read on the consumer thread
+        '''
+        self.params = dict(params)
+
+    def raiseError(self):
+        '''
+        Raise the exception that stopped the capture or worker thread in the
+        consumer, call it once the pipeline is finished. Does nothing when
+        they did not fail
+        '''
+        if self.error is not None:
+            raise self.error
+
+    def captureLoop(self):
+        # the queue is closed however the loop ends, so the worker stops too
+        try:
+            frameId = 0
+            while self.running:
+                retval, image = self.capture.read()
+                if not retval or image is None:
+                    break
+
+                self.frames.put((frameId, time.time(), image))
+                self.capturedCount += 1
+                frameId += 1
+        except Exception as e:
+            self.error = e
+            self.running = False
+        finally:
+            self.frames.close()
+
+    def processLoop(self):
+        # the queue is closed however the loop ends, so the consumer stops too
+        try:
+            while self.running:
+                item = self.frames.get(0.1)
+                if item is None:
+                    if self.frames.isFinished():
+                        break
+                    continue
+
+                frameId, captureTime, image = item
+                result = self.process(image, self.params)
+
+                self.results.put((frameId, captureTime, image, result))
+                self.processedCount += 1
+        except Exception as e:
+            self.error = e
+            self.running = False
+        finally:
+            self.results.close()
+
+    def getResult(self, timeout=None):
+        '''
+        Take the oldest result waiting for the consumer
+
+        Params:
+            timeout (float): seconds to wait, forever when None
+
+        Returns:
+            (frameId, captureTime, image, result) or None when nothing came in time
+        '''
+        return self.results.get(timeout)
+
+    def displayed(self, captureTime):
+        '''
+        Report that the result of the frame captured at captureTime has been shown
+
+        Params:
+            captureTime (float): from getResult()
+        '''
+        self.latencies.append((time.time() - captureTime) * 1000.0)
+        self.displayedCount += 1
+
+    def isFinished(self):
+        '''
+        Returns:
+            (bool) the capture ended and all results have been taken
+        '''
+        return self.results.isFinished()
+
+    def getStats(self):
+        '''
+        Returns:
+            dict with the counters, fps of the displayed results and the
+            latency (ms) from capture to display over the latest frames
+        '''
+        elapsed = time.time() - self.startTime if self.startTime is not None else 0.0
+        latencies = np.array(self.latencies)
+
+        stats = {
+            'captured': self.capturedCount,
+            'processed': self.processedCount,
+            'displayed': self.displayedCount,
+            'droppedFrames': self.frames.dropped,
+            'droppedResults': self.results.dropped,
+            'fps': self.displayedCount / elapsed if elapsed > 0 else 0.0
+        }
+
+        if len(latencies) > 0:
+            stats['latencyMean'] = float(latencies.mean())
+            stats['latencyP95'] = float(np.percentile(latencies, 95))
+            stats['latencyMax'] = float(latencies.max())
+
+        return stats
+
+def printStats(stats):
+    '''
+    Print the output of LivePipeline.getStats()
+    '''
+    print("Captured: {captured} Processed: {processed} Displayed: {displayed} Dropped frames: {droppedFrames} Dropped results: {droppedResults} ({fps:.1f} fps)".format(**stats))
+    if 'latencyMean' in stats:
+        print("Latency capture -> display: mean {latencyMean:.1f} ms, p95 {latencyP95:.1f} ms, max {latencyMax:.1f} ms".format(**stats))
+
+if __name__ == "__main__":
+    import argparse
+    from SIGBSolutions import FrameContext, PupilTracker, getEye, drawEye
+
+    parser = argparse.ArgumentParser(description="Track the eye in a live camera stream")
+    parser.add_argument("source", help="camera index or video file")
+    parser.add_argument("-o", "--output", default=None, help="record the results into this video")
+    parser.add_argument("-q", "--queue", type=int, default=1, help="max frames waiting for the detection")
+    parser.add_argument("--headless", action="store_true", help="do not show the results")
+    args = parser.parse_args()
+
+    capture = cv2.VideoCapture(int(args.source) if args.source.isdigit() else args.source)
+    tracker = PupilTracker()
+
+    def process(image, params):
+        eye = getEye(FrameContext(image), tracker)
+        return drawEye(np.copy(image), eye)
+
+    live = LivePipeline(capture, process, queueSize=args.queue)
+    writer = None
+
+    live.start()
+    while not live.isFinished():
+        item = live.getResult(0.1)
+
+        if item is not None:
+            frameId, captureTime, image, result = item
+
+            if args.output is not None:
+                if writer is None:
+                    size = (result.shape[1], result.shape[0])
+                    fps = capture.get(CAP_PROP_FPS) or 30
+                    writer = cv2.VideoWriter(args.output, getFourCC("XVID"), fps, size)
+                writer.write(result)
+
+            if not args.headless:
+                cv2.imshow("Results", result)
+
+            live.displayed(captureTime)
+
+        if not args.headless and cv2.waitKey(1) == 27:
+            break
+
+    live.stop()
+    capture.release()
+    if writer is not None:
+        writer.release()
+
+    printStats(live.getStats())
+    live.raiseError()
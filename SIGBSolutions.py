@@ -1,6 +1,7 @@
 import cv2
+import SIGBTrace
 from SIGBTools import *
-import operator
+from SIGBCompat import HOUGH_GRADIENT
 
 ######################################################################
 #
@@ -8,54 +9,202 @@ import operator
 #
 ######################################################################
 
-def getPupilCandidates(image):
+def getPupilCandidates(image, imageArea=None, method="contours", maxAxesDifference=15):
     '''
-    Applies cv2.findContours to binary image, then filters the contours
+    Applies cv2.findContours (or cv2.connectedComponentsWithStats, see
+    method) to binary image, then filters the contours
     and sorts them to get best guesses for pupil locations. Lastly,
     applies ellipse fitting to those contours and returns sorted list
     of ellipses that are good pupil candidates
     
     Params:
         image (numpy array): Binary image
+        imageArea (int): area the size filter is relative to, defaults to
+                         the area of image (pass the frame area for a crop)
+        method (string): blob extraction backend, see SIGBTools.getBlobs()
+        maxAxesDifference (float): ellipses whose axes differ by more pixels
+                                   are too elliptical, scale it with the image
     
     Returns:
         pupils (list): sorted list of pupil ellipses
     '''
-    def orderPupilCandidates(pupil):
-        c = ContourTools(pupil)
-        return c.getExtend()
+    if imageArea is None:
+        imageArea = image.shape[0] * image.shape[1]
 
-    contours, hierarchy = cv2.findContours(image, cv2.RETR_LIST, cv2.CHAIN_APPROX_SIMPLE)
+    batch = getBlobs(image, method)
+    SIGBTrace.count("pupils.contours", len(batch))
 
-    imageArea = image.shape[0] * image.shape[1]
-
-    candidates = []
-    # first filter contours
-    for contour in contours:
-        c = ContourTools(contour)
-        area = c.getArea()
+    # first filter contours, out too small or too big
+    batch = batch.filter((batch.area >= imageArea * 0.002) & (batch.area <= imageArea * 0.3))
 
-        # Filter out too small or too big
-        if area < imageArea * 0.002 or area > imageArea * 0.3: continue
+    SIGBTrace.count("pupils.contoursInArea", len(batch))
 
-        candidates.append(c.getConvexHull())
-
-    candidates = sorted(candidates, key=orderPupilCandidates, reverse=True)
+    # most filled convex hulls first, a stable sort keeps ties in contour order
+    candidates = ContourBatch(batch.getConvexHulls())
+    candidates = candidates.filter(np.argsort(-candidates.extent, kind="mergesort"))
 
     pupils = []
     # second filter ellipses fitted to those contours
-    for candidate in candidates:
+    for candidate in candidates.contours:
         if len(candidate) < 5: continue
         pupil = cv2.fitEllipse(candidate)
 
         # Filter out too elliptical
-        if abs(pupil[1][0] - pupil[1][1]) > 15: continue
+        if abs(pupil[1][0] - pupil[1][1]) > maxAxesDifference: continue
 
         pupils.append(pupil)
 
+    SIGBTrace.count("pupils.candidates", len(pupils))
+
     return pupils
 
-def getPupils(image, kmeansFeatureCount=5, kmeansDistanceWeight=14, show=False):
+def getPupilsForThreshold(gray, threshold, region=None, imageArea=None, show=False, blobMethod="contours", openSize=8, buffers=None, maxAxesDifference=15):
+    '''
+    Threshold the equalized grayscale image, clean it up using morphologic
+    opening and return the pupil candidates found in it
+    
+    Params:
+        gray (numpy array): equalized grayscale image
+        threshold (float): intensity threshold separating the pupil
+        region (tuple (x, y, width, height)): only search this part of the image,
+                                              the whole image when None
+        imageArea (int): area the candidate size filter is relative to,
+                         defaults to the area of gray
+        show (bool): show partial results
+        blobMethod (string): blob extraction backend, see SIGBTools.getBlobs()
+        openSize (int): size of the morphologic opening, see getOpen()
+        buffers (BufferPool): threshold and open into the arrays of this pool
+        maxAxesDifference (float): ellipticity limit in pixels of gray, see getPupilCandidates()
+    
+    Returns:
+        list of pupil ellipses in the coordinates of gray
+    '''
+    offset = (0, 0)
+    if imageArea is None:
+        imageArea = gray.shape[0] * gray.shape[1]
+    if buffers is None:
+        buffers = BufferPool.none
+
+    capacity = gray.size
+
+    if region is not None:
+        x, y, width, height = region
+        gray = gray[y:y + height, x:x + width]
+        offset = (x, y)
+
+    retval, thresh = cv2.threshold(gray, threshold, 255, cv2.THRESH_BINARY, dst=buffers.get("pupilThreshold", gray.shape, capacity=capacity))
+
+    if show:
+        cv2.namedWindow("Thresh")
+        cv2.imshow("Thresh", thresh)
+
+    # Cleanup using closing
+    closed = getOpen(thresh, openSize, dst=buffers.get("pupilOpen", gray.shape, capacity=capacity))
+    if show:
+        cv2.namedWindow("Closed")
+        cv2.imshow("Closed", closed)
+
+    pupils = getPupilCandidates(closed, imageArea, method=blobMethod, maxAxesDifference=maxAxesDifference)
+
+    if offset != (0, 0):
+        pupils = [((center[0] + offset[0], center[1] + offset[1]), axes, angle) for center, axes, angle in pupils]
+
+    return pupils
+
+def getPupilKMeans(context, kmeansFeatureCount=5, kmeansDistanceWeight=14, kmeansMethod="scipy", vignette=False, initial=None):
+    '''
+    k-means of the equalized frame the pupil thresholds are taken from,
+    memoized by the context
+    
+    Params:
+        context (FrameContext): frame to perform pupil detection on
+        kmeansFeatureCount (int): sub param for kmeans
+        kmeansDistanceWeight (int): sub param for kmeans
+        kmeansMethod (string): k-means backend, see SIGBTools.kmeansMethods
+        vignette (bool): brighten the borders of the image using applyGradient()
+        initial (numpy array): initial centroids, e.g. of the previous frame
+    
+    Returns:
+        (centroids, variance)
+    '''
+    return context.getKMeans(featureCount=kmeansFeatureCount, distanceWeight=kmeansDistanceWeight, smallSize=(100, 75), equalized=True, method=kmeansMethod, vignette=vignette, initial=initial)
+
+def getPupilThresholds(context, kmeansFeatureCount=5, kmeansDistanceWeight=14, kmeansMethod="scipy", vignette=False, initial=None):
+    '''
+    Thresholds to try for the pupil, best guess first
+    
+    k-means runs only once, with kmeansFeatureCount clusters. The first
+    threshold is its darkest centroid, thresholds for fewer clusters (down to 3)
+    are derived from the same clustering by merging clusters, see
+    getKMeansHierarchy()
+    
+    Params:
+        context (FrameContext): frame to perform pupil detection on
+        kmeansFeatureCount (int): sub param for kmeans
+        kmeansDistanceWeight (int): sub param for kmeans
+        kmeansMethod (string): k-means backend, see SIGBTools.kmeansMethods
+        vignette (bool): brighten the borders of the image using applyGradient()
+        initial (numpy array): initial k-means centroids, see getPupilKMeans()
+    
+    Returns:
+        generator of thresholds, without duplicates
+    '''
+    if kmeansFeatureCount < 3: return
+
+    centroids, variance = getPupilKMeans(context, kmeansFeatureCount, kmeansDistanceWeight, kmeansMethod, vignette, initial)
+
+    # same features k-means was run on, memoized by the context
+    features = context.getKMeansFeatures(distanceWeight=kmeansDistanceWeight, smallSize=(100, 75), equalized=True, vignette=vignette)
+    hierarchy = getKMeansHierarchy(features, centroids, minCount=3)
+
+    # Lower the number of clusters until min kmeans is reached
+    thresholds = []
+    for centroids in hierarchy:
+        if len(centroids) < 3: break
+
+        threshold = min(centroid[0] for centroid in centroids)
+
+        # merging brighter clusters does not change the darkest one
+        if threshold in thresholds: continue
+        thresholds.append(threshold)
+        SIGBTrace.count("pupils.thresholdsTried")
+
+        yield threshold
+
+def getPupilsWithThreshold(image, kmeansFeatureCount=5, kmeansDistanceWeight=14, show=False, kmeansMethod="scipy", vignette=False, blobMethod="contours", initial=None):
+    '''
+    Same as getPupils(), but also returns the threshold that was used
+    
+    The thresholds from getPupilThresholds() are tried in turn until
+    something is found
+    
+    Params:
+        image (numpy array or FrameContext): image to perform pupil detection on (BGR)
+        kmeansFeatureCount (int): sub param for kmeans
+        kmeansDistanceWeight (int): sub param for kmeans
+        show (bool): show partial results
+        kmeansMethod (string): k-means backend, see SIGBTools.kmeansMethods
+        vignette (bool): brighten the borders of the image using applyGradient()
+        blobMethod (string): blob extraction backend, see SIGBTools.getBlobs()
+        initial (numpy array): initial k-means centroids, see getPupilKMeans()
+    
+    Returns:
+        (pupils, threshold): list of pupil ellipses and the threshold that found them,
+                             threshold is None when nothing was found
+    '''
+    context = getFrameContext(image)
+
+    gray = context.getEqualized(vignette)
+
+    for threshold in getPupilThresholds(context, kmeansFeatureCount, kmeansDistanceWeight, kmeansMethod, vignette, initial):
+        pupils = getPupilsForThreshold(gray, threshold, show=show, blobMethod=blobMethod, buffers=context.buffers)
+
+        if len(pupils) > 0:
+            return pupils, threshold
+
+    return [], None
+
+def getPupils(image, kmeansFeatureCount=5, kmeansDistanceWeight=14, show=False, kmeansMethod="scipy", vignette=False, blobMethod="contours"):
     '''
     Given an image perform kmeans detection, threshold it and perform
     blob analysis to determine pupil candidates, and sort them using
@@ -64,57 +213,119 @@ def getPupils(image, kmeansFeatureCount=5, kmeansDistanceWeight=14, show=False):
     pupil candidates
     
     Params:
-        image (numpy array): image to perform pupil detection on (BGR)
+        image (numpy array or FrameContext): image to perform pupil detection on (BGR)
         kmeansFeatureCount (int): sub param for kmeans
         kmeansDistanceWeight (int): sub param for kmeans
         show (bool): show partial results
+        kmeansMethod (string): k-means backend, see SIGBTools.kmeansMethods
+        vignette (bool): brighten the borders of the image using applyGradient(),
+                         counters black borders causing false detects
+        blobMethod (string): blob extraction backend, see SIGBTools.getBlobs()
     
     Returns:
         list of ellipse positions that are good guess for a pupil location
         
     '''
-    if kmeansFeatureCount < 3: return []
+    pupils, threshold = getPupilsWithThreshold(image, kmeansFeatureCount=kmeansFeatureCount, kmeansDistanceWeight=kmeansDistanceWeight, show=show, kmeansMethod=kmeansMethod, vignette=vignette, blobMethod=blobMethod)
 
-    gray = getGray(image)
-    gray = cv2.equalizeHist(gray)
-#    gray = applyGradient(gray)
+    return pupils
 
-    centroids, variance = getKMeans(gray, featureCount=kmeansFeatureCount, distanceWeight=kmeansDistanceWeight, smallSize=(100, 75), show=False)
+def getPupilsPyramid(image, levels=1, kmeansFeatureCount=5, kmeansDistanceWeight=14, show=False, kmeansMethod="scipy", vignette=False, blobMethod="contours", margin=1.0):
+    '''
+    Coarse to fine version of getPupils(). The candidates are searched for in
+    the equalized image reduced levels times by cv2.pyrDown, with the opening
+    kernel and the ellipticity limit reduced accordingly, so the scaled up
+    candidates pass the same filter as the full resolution ones. Only the
+    best candidate is refined at full resolution, in a window around it, so
+    the expensive full resolution morphology runs on a small crop. The other
+    candidates are scaled up
+    
+    Params:
+        image (numpy array or FrameContext): image to perform pupil detection on (BGR)
+        levels (int): number of pyramid levels, every level halves the size, 0 is getPupils()
+        kmeansFeatureCount (int): sub param for kmeans
+        kmeansDistanceWeight (int): sub param for kmeans
+        show (bool): show partial results
+        kmeansMethod (string): k-means backend, see SIGBTools.kmeansMethods
+        vignette (bool): brighten the borders of the image using applyGradient()
+        blobMethod (string): blob extraction backend, see SIGBTools.getBlobs()
+        margin (float): size of the refinement window in multiples of the pupil size
+    
+    Returns:
+        list of ellipse positions that are good guess for a pupil location
+    '''
+    if levels <= 0:
+        return getPupils(image, kmeansFeatureCount=kmeansFeatureCount, kmeansDistanceWeight=kmeansDistanceWeight, show=show, kmeansMethod=kmeansMethod, vignette=vignette, blobMethod=blobMethod)
 
-    centroids = sorted(centroids, key=lambda centroid: centroid[0])
+    context = getFrameContext(image)
 
-    pupils = []
-    retval, gray = cv2.threshold(gray, centroids[0][0], 255, cv2.cv.CV_THRESH_BINARY)
+    gray = context.getEqualized(vignette)
+    imageArea = gray.shape[0] * gray.shape[1]
 
-    if show:
-        cv2.namedWindow("Thresh")
-        cv2.imshow("Thresh", gray)
+    small = gray
+    for level in range(levels):
+        small = cv2.pyrDown(small)
 
-    # Cleanup using closing
-    closed = getOpen(gray, 8)
-    if show:
-        cv2.namedWindow("Closed")
-        cv2.imshow("Closed", closed)
+    scale = float(gray.shape[1]) / small.shape[1]
+    openSize = max(1, int(round(8 / scale)))
+    # the 15 pixels of getPupilCandidates() at full resolution
+    maxAxesDifference = 15 / scale
 
-    pupils = getPupilCandidates(closed)
+    for threshold in getPupilThresholds(context, kmeansFeatureCount, kmeansDistanceWeight, kmeansMethod, vignette):
+        candidates = getPupilsForThreshold(small, threshold, show=show, blobMethod=blobMethod, openSize=openSize, buffers=context.buffers, maxAxesDifference=maxAxesDifference)
 
-    # Iteratively call itself with lower kmeans until something is found or min kmeans is reached
-    if len(pupils) == 0:
-        return getPupils(image, kmeansFeatureCount=kmeansFeatureCount - 1, kmeansDistanceWeight=kmeansDistanceWeight, show=show)
+        if len(candidates) == 0: continue
 
-    return pupils
+        candidates = [((center[0] * scale, center[1] * scale), (axes[0] * scale, axes[1] * scale), angle) for center, axes, angle in candidates]
+        SIGBTrace.count("pupils.pyramidCandidates", len(candidates))
+
+        center, axes, angle = candidates[0]
+        region = getCircleRegion(center, margin * max(axes), gray.shape)
 
-def drawPupils(image, pupils):
+        pupils = getPupilsForThreshold(gray, threshold, region, imageArea=imageArea, blobMethod=blobMethod, buffers=context.buffers)
+
+        # the coarse ellipse is still a good guess when the window misses
+        if len(pupils) == 0:
+            SIGBTrace.count("pupils.pyramidUnrefined")
+            return candidates
+
+        return pupils + candidates[1:]
+
+    return []
+
+def getDrawTarget(image, output=None):
+    '''
+    Image the draw functions draw into
+    
+    Params:
+        image (numpy array): image to draw
+        output (numpy array): array of the same shape as image (e.g. from a
+                              BufferPool), image is copied into it
+    
+    Returns:
+        output with image copied in, image itself when output is None
+    '''
+    if output is None:
+        return image
+
+    output[...] = image
+
+    return output
+
+def drawPupils(image, pupils, output=None):
     '''
     Draws ellipses into the image
     
     Params:
         image (numpy array): color image to draw to
         pupils (list ellipses): output of getPupils()
+        output (numpy array): draw into this array instead, see getDrawTarget()
     
     Returns:
         image (numpy array) with pupils drawn in
     '''
+    image = getDrawTarget(image, output)
+
     for pupil in pupils:
         cv2.ellipse(image, pupil, (255, 0, 0))
 
@@ -125,28 +336,220 @@ def drawPupils(image, pupils):
 
     return image
 
+######################################################################
+#
+#    Pupil Tracking
+#
+######################################################################
+
+class PupilTracker:
+    '''Tracks the pupil through a continuous video
+    
+    Wraps getPupils(). Once a pupil has been found, the following frames
+    are only searched in a region around the last pupil ellipse, using the
+    threshold that found it, so no kmeans is needed and the morphology and
+    contour search only run on a small crop. When the pupil is not found
+    in the region, or the confidence of the match is too low, tracking is
+    lost and the tracker falls back to full frame detection with getPupils().
+    With warmStart, the k-means of a full frame detection starts from the
+    centroids of the previous one instead of from scratch.
+    
+    Counters:
+        frameCount: frames processed
+        trackedCount: frames where the pupil was found by tracking
+        fallbackCount: frames where full frame detection had to run
+        lostCount: frames where tracking was attempted but lost
+        confidence: confidence of the last tracked pupil (0 - 1), 1 after full frame detection
+    
+    Example:
+        tracker = PupilTracker()
+        for frame in frames:
+            pupils = tracker.getPupils(frame)
+    '''
+    def __init__(self, kmeansFeatureCount=5, kmeansDistanceWeight=14, margin=2.0, minConfidence=0.5, kmeansMethod="scipy", vignette=False, blobMethod="contours", warmStart=False):
+        '''
+        Params:
+            kmeansFeatureCount (int): sub param for kmeans used by full frame detection
+            kmeansDistanceWeight (int): sub param for kmeans used by full frame detection
+            margin (float): size of the search region in multiples of the pupil size
+            minConfidence (float): tracked pupils with lower confidence count as lost
+            kmeansMethod (string): k-means backend used by full frame detection
+            vignette (bool): brighten the borders of the image, see getPupils()
+            blobMethod (string): blob extraction backend, see SIGBTools.getBlobs()
+            warmStart (bool): initialize k-means with the centroids of the last full frame detection
+        '''
+        self.kmeansFeatureCount = kmeansFeatureCount
+        self.kmeansDistanceWeight = kmeansDistanceWeight
+        self.kmeansMethod = kmeansMethod
+        self.vignette = vignette
+        self.blobMethod = blobMethod
+        self.margin = margin
+        self.minConfidence = minConfidence
+        self.warmStart = warmStart
+
+        # kept by reset(), the intensities of the eye change less than its position
+        self.centroids = None
+
+        self.frameCount = 0
+        self.trackedCount = 0
+        self.fallbackCount = 0
+        self.lostCount = 0
+
+        self.reset()
+
+    def reset(self):
+        '''
+        Forget the tracked pupil, next frame will use full frame detection
+        '''
+        self.pupil = None
+        self.threshold = None
+        self.confidence = 0.0
+
+    def getPupils(self, image):
+        '''
+        Find pupils in the next frame of the video
+        
+        Params:
+            image (numpy array or FrameContext): next frame (BGR)
+        
+        Returns:
+            list of ellipse positions that are good guess for a pupil location
+        '''
+        context = getFrameContext(image)
+        self.frameCount += 1
+
+        pupils = []
+        if self.pupil is not None:
+            pupils = self.track(context)
+
+            if len(pupils) > 0:
+                self.trackedCount += 1
+                SIGBTrace.count("tracker.tracked")
+            else:
+                self.lostCount += 1
+                SIGBTrace.count("tracker.lost")
+
+        if len(pupils) == 0:
+            self.fallbackCount += 1
+            SIGBTrace.count("tracker.fallbacks")
+            initial = self.centroids if self.warmStart else None
+            if initial is not None:
+                SIGBTrace.count("tracker.warmStarts")
+
+            pupils, threshold = getPupilsWithThreshold(context, kmeansFeatureCount=self.kmeansFeatureCount, kmeansDistanceWeight=self.kmeansDistanceWeight, kmeansMethod=self.kmeansMethod, vignette=self.vignette, blobMethod=self.blobMethod, initial=initial)
+
+            if self.warmStart:
+                # memoized by the context, k-means does not run again
+                centroids, variance = getPupilKMeans(context, self.kmeansFeatureCount, self.kmeansDistanceWeight, self.kmeansMethod, self.vignette)
+
+                # clusters that ended up empty were dropped, start from scratch then
+                self.centroids = centroids if len(centroids) == self.kmeansFeatureCount else None
+
+            if len(pupils) == 0:
+                self.reset()
+                return pupils
+
+            self.threshold = threshold
+            self.confidence = 1.0
+
+        self.pupil = pupils[0]
+
+        return pupils
+
+    def track(self, context):
+        '''
+        Search for the pupil in the region around the last pupil
+        
+        Params:
+            context (FrameContext): the frame to search
+        
+        Returns:
+            list of pupil ellipses, empty when tracking was lost
+        '''
+        gray = context.getEqualized(self.vignette)
+        height, width = gray.shape
+
+        pupils = getPupilsForThreshold(gray, self.threshold, self.getRegion(gray.shape), imageArea=width * height, blobMethod=self.blobMethod, buffers=context.buffers)
+        if len(pupils) == 0:
+            return pupils
+
+        confidence = self.getConfidence(pupils[0])
+        if confidence < self.minConfidence:
+            return []
+
+        self.confidence = confidence
+        SIGBTrace.record("tracker.confidence", confidence)
+
+        return pupils
+
+    def getRegion(self, shape):
+        '''
+        Search region around the last pupil
+        
+        Params:
+            shape (tuple (height, width)): shape of the frame
+        
+        Returns:
+            (x, y, width, height) of the region, clipped to the frame
+        '''
+        center, axes, angle = self.pupil
+
+        return getCircleRegion(center, self.margin * max(axes), shape)
+
+    def getConfidence(self, pupil):
+        '''
+        How well does pupil match the last pupil? Penalizes movement relative
+        to the pupil size and changes in the pupil area
+        
+        Params:
+            pupil (ellipse): newly found pupil
+        
+        Returns:
+            (float) confidence 0 - 1
+        '''
+        (lx, ly), lastAxes, lastAngle = self.pupil
+        (x, y), axes, angle = pupil
+
+        lastSize = max(1.0, (lastAxes[0] + lastAxes[1]) / 2)
+        shift = sqrt((x - lx) ** 2 + (y - ly) ** 2) / lastSize
+
+        lastArea = max(1.0, lastAxes[0] * lastAxes[1])
+        area = max(1.0, axes[0] * axes[1])
+        areaRatio = min(area, lastArea) / max(area, lastArea)
+
+        return max(0.0, 1.0 - shift) * areaRatio
+
 ######################################################################
 #
 #    Iris Detection
 #
 ######################################################################
 
-def getIrisForPupil(image, pupil, show=False):
+def getIrisForPupil(image, pupil, show=False, rayCount=30, radiusResolution=10):
     '''
     Find the best iris radius for a given pupil. Always assumes there is one,
     so it will very likely return a result. But can also return a None, when
     there is absolutely no indication of an iris.
     
+    Casts rays from in between the pupil and iris edge outwards, samples
+    the gradient along all of them at once and lets every sample with the
+    right magnitude and orientation vote for an iris radius.
+    
     Params:
-        image (numpy array): color image to use
+        image (numpy array or FrameContext): color image to use
         pupil (ellipse): location of a pupil
         show (bool): show partial resutls
+        rayCount (int): how many rays to cast from the pupil
+        radiusResolution (int): radius votes are rounded to multiples of this
     
     Returns:
         (center, radius) for the detected iris, center is the same as center of the pupil
     '''
-    gray = getGray(image)
-    orientation, magnitude = getOrientationAndMagnitude(gray, show=False)
+    context = getFrameContext(image)
+    image = context.image
+
+    orientation, magnitude = context.getOrientationAndMagnitude()
+    height, width = magnitude.shape
 
     # pupil, and therefore also iris center
     center = (int(pupil[0][0]), int(pupil[0][1]))
@@ -156,104 +559,77 @@ def getIrisForPupil(image, pupil, show=False):
     # max pupil radius will be at most 5 times pupil radius
     irisRadius = 5 * pupilRadius
 
-    # 30 points laying between pupil and iris
-    pupilSamples = getCircleSamples(center, min(irisRadius * 0.5, pupilRadius * 2))
-
-    # 30 points laying on a circle that is bigger than iris
-    irisSamples = getCircleSamples(center, irisRadius)
-
-    # vote dict for different radii
-    finalIrisRadiusVotes = dict()
+    # rays starting in between pupil and iris and ending on a circle that is bigger than iris,
+    # each of them has the direction of the normal for the iris circle
+    starts, ends, X, Y, valid = getRaySamples(center, min(irisRadius * 0.5, pupilRadius * 2), irisRadius, rayCount)
 
-    # for each sample point in the concentric circle that lies between pupil and iris
-    for sample in range(len(pupilSamples)):
-        # starting point for a line that goes from in between pupil and iris edge
-        pupilSample = (int(pupilSamples[sample][0]), int(pupilSamples[sample][1]))
-        # ending point for the line that ends at 5x pupil radius from the pupil center
-        irisSample = (int(irisSamples[sample][0]), int(irisSamples[sample][1]))
+    # angle of the normal vector for each ray
+    normals = (starts - center).astype(np.float32)
+    angles = cv2.phase(normals[:, 0], normals[:, 1], angleInDegrees=True).reshape(-1, 1)
+    angles = np.repeat(angles, X.shape[1], axis=1)
 
-        # line defined by pupilSample and irisSample points has the direction of
-        # the normal for the iris circle
+    # drop the padding and the samples that are outside of the image, the gradient
+    # is read one pixel up and left of each sample as it always has been
+    valid &= (X >= 1) & (X <= width) & (Y >= 1) & (Y <= height)
+    X = X[valid]
+    Y = Y[valid]
+    angles = angles[valid]
 
-        # points in the image that lay on the line
-        lineCoordinates = getLineCoordinates(pupilSample, irisSample)
+    mag = magnitude[Y - 1, X - 1]
+    ori = orientation[Y - 1, X - 1]
 
-        # normal vector for the pupil/iris circles
-        sampleVector = (pupilSample[0] - center[0], pupilSample[1] - center[1])
+    # cleanup the angle so that it is a comparable number to the angle of the ray
+    an = angles + ori - 90.0
+    an = np.where(an > 360.0, an - 360.0, an)
 
-        # length of the normal vector
-        dist = sqrt(sampleVector[0] ** 2 + sampleVector[1] ** 2)
+    # only consider those points that have magnitude greater than 15 but lower than 30
+    # since the gradient is a slow one, angle difference should be +-3 degrees
+    good = (mag > 15) & (mag < 30) & ((an < 3) | (an > 357))
+    X = X[good]
+    Y = Y[good]
 
-        # angle of the normal vector
-        angle = cv2.fastAtan2(sampleVector[1], sampleVector[0])
-
-        # loop over all the points on the line
-        for s in lineCoordinates:
-            # sometimes the line is outside the magnitude arrays, in that case just conitnue the loop
-            try:
-                mag = magnitude[s[1] - 1][s[0] - 1]
-            except:
-                continue
-
-            # only consider those points that have magnitude greater than 15 but lower than 30
-            # since the gradient is a slow one
-            if mag > 15 and mag < 30:
-                # orientation at the point in question
-                ori = orientation[s[1] - 1][s[0] - 1]
-
-                # cleanup the angle so that it is a comparable number to the angle of the line we've
-                # obtained earlier
-                an = angle + ori - 90.0
-                if an > 360.0: an -= 360.0
-
-                # angle difference should be +-3 degrees
-                if an < 3 or an > 357:
-                    # we have a good sample point with the right magnitude and orientation
-                    # calculate the radius of the iris this would correspond to
-                    radius = sqrt((s[0] - center[0]) ** 2 + (s[1] - center[1]) ** 2)
-                    # Round radius to tens
-                    radius = round(radius / 10.0) * 10.0
-                    radius = int(radius)
-
-                    # draw the sample that we have used
-                    if show:
-                        cv2.circle(image, (s[0], s[1]), 2, (255, 255, 0), 2)
-
-                    # add the radius to the vote dict
-                    if radius not in finalIrisRadiusVotes:
-                        finalIrisRadiusVotes[radius] = 0
-
-                    finalIrisRadiusVotes[radius] += 1
-
-        # draw the line
-        if show:
-            cv2.line(image, pupilSample, irisSample, (0, 255, 0))
+    SIGBTrace.count("iris.samples", len(good))
+    SIGBTrace.count("iris.votes", len(X))
 
     # very rare, in normal real life images probably won't occur
-    if len(finalIrisRadiusVotes) == 0:
+    if len(X) == 0:
         return None
 
-    # order the radius dict by votes and grab the winner
-    finalIrisRadius = max(finalIrisRadiusVotes.iteritems(), key=operator.itemgetter(1))[0]
+    # calculate the radius of the iris each good sample corresponds to, rounded to radiusResolution
+    radii = np.sqrt((X - center[0]) ** 2 + (Y - center[1]) ** 2)
+    bins = np.floor(radii / float(radiusResolution) + 0.5).astype(int)
+
+    # vote for the radii and grab the winner
+    votes = np.bincount(bins)
+    finalIrisRadius = int(np.argmax(votes) * radiusResolution)
 
-    # draw the winning radius
     if show:
+        # draw the samples that we have used and the rays
+        for x, y in zip(X, Y):
+            cv2.circle(image, (int(x), int(y)), 2, (255, 255, 0), 2)
+        for start, end in zip(starts, ends):
+            cv2.line(image, tuple(int(c) for c in start), tuple(int(c) for c in end), (0, 255, 0))
+
+        # draw the winning radius
         cv2.circle(image, center, finalIrisRadius, (255, 0, 255), 2)
         cv2.imshow("Iris Samples", image)
 
     return (center, finalIrisRadius)
 
-def drawIris(image, iris):
+def drawIris(image, iris, output=None):
     '''
     Draw the iris detected by getIrisForPupil()
     
     Params:
         image (numpy array): image to draw to
         iris (tuple(center tuple(int, int), radius int): iris to draw
+        output (numpy array): draw into this array instead, see getDrawTarget()
     
     Returns:
         image with the iris drawin in
     '''
+    image = getDrawTarget(image, output)
+
     center = iris[0]
     radius = iris[1]
     cv2.circle(image, center, radius, (255, 255, 0), 2)
@@ -266,77 +642,366 @@ def drawIris(image, iris):
 #
 ######################################################################
 
-def getGlints(image, iris=None, show=False):
+def getGlints(image, iris=None, show=False, kmeansMethod="scipy", roiMargin=10, blobMethod="contours"):
     '''
     Glint detection function finds glints in the iris area of the eye
     
+    When the iris is known, only its bounding box (plus roiMargin) is
+    processed, so the cost depends on the size of the iris and not on the
+    size of the frame. k-means then samples the crop with the same density
+    getKMeans uses for the whole frame
+    
     Params:
-        image (numpy array): image to use for detection
+        image (numpy array or FrameContext): image to use for detection
         iris (tuple(center tuple(int, int), radius int): iris from getIrisForPupil()
         show (bool): show intermediate results 
+        kmeansMethod (string): k-means backend, see SIGBTools.kmeansMethods
+        roiMargin (int): pixels added around the iris bounding box
+        blobMethod (string): blob extraction backend, see SIGBTools.getBlobs()
     
     Returns:
         list of glint circles
     '''
-    gray = getGray(image)
+    context = getFrameContext(image)
+    image = context.image
+
+    gray = context.getGray()
+
+    imageArea = image.shape[0] * image.shape[1]
 
-    # compute kmeans
-    centroids, variance = getKMeans(gray, featureCount=5, distanceWeight=14, smallSize=(100, 75), show=show)
+    if iris is not None:
+        # crop to the iris, positions in the crop are relative to offset
+        x, y, width, height = getCircleRegion(iris[0], iris[1] + roiMargin, gray.shape)
+        offset = (x, y)
+
+        smallSize = (max(10, int(round(100.0 * width / gray.shape[1]))), max(10, int(round(75.0 * height / gray.shape[0]))))
+
+        gray = gray[y:y + height, x:x + width]
+        SIGBTrace.record("glints.roiArea", width * height)
+
+        # compute kmeans
+        centroids, variance = getKMeans(gray, featureCount=5, distanceWeight=14, smallSize=smallSize, show=show, method=kmeansMethod)
+    else:
+        offset = (0, 0)
+
+        # compute kmeans
+        centroids, variance = context.getKMeans(featureCount=5, distanceWeight=14, smallSize=(100, 75), show=show, method=kmeansMethod)
 
     # sort, notice reverse=True, we want the brightest parts
     centroids = sorted(centroids, key=lambda centroid: centroid[0], reverse=True)
 
     # threshold using values obtained by kmeans
-    retval, gray = cv2.threshold(gray, centroids[0][0] - centroids[0][1], 255, cv2.cv.CV_THRESH_BINARY)
+    capacity = image.shape[0] * image.shape[1]
+    retval, gray = cv2.threshold(gray, centroids[0][0] - centroids[0][1], 255, cv2.THRESH_BINARY, dst=context.buffers.get("glintThreshold", gray.shape, capacity=capacity))
 
     # perform morphologic opening
-    result = getOpen(gray, 2)
+    result = getOpen(gray, 2, dst=context.buffers.get("glintOpen", gray.shape, capacity=capacity))
     glints = []
 
-    imageArea = image.shape[0] * image.shape[1]
-
-    contours, hierarchy = cv2.findContours(result, cv2.RETR_LIST, cv2.CHAIN_APPROX_SIMPLE)
-
     # filter contours
-    for contour in contours:
-        c = ContourTools(contour)
+    batch = getBlobs(result, blobMethod)
+    centers = batch.getCentroidInt() + offset
+    radii = (batch.equivDiameter / 2).astype(int)
 
-        area = c.getArea()
-        # reject too big
-        if area > 0.001 * imageArea: continue
+    # reject too big
+    mask = batch.area <= 0.001 * imageArea
 
-        center = c.getCentroidInt()
+    # reject those that lie outside of the iris
+    if iris != None:
+        irisCenter = iris[0]
+        irisRadius = iris[1]
+        mask &= np.sqrt(((centers - irisCenter) ** 2).sum(axis=1)) <= irisRadius
 
-        # reject those that lie outside of the iris
-        if iris != None:
-            irisCenter = iris[0]
-            irisRadius = iris[1]
-            if sqrt((center[0] - irisCenter[0]) ** 2 + (center[1] - irisCenter[1]) ** 2) > irisRadius:
-                continue
-
-        color = (255, 0, 255)
-        radius = int(c.getEquivDiameter() / 2)
+    color = (255, 0, 255)
+    for i in np.flatnonzero(mask):
+        center = (int(centers[i, 0]), int(centers[i, 1]))
+        radius = int(radii[i])
 
         cv2.circle(image, center, radius, color, -1)
         glints.append((center, radius))
 
+    SIGBTrace.count("glints.contours", len(batch))
+    SIGBTrace.count("glints.glints", len(glints))
+
     if show:
         cv2.imshow("Glints", image)
 
     return glints
 
-def drawGlints(image, glints):
+def drawGlints(image, glints, output=None):
     '''
     Draw glints obtained by getGlints()
     
     Params:
         image (numpy array): image to draw to
         glints (list): glints
+        output (numpy array): draw into this array instead, see getDrawTarget()
     
     Results:
         image with glints drawn
     '''
+    image = getDrawTarget(image, output)
+
     for center, radius in glints:
         cv2.circle(image, center, radius, (255, 0, 255), -1)
 
     return image
+
+######################################################################
+#
+#    Hough Circles (experiment, see hough() in SIGBAssignments.py)
+#
+######################################################################
+
+def getHoughCircles(image, dp=8, minDist=307, param1=52, param2=447, minRadius=28, maxRadius=110):
+    '''
+    Circles found by cv2.HoughCircles in the grayscale image, the defaults
+    are the starting values of the hough() sliders
+
+    Params:
+        image (numpy array or FrameContext): image to use for detection (BGR)
+        dp (int): inverse ratio of the accumulator resolution
+        minDist (int): min distance between the circle centers
+        param1 (int): upper threshold of the Canny edge detector
+        param2 (int): accumulator threshold
+        minRadius (int): min circle radius
+        maxRadius (int): max circle radius
+
+    Returns:
+        list of circles (x, y, radius), best first
+    '''
+    context = getFrameContext(image)
+
+    circles = cv2.HoughCircles(context.getGray(), HOUGH_GRADIENT, dp, minDist, None, param1, param2, minRadius, maxRadius)
+
+    if circles is None:
+        return []
+
+    return [tuple(circle) for circle in circles[0]]
+
+######################################################################
+#
+#    Whole Eye
+#
+######################################################################
+
+def getEye(image, tracker=None):
+    '''
+    Runs the whole pipeline on one frame: pupil, then iris and glints
+    for the best pupil
+    
+    Params:
+        image (numpy array or FrameContext): image to use for detection (BGR)
+        tracker (PupilTracker): use this tracker to find the pupils instead of getPupils()
+    
+    Returns:
+        (pupils, iris, glints): iris is None and glints are empty when no pupil was found
+    '''
+    context = getFrameContext(image)
+
+    if tracker is not None:
+        pupils = tracker.getPupils(context)
+    else:
+        pupils = getPupils(context)
+
+    iris = None
+    glints = []
+
+    if len(pupils) > 0:
+        iris = getIrisForPupil(context, pupils[0])
+        glints = getGlints(context, iris)
+
+    return pupils, iris, glints
+
+def drawEye(image, eye, output=None):
+    '''
+    Draw the results of getEye()
+    
+    Params:
+        image (numpy array): image to draw to
+        eye (tuple (pupils, iris, glints)): output of getEye()
+        output (numpy array): draw into this array instead, see getDrawTarget()
+    
+    Returns:
+        image with pupils, iris and glints drawn
+    '''
+    pupils, iris, glints = eye
+
+    image = drawPupils(image, pupils, output)
+
+    if iris is not None:
+        image = drawIris(image, iris)
+
+    image = drawGlints(image, glints)
+
+    return image
+
+######################################################################
+#
+#    Motion Gating
+#
+######################################################################
+
+class MotionGate:
+    '''Skips the detection on frames where the eye did not move
+    
+    Every frame is compared with the frame of the last detection, in the
+    region around the eye that was found (the iris, or the pupil when there
+    is no iris, or the whole frame when nothing was found), on a grayscale
+    image downscaled by scale. When the mean absolute difference is below
+    threshold (gray levels) the eye of the last detection is reused and the
+    frame counts as inferred. Comparing with the last detection and not with
+    the previous frame means slow drifts add up until they are detected.
+    
+    The detection is forced every maxSkip frames and when the difference is
+    above motionThreshold, where the eye moved so much (saccade, blink) that
+    tracking around the last pupil is unlikely to work, see isMoved()
+    
+    Counters:
+        frameCount: frames processed
+        detectedCount: frames where the detection had to run
+        inferredCount: frames where the last eye was reused
+        forcedCount: detections forced by maxSkip
+        movedCount: detections caused by motion above motionThreshold
+    
+    Example:
+        gate = MotionGate()
+        for frame in frames:
+            context = FrameContext(frame)
+            if gate.isNeeded(context):
+                gate.update(context, getEye(context))
+            eye = gate.eye
+    '''
+    def __init__(self, threshold=2.0, motionThreshold=12.0, maxSkip=15, scale=0.25, margin=1.5):
+        '''
+        Params:
+            threshold (float): mean absolute difference below which the eye is reused
+            motionThreshold (float): mean absolute difference that counts as large motion
+            maxSkip (int): max number of frames in a row the eye is reused
+            scale (float): the frames are compared at this fraction of their size
+            margin (float): size of the compared region in multiples of the eye radius
+        '''
+        self.threshold = threshold
+        self.motionThreshold = motionThreshold
+        self.maxSkip = maxSkip
+        self.scale = scale
+        self.margin = margin
+
+        self.frameCount = 0
+        self.detectedCount = 0
+        self.inferredCount = 0
+        self.forcedCount = 0
+        self.movedCount = 0
+
+        self.reset()
+
+    def reset(self):
+        '''
+        Forget the last detection, the next frame is detected
+        '''
+        self.reference = None
+        self.region = None
+        self.eye = None
+        self.skipped = 0
+        self.motion = None
+        self.moved = False
+
+    def getSmall(self, context, dst=None):
+        gray = context.getGray()
+        size = (max(1, int(gray.shape[1] * self.scale)), max(1, int(gray.shape[0] * self.scale)))
+
+        return cv2.resize(gray, size, dst=dst, interpolation=cv2.INTER_AREA)
+
+    def getMotion(self, context):
+        '''
+        Params:
+            context (FrameContext): the frame
+        
+        Returns:
+            (float) mean absolute difference to the frame of the last
+            detection in the region of its eye, None without a detection
+        '''
+        if self.reference is None:
+            return None
+
+        small = self.getSmall(context, context.buffers.get("gateSmall", self.reference.shape))
+        x, y, width, height = self.region
+        if width * height == 0:
+            return 0.0
+
+        # L1 norm of the difference, without making the difference image
+        return cv2.norm(small[y:y + height, x:x + width], self.reference[y:y + height, x:x + width], cv2.NORM_L1) / (width * height)
+
+    def isNeeded(self, context):
+        '''
+        Decide whether the detection has to run on the next frame, call
+        update() with its result when it does, use eye when it does not
+        
+        Params:
+            context (FrameContext): the frame
+        
+        Returns:
+            (bool) True when the detection has to run
+        '''
+        self.frameCount += 1
+        self.moved = False
+        self.motion = self.getMotion(context)
+
+        if self.motion is not None:
+            SIGBTrace.record("gate.motion", self.motion)
+
+        if self.motion is None:
+            needed = True
+        elif self.motion >= self.motionThreshold:
+            self.moved = True
+            self.movedCount += 1
+            needed = True
+        elif self.skipped >= self.maxSkip:
+            self.forcedCount += 1
+            needed = True
+        else:
+            needed = self.motion >= self.threshold
+
+        if needed:
+            self.detectedCount += 1
+            SIGBTrace.count("gate.detected")
+        else:
+            self.inferredCount += 1
+            self.skipped += 1
+            SIGBTrace.count("gate.inferred")
+
+        return needed
+
+    def isMoved(self):
+        '''
+        Returns:
+            (bool) was the detection of the last frame caused by large motion,
+            a PupilTracker should be reset then
+        '''
+        return self.moved
+
+    def update(self, context, eye):
+        '''
+        Remember the frame and the eye that was detected in it
+        
+        Params:
+            context (FrameContext): the frame the detection ran on
+            eye (tuple (pupils, iris, glints)): output of getEye()
+        '''
+        pupils, iris, glints = eye
+
+        self.reference = self.getSmall(context)
+        self.eye = eye
+        self.skipped = 0
+
+        if iris is not None:
+            center, radius = iris
+        elif len(pupils) > 0:
+            center, axes, angle = pupils[0]
+            radius = max(axes) / 2
+        else:
+            self.region = (0, 0, self.reference.shape[1], self.reference.shape[0])
+            return
+
+        center = (center[0] * self.scale, center[1] * self.scale)
+        self.region = getCircleRegion(center, max(1.0, self.margin * radius * self.scale), self.reference.shape)
@@ -0,0 +1,501 @@
+from __future__ import print_function
+import os
+import json
+import hashlib
+import numpy as np
+import SIGBCache
+import SIGBSolutions
+import SIGBTools
+from SIGBSolutions import *
+
+# Persistent per-video results store
+# Every video gets a directory of .npy columns per set of pupil parameters,
+# <video>.<pupil hash>.store, opened as memory maps, with one row per frame
+# of the video:
+#
+#    pupil.npy   float64 (n, 5)    best pupil ellipse: center x, y, axes w, h, angle
+#    iris.npy    float64 (n, 3)    iris center x, y and radius
+#    glints.npy  int32   (n, g, 3) glint center x, y and radius, g = maxGlints
+#    glintCount.npy int16 (n,)     number of glints in glints.npy
+#    done.npy    bool    (n, 3)    which stages have been computed, pupil, iris, glints
+#    inferred.npy bool   (n,)      the eye was reused from an earlier frame by a MotionGate
+#    motion.npy  float32 (n,)      difference the MotionGate measured, NaN without a gate
+#    interpolatedPupil.npy float64 (n, 5) pupil column with the inferred frames interpolated
+#    interpolatedIris.npy  float64 (n, 3) iris column with the inferred frames interpolated
+#    params.json                   parameters and hash of every stage
+#
+# NaN rows are frames where nothing was found. The hash of a stage covers its
+# parameters and the hash of the stage before it. Runs with different pupil
+# parameters (e.g. with and without tracker or gate) use different
+# directories, so their results live side by side. When the iris or glints
+# parameters change, that stage and the stages after it are computed again,
+# the stages before it are read from the store. Frames that are done are
+# not computed again at all. The hashes also cover the source of the
+# detector modules (see getCodeVersion()), so editing the detectors
+# computes everything again.
+#
+# With a 'gate' in the pupil parameters (MotionGate arguments) the detection
+# only runs on frames where the eye moved, the other frames reuse the eye of
+# the last detection and are marked inferred. interpolateInferred() fills the
+# interpolated columns: the pupils and irises, with the reused ones
+# interpolated between the detections when the eye moved gradually between
+# them. The pupil and iris columns keep the reused ones, read the
+# interpolated ones with getEye(frameId, interpolated=True).
+#
+# Example:
+#    store = ResultStore("Sequences/eye1.avi", frameCount)
+#    for frameId, image in source.getFrames():
+#        eye = getStoredEye(store, frameId, image)
+#    store.flush()
+
+stages = ["pupil", "iris", "glints"]
+
+defaultParams = {
+    'pupil': {'kmeansFeatureCount': 5, 'kmeansDistanceWeight': 14, 'kmeansMethod': "scipy", 'vignette': False, 'blobMethod': "contours", 'tracker': False},
+    'iris': {'rayCount': 30, 'radiusResolution': 10},
+    'glints': {'kmeansMethod': "scipy", 'roiMargin': 10, 'blobMethod': "contours"}
+}
+
+def getParams(**stageParams):
+    '''
+    Detector parameters for the store, defaultParams updated with stageParams
+
+    Params:
+        stageParams: stage name -> dict of parameters to change, e.g. pupil={'tracker': True}
+
+    Returns:
+        dict stage -> parameters
+    '''
+    params = dict((stage, dict(defaultParams[stage])) for stage in stages)
+    for stage in stageParams:
+        params[stage].update(stageParams[stage])
+
+    return params
+
+# modules whose source the detection results depend on
+detectorModules = [SIGBSolutions, SIGBTools, SIGBCache]
+
+codeVersion = None
+
+def getCodeVersion():
+    '''
+    Hash of the source of detectorModules, computed once per process
+
+    Returns:
+        (string) hex digest
+    '''
+    global codeVersion
+
+    if codeVersion is None:
+        digest = hashlib.sha1()
+        for module in detectorModules:
+            filename = os.path.splitext(module.__file__)[0] + ".py"
+            with open(filename, "rb") as f:
+                digest.update(f.read())
+
+        codeVersion = digest.hexdigest()
+
+    return codeVersion
+
+def getStageHashes(params, salt=""):
+    '''
+    Hash of every stage, chained so that a stage changes with every stage before it
+
+    Params:
+        params (dict): output of getParams()
+        salt (string): included in the first hash, e.g. getCodeVersion()
+
+    Returns:
+        dict stage -> hex digest
+    '''
+    hashes = dict()
+    previous = salt
+    for stage in stages:
+        previous = hashlib.sha1((previous + json.dumps(params[stage], sort_keys=True)).encode("utf-8")).hexdigest()
+        hashes[stage] = previous
+
+    return hashes
+
+class ResultStore:
+    '''Results of the pipeline for every frame of one video, on disk
+
+    The columns are memory maps, so opening the store of a long video does
+    not read it and the results are written to disk as they come in. See
+    the top of SIGBStore.py for the layout
+
+    Counters:
+        invalidated: stages that were reset when the store was opened
+    '''
+    def __init__(self, videoFile, frameCount, params=None, directory="Sequences/Results", maxGlints=8):
+        '''
+        Opens the store of the video, creates it when it does not exist or
+        the frame count changed, resets the stages whose parameters changed
+
+        Params:
+            videoFile (string): path to the video, its file name and the
+                                hash of the pupil parameters name the store
+            frameCount (int): number of frames in the video
+            params (dict): output of getParams(), defaultParams when None
+            directory (string): where the stores are
+            maxGlints (int): max number of glints stored per frame
+        '''
+        if params is None:
+            params = getParams()
+
+        self.params = params
+        self.hashes = getStageHashes(params, getCodeVersion())
+
+        # named by the parameters only, a new version of the detectors resets the store
+        name = getStageHashes(params)['pupil'][:12]
+        self.path = os.path.join(directory, "{}.{}.store".format(os.path.basename(videoFile), name))
+        self.frameCount = frameCount
+        self.tracker = None
+        self.gate = None
+        self.invalidated = []
+
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path)
+
+        stored = self.readParams()
+        columns = [
+            ("pupil", np.float64, (frameCount, 5), np.nan),
+            ("iris", np.float64, (frameCount, 3), np.nan),
+            ("glints", np.int32, (frameCount, maxGlints, 3), 0),
+            ("glintCount", np.int16, (frameCount,), 0),
+            ("inferred", np.bool_, (frameCount,), False),
+            ("motion", np.float32, (frameCount,), np.nan),
+            ("interpolatedPupil", np.float64, (frameCount, 5), np.nan),
+            ("interpolatedIris", np.float64, (frameCount, 3), np.nan),
+            ("done", np.bool_, (frameCount, len(stages)), False)
+        ]
+
+        for name, dtype, shape, empty in columns:
+            setattr(self, name, self.openColumn(name, dtype, shape, empty, stored is not None))
+
+        if stored is None:
+            stored = {'hashes': {}}
+
+        # stage hashes are chained, so the stages after a changed one are reset too
+        for stage in stages:
+            if stored['hashes'].get(stage) != self.hashes[stage]:
+                self.reset(stage)
+                self.invalidated.append(stage)
+
+        self.writeParams()
+
+    def openColumn(self, name, dtype, shape, empty, exists):
+        filename = os.path.join(self.path, name + ".npy")
+
+        if exists and os.path.isfile(filename):
+            column = np.lib.format.open_memmap(filename, mode="r+")
+            if column.dtype == dtype and column.shape == shape:
+                return column
+
+        column = np.lib.format.open_memmap(filename, mode="w+", dtype=dtype, shape=shape)
+        column[...] = empty
+
+        # a new column has nothing done
+        if name != "done":
+            doneFile = os.path.join(self.path, "done.npy")
+            if os.path.isfile(doneFile):
+                os.remove(doneFile)
+
+        return column
+
+    def readParams(self):
+        filename = os.path.join(self.path, "params.json")
+        if not os.path.isfile(filename):
+            return None
+
+        with open(filename) as f:
+            return json.load(f)
+
+    def writeParams(self):
+        with open(os.path.join(self.path, "params.json"), "w") as f:
+            json.dump({'params': self.params, 'hashes': self.hashes, 'frameCount': self.frameCount}, f, indent=2, sort_keys=True)
+
+    def reset(self, stage):
+        '''
+        Forget the results of a stage for all frames
+
+        Params:
+            stage (string): one of stages
+        '''
+        self.done[:, stages.index(stage)] = False
+
+        if stage == "pupil":
+            self.pupil[...] = np.nan
+            self.inferred[...] = False
+            self.motion[...] = np.nan
+            self.interpolatedPupil[...] = np.nan
+            self.interpolatedIris[...] = np.nan
+        elif stage == "iris":
+            self.iris[...] = np.nan
+            self.interpolatedIris[...] = np.nan
+        else:
+            self.glintCount[...] = 0
+
+    def isDone(self, frameId, stage=None):
+        '''
+        Params:
+            frameId (int): frame of the video
+            stage (string): one of stages, all of them when None
+
+        Returns:
+            (bool) has the stage (all stages) been computed for the frame
+        '''
+        if stage is None:
+            return bool(self.done[frameId].all())
+
+        return bool(self.done[frameId, stages.index(stage)])
+
+    def getMissing(self, stage=None):
+        '''
+        Params:
+            stage (string): one of stages, any of them when None
+
+        Returns:
+            (numpy array) frames where the stage (any stage) has not been computed
+        '''
+        if stage is None:
+            return np.flatnonzero(~self.done.all(axis=1))
+
+        return np.flatnonzero(~self.done[:, stages.index(stage)])
+
+    def getPupil(self, frameId, interpolated=False):
+        row = (self.interpolatedPupil if interpolated else self.pupil)[frameId]
+        if np.isnan(row[0]):
+            return None
+
+        return ((row[0], row[1]), (row[2], row[3]), row[4])
+
+    def setPupil(self, frameId, pupil):
+        self.pupil[frameId] = np.nan if pupil is None else (pupil[0][0], pupil[0][1], pupil[1][0], pupil[1][1], pupil[2])
+        self.done[frameId, 0] = True
+
+    def getIris(self, frameId, interpolated=False):
+        row = (self.interpolatedIris if interpolated else self.iris)[frameId]
+        if np.isnan(row[0]):
+            return None
+
+        return ((int(row[0]), int(row[1])), int(row[2]))
+
+    def setIris(self, frameId, iris):
+        self.iris[frameId] = np.nan if iris is None else (iris[0][0], iris[0][1], iris[1])
+        self.done[frameId, 1] = True
+
+    def getGlints(self, frameId):
+        return [((int(x), int(y)), int(radius)) for x, y, radius in self.glints[frameId, :self.glintCount[frameId]]]
+
+    def setGlints(self, frameId, glints):
+        glints = glints[:self.glints.shape[1]]
+        for i, (center, radius) in enumerate(glints):
+            self.glints[frameId, i] = (center[0], center[1], radius)
+
+        self.glintCount[frameId] = len(glints)
+        self.done[frameId, 2] = True
+
+    def setEye(self, frameId, eye, inferred=False):
+        '''
+        Store all the stages of a frame at once
+        
+        Params:
+            frameId (int): frame of the video
+            eye (tuple (pupils, iris, glints)): only the best pupil is stored
+            inferred (bool): the eye was reused from an earlier frame
+        '''
+        pupils, iris, glints = eye
+
+        self.setPupil(frameId, pupils[0] if len(pupils) > 0 else None)
+        self.setIris(frameId, iris)
+        self.setGlints(frameId, glints)
+        self.inferred[frameId] = inferred
+
+    def getEye(self, frameId, interpolated=False):
+        '''
+        Params:
+            frameId (int): frame of the video
+            interpolated (bool): read the interpolated pupil and iris, see
+                                 interpolateInferred()
+
+        Returns:
+            (pupils, iris, glints) like SIGBSolutions.getEye(), only the best
+            pupil is stored, None when not all stages are done
+        '''
+        if not self.isDone(frameId):
+            return None
+
+        pupil = self.getPupil(frameId, interpolated)
+        if pupil is None:
+            return [], None, []
+
+        return [pupil], self.getIris(frameId, interpolated), self.getGlints(frameId)
+
+    def flush(self):
+        '''
+        Write the changes of the memory maps to disk
+        '''
+        for name in ["pupil", "iris", "glints", "glintCount", "inferred", "motion", "interpolatedPupil", "interpolatedIris", "done"]:
+            getattr(self, name).flush()
+
+def getStoredEye(store, frameId, image):
+    '''
+    SIGBSolutions.getEye() that only runs the stages the store does not
+    have for the frame, using the parameters of the store, and saves them
+
+    When the pupil parameters have 'tracker' set, the pupil is found by a
+    PupilTracker kept in the store, and with a 'gate' (MotionGate arguments)
+    the frames where the eye did not move reuse the last detection, for
+    both the frames should come in order
+
+    Params:
+        store (ResultStore): store of the video
+        frameId (int): frame of the video
+        image (numpy array or FrameContext): the frame (BGR)
+
+    Returns:
+        (pupils, iris, glints) like getEye(), with only the best pupil, the
+        same whether it was computed or read from the store
+    '''
+    eye = store.getEye(frameId)
+    if eye is not None:
+        SIGBTrace.count("store.hits")
+
+        # neither the gate nor the tracker have seen the frames in between
+        if store.gate is not None:
+            store.gate.reset()
+        if store.tracker is not None:
+            store.tracker.reset()
+
+        return eye
+
+    SIGBTrace.count("store.misses")
+    context = getFrameContext(image)
+
+    params = dict(store.params['pupil'])
+    tracking = params.pop('tracker', False)
+    gating = params.pop('gate', None)
+
+    if gating is None or store.isDone(frameId, "pupil"):
+        return detectStoredEye(store, frameId, context, params, tracking)
+
+    if store.gate is None:
+        store.gate = MotionGate(**gating)
+
+    needed = store.gate.isNeeded(context)
+    store.motion[frameId] = np.nan if store.gate.motion is None else store.gate.motion
+
+    if not needed:
+        store.setEye(frameId, store.gate.eye, inferred=True)
+        return store.gate.eye
+
+    # the eye moved too far for the tracker to follow it
+    if store.gate.isMoved() and store.tracker is not None:
+        store.tracker.reset()
+
+    eye = detectStoredEye(store, frameId, context, params, tracking)
+    store.gate.update(context, eye)
+
+    return eye
+
+def detectStoredEye(store, frameId, context, params, tracking):
+    '''
+    Run the stages of getStoredEye() the store does not have and save them
+    
+    Params:
+        store (ResultStore): store of the video
+        frameId (int): frame of the video
+        context (FrameContext): the frame
+        params (dict): pupil parameters for getPupils()
+        tracking (bool): find the pupil with the PupilTracker of the store
+    
+    Returns:
+        (pupils, iris, glints) with only the best pupil
+    '''
+    if store.isDone(frameId, "pupil"):
+        pupil = store.getPupil(frameId)
+        pupils = [] if pupil is None else [pupil]
+    else:
+        if tracking:
+            if store.tracker is None:
+                store.tracker = PupilTracker(**params)
+            pupils = store.tracker.getPupils(context)[:1]
+        else:
+            pupils = getPupils(context, **params)[:1]
+
+        store.setPupil(frameId, pupils[0] if len(pupils) > 0 else None)
+        store.inferred[frameId] = False
+
+    if len(pupils) == 0:
+        store.setIris(frameId, None)
+        store.setGlints(frameId, [])
+        return pupils, None, []
+
+    if store.isDone(frameId, "iris"):
+        iris = store.getIris(frameId)
+    else:
+        iris = getIrisForPupil(context, pupils[0], **store.params['iris'])
+        store.setIris(frameId, iris)
+
+    glints = getGlints(context, iris, **store.params['glints'])
+    store.setGlints(frameId, glints)
+
+    return pupils, iris, glints
+
+def interpolateInferred(store, maxMotion=None):
+    '''
+    Fill the interpolated columns of the store: the pupils and irises, with
+    the ones the MotionGate reused replaced by interpolating linearly between
+    the detections before and after them. The pupil and iris columns are not
+    changed. The whole columns are computed again, so call it after the
+    frames have been processed
+    
+    Only where the eye moved gradually: when the detection after the reused
+    frames measured more than maxMotion the eye jumped (saccade, blink) and
+    stood still before that, so the reused eye is kept. Frames where one of
+    the two detections found nothing keep the reused eye too, the glints and
+    the pupil angle are always reused
+    
+    Params:
+        store (ResultStore): store of the video
+        maxMotion (float): motion of the following detection up to which the
+                           change counts as gradual, twice the gate threshold
+                           when None
+    
+    Returns:
+        (int) number of inferred frames that were interpolated
+    '''
+    if maxMotion is None:
+        gating = store.params['pupil'].get('gate') or {}
+        maxMotion = 2 * gating.get('threshold', MotionGate().threshold)
+
+    store.interpolatedPupil[...] = store.pupil
+    store.interpolatedIris[...] = store.iris
+
+    done = store.done.all(axis=1)
+    anchors = np.flatnonzero(done & ~store.inferred[...])
+    frames = np.flatnonzero(done & store.inferred[...])
+
+    # detections before and after every inferred frame
+    after = np.searchsorted(anchors, frames)
+    inside = (after > 0) & (after < len(anchors))
+    frames = frames[inside]
+    previous = anchors[after[inside] - 1]
+    following = anchors[after[inside]]
+
+    # NaN motion (no gate at the following frame) compares False as well
+    gradual = store.motion[following] < maxMotion
+    frames, previous, following = frames[gradual], previous[gradual], following[gradual]
+
+    if len(frames) == 0:
+        return 0
+
+    weight = ((frames - previous) / (following - previous).astype(float))[:, np.newaxis]
+
+    # pupil center and axes, iris center and radius
+    for column, count in [(store.interpolatedPupil, 4), (store.interpolatedIris, 3)]:
+        values = column[previous, :count] * (1 - weight) + column[following, :count] * weight
+        valid = ~np.isnan(values).any(axis=1)
+        column[frames[valid], :count] = values[valid]
+
+    return len(frames)
@@ -0,0 +1,261 @@
+from __future__ import print_function
+import csv
+import time
+import itertools
+import multiprocessing
+import numpy as np
+from SIGBSolutions import *
+from SIGBVideo import FrameSource
+from SIGBJobs import getUnits, loadManifest
+
+# Parameter sweeps for tuning the detectors
+# Every combination of a parameter grid is evaluated on a set of frames, the
+# combinations are ranked by detection rate and then by cost per frame.
+# The frames are split into units like in SIGBJobs.py and the units are spread
+# over a pool of worker processes. A worker decodes a frame once and runs all
+# the combinations on it with one FrameContext, so the grayscale and equalized
+# images are computed once per frame and k-means once per frame and k-means
+# parameters.
+#
+# Detectors that can be swept (sweepDetectors):
+#    pupil: getPupils(), kmeansFeatureCount, kmeansDistanceWeight, kmeansMethod, vignette, blobMethod
+#    hough: getHoughCircles(), dp, minDist, param1, param2, minRadius, maxRadius
+#
+# Usage:
+#    > python SIGBSweep.py pupil -g kmeansFeatureCount=3,4,5,6,8 -g kmeansDistanceWeight=8,14,20
+#    > python SIGBSweep.py hough -g dp=4,8,12 -g param2=300,447,600 -o hough.csv
+
+sweepDetectors = {
+    "pupil": getPupils,
+    "hough": getHoughCircles
+}
+
+class SweepContext(FrameContext):
+    '''FrameContext that remembers how long every k-means took
+
+    The combinations that get a memoized k-means result are charged the time
+    it took to compute, so the cost of a combination does not depend on the
+    order the combinations run in
+    '''
+    def __init__(self, image):
+        FrameContext.__init__(self, image)
+        self.kmeansTimes = dict()
+        self.charged = 0.0
+
+    def getKMeans(self, *args, **kwargs):
+        count = len(self.kmeans)
+        start = time.time()
+
+        result = FrameContext.getKMeans(self, *args, **kwargs)
+
+        if len(self.kmeans) > count:
+            self.kmeansTimes[id(result)] = time.time() - start
+        else:
+            self.charged += self.kmeansTimes[id(result)]
+
+        return result
+
+def parseValue(value):
+    '''
+    Value of a grid parameter given on the command line: int, float, bool or string
+    '''
+    for parse in [int, float]:
+        try:
+            return parse(value)
+        except ValueError:
+            pass
+
+    if value.lower() in ["true", "false"]:
+        return value.lower() == "true"
+
+    return value
+
+def parseGrid(items):
+    '''
+    Params:
+        items (list): "name=value1,value2,..." strings
+
+    Returns:
+        dict parameter name -> list of values
+    '''
+    grid = dict()
+    for item in items:
+        name, values = item.split("=", 1)
+        grid[name] = [parseValue(value) for value in values.split(",")]
+
+    return grid
+
+def getCombinations(grid):
+    '''
+    Params:
+        grid (dict): parameter name -> list of values
+
+    Returns:
+        list of dicts parameter name -> value, one for every combination
+    '''
+    names = sorted(grid.keys())
+
+    return [dict(zip(names, values)) for values in itertools.product(*[grid[name] for name in names])]
+
+def sweepUnit(task):
+    '''
+    Worker function, runs all the combinations on the frames of one unit
+
+    Params:
+        task (tuple (detector, combinations, videoFile, frameIds)): name of the
+            detector in sweepDetectors, output of getCombinations() and the frames
+
+    Returns:
+        (frames, detections, seconds, sharedSeconds): number of frames that could
+        be read, per combination the number of frames with a detection and the
+        seconds spent, and the seconds spent on the preprocessing all the
+        combinations share
+    '''
+    detector, combinations, videoFile, frameIds = task
+    function = sweepDetectors[detector]
+
+    detections = np.zeros(len(combinations), int)
+    seconds = np.zeros(len(combinations))
+    sharedSeconds = 0.0
+    frames = 0
+
+    source = FrameSource(videoFile)
+    for frameId in frameIds:
+        image = source.getFrame(frameId)
+        if image is None:
+            continue
+
+        frames += 1
+        context = SweepContext(image)
+
+        start = time.time()
+        context.getEqualized()
+        if any(combination.get('vignette', False) for combination in combinations):
+            context.getEqualized(vignette=True)
+        sharedSeconds += time.time() - start
+
+        for i, combination in enumerate(combinations):
+            context.charged = 0.0
+            start = time.time()
+
+            found = function(context, **combination)
+
+            seconds[i] += time.time() - start + context.charged
+            if len(found) > 0:
+                detections[i] += 1
+
+    source.release()
+
+    return frames, detections, seconds, sharedSeconds
+
+def runSweep(detector, grid, manifest, directory="Sequences", processes=None, chunkSize=10, verbose=True):
+    '''
+    Evaluate every combination of grid on the frames of manifest
+
+    Params:
+        detector (string): name of the detector in sweepDetectors
+        grid (dict): parameter name -> list of values
+        manifest (dict): video name -> frames, see SIGBJobs.py
+        directory (string): where the videos are
+        processes (int): number of worker processes, defaults to the number of cores
+        chunkSize (int): max number of frames in one unit
+        verbose (bool): print progress
+
+    Returns:
+        list of dicts {params, detectionRate, msPerFrame}, ranked by detection
+        rate and then cost, and the preprocessing cost shared by all combinations
+    '''
+    combinations = getCombinations(grid)
+    tasks = [(detector, combinations, videoFile, frameIds) for sequence, videoFile, frameIds in getUnits(manifest, directory, chunkSize)]
+
+    frames = 0
+    detections = np.zeros(len(combinations), int)
+    seconds = np.zeros(len(combinations))
+    sharedSeconds = 0.0
+
+    pool = multiprocessing.Pool(processes)
+    startTime = time.time()
+
+    for done, result in enumerate(pool.imap_unordered(sweepUnit, tasks, chunksize=1)):
+        frames += result[0]
+        detections += result[1]
+        seconds += result[2]
+        sharedSeconds += result[3]
+
+        if verbose:
+            elapsed = time.time() - startTime
+            print("Finished unit {}/{}, {} frames x {} combinations ({:.1f}s)".format(done + 1, len(tasks), frames, len(combinations), elapsed))
+
+    pool.close()
+    pool.join()
+
+    frames = max(frames, 1)
+    results = []
+    for i, combination in enumerate(combinations):
+        results.append({
+            'params': combination,
+            'detectionRate': detections[i] * 100.0 / frames,
+            'msPerFrame': seconds[i] * 1000.0 / frames
+        })
+
+    results.sort(key=lambda result: (-result['detectionRate'], result['msPerFrame']))
+
+    return results, sharedSeconds * 1000.0 / frames
+
+def printSweepReport(results, sharedMs, count=None):
+    '''
+    Print the output of runSweep() as a ranked table
+
+    Params:
+        results (list): ranked combinations from runSweep()
+        sharedMs (float): shared preprocessing cost per frame from runSweep()
+        count (int): print only the best count combinations
+    '''
+    if len(results) == 0:
+        return
+
+    names = sorted(results[0]['params'].keys())
+    print("{:>5}".format("rank") + "".join("{:>22}".format(name) for name in names) + "{:>12}{:>12}".format("detect %", "ms/frame"))
+
+    for rank, result in enumerate(results[:count]):
+        print("{:>5}".format(rank + 1) + "".join("{:>22}".format(result['params'][name]) for name in names) + "{:>12.1f}{:>12.2f}".format(result['detectionRate'], result['msPerFrame']))
+
+    print("Shared preprocessing: {:.2f} ms/frame".format(sharedMs))
+
+def writeSweepCSV(results, filename):
+    '''
+    Write the output of runSweep() into a CSV file, one row per combination
+    '''
+    names = sorted(results[0]['params'].keys()) if len(results) > 0 else []
+
+    with open(filename, "w") as f:
+        writer = csv.writer(f)
+        writer.writerow(["rank"] + names + ["detectionRate", "msPerFrame"])
+        for rank, result in enumerate(results):
+            writer.writerow([rank + 1] + [result['params'][name] for name in names] + [result['detectionRate'], result['msPerFrame']])
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Rank detector parameters by detection rate and cost")
+    parser.add_argument("detector", choices=sorted(sweepDetectors.keys()), help="detector to tune")
+    parser.add_argument("-g", "--grid", action="append", default=[], help="name=value1,value2,... (repeat for more parameters)")
+    parser.add_argument("-m", "--manifest", default=None, help="JSON manifest of the frames (default: the sequences of SIGBTests.py)")
+    parser.add_argument("-d", "--directory", default="Sequences", help="where the videos are")
+    parser.add_argument("-p", "--processes", type=int, default=None, help="number of worker processes (default: number of cores)")
+    parser.add_argument("-c", "--chunk-size", type=int, default=10, help="max number of frames per unit")
+    parser.add_argument("-n", "--top", type=int, default=None, help="print only the best combinations")
+    parser.add_argument("-o", "--output", default=None, help="write all the combinations into this CSV file")
+    args = parser.parse_args()
+
+    if args.manifest is None:
+        from SIGBTests import sequences
+        manifest = sequences
+    else:
+        manifest = loadManifest(args.manifest)
+
+    results, sharedMs = runSweep(args.detector, parseGrid(args.grid), manifest, args.directory, processes=args.processes, chunkSize=args.chunk_size)
+    printSweepReport(results, sharedMs, args.top)
+
+    if args.output is not None:
+        writeSweepCSV(results, args.output)
@@ -1,11 +1,24 @@
 from __future__ import print_function
+import argparse
+import os
 import cv2
 from SIGBSolutions import *
+from SIGBVideo import FrameSource
+from SIGBStore import ResultStore, getStoredEye, stages
+from SIGBBenchmark import benchmarkAllocations, getSyntheticEyeFrames
 
 # Testing framework
 # Applies the pupil detection to images specified, writes the image with
 # pupil, iris, glints drawn on to the Resutls folder in the following format:
 #    sequence_frameid.png
+# Detections are kept in Sequences/Results (see SIGBStore), so re-runs only
+# detect frames whose results are missing or whose parameters or detector
+# code changed. The report says how many frames were read from the store,
+# --recompute runs the detection on every frame
+#
+# With --checks it instead runs the checks below, which compare the optimized
+# code paths against their reference implementations and fail with an
+# AssertionError on the first mismatch
 
 # Sequences with representative/challenging frames that we have picked
 sequences = {
@@ -20,72 +33,222 @@ sequences = {
     # "EyeBizaro": [3, 48, 261, 293, 323, 365, 411, 456] # does not load for some reason?
 }
 
-# Total frames processed (useful when a frame can not be loaded,
-# we don't want to count it against us
-totalFrameCount = 0
-
-# Total frames where the algorithm has detected *something*
-# still does not have to be correct detection
-totalDetections = 0
-
-# Loop over each sequence
-for sequence, frames in sequences.items():
-    print("Processing sequence: {0} ({1} frames)".format(sequence, len(frames)), end="")
-    video = cv2.VideoCapture("Sequences/" + sequence)
-
-    # Partial frame count for processed frames
-    frameCount = 0
-
-    # Partial detection count for processed frames
-    detections = 0
-
-    # loop over all frames defined for the sequence at hand
-    for frameId in frames:
-        print(".", end="")
-
-        # Read the frame
-        video.set(cv2.cv.CV_CAP_PROP_POS_FRAMES, frameId)
-        retval, frame = video.read()
-
-        # Erro checking
-        if frame == None:
-            print("\nFrame Could not be loaded: Retval from video.read(): {} Frame ID: {}".format(retval, frameId))
+def runTests(recompute=False):
+    # recompute forgets the stored results and detects every frame again
+    # Total frames processed (useful when a frame can not be loaded,
+    # we don't want to count it against us
+    totalFrameCount = 0
+
+    # Total frames where the algorithm has detected *something*
+    # still does not have to be correct detection
+    totalDetections = 0
+
+    # Total frames whose results came from earlier runs
+    totalStoredCount = 0
+
+    # Loop over each sequence
+    for sequence, frames in sequences.items():
+        print("Processing sequence: {0} ({1} frames)".format(sequence, len(frames)), end="")
+        # frames are sorted, so FrameSource mostly reads forward instead of seeking
+        video = FrameSource("Sequences/" + sequence)
+        store = ResultStore("Sequences/" + sequence, video.getFrameCount())
+        if recompute:
+            for stage in stages:
+                store.reset(stage)
+
+        # Partial frame count for processed frames
+        frameCount = 0
+
+        # Partial detection count for processed frames
+        detections = 0
+
+        # Frames whose results were read from the store instead of detected
+        storedCount = 0
+
+        # loop over all frames defined for the sequence at hand
+        for frameId in frames:
+            print(".", end="")
+
+            # Read the frame
+            frame = video.getFrame(frameId)
+
+            # Erro checking
+            if frame is None:
+                print("\nFrame Could not be loaded: Frame ID: {}".format(frameId))
+                continue
+
+            # We dont want to run iris and glint detection on frames
+            # we've already drawn in so we make a copy for that
+            result = np.copy(frame)
+
+            # share intermediate results between the detectors
+            context = FrameContext(frame)
+
+            # detect (or read from the store) pupil, iris and glints
+            if store.isDone(frameId):
+                storedCount += 1
+            pupils, iris, glints = getStoredEye(store, frameId, context)
+            result = drawPupils(result, pupils)
+
+            # cant run iris and glints when no pupil was detected
+            if len(pupils) > 0:
+                # draw iris
+                if iris is not None:
+                    result = drawIris(result, iris)
+
+                # draw glints
+                result = drawGlints(result, glints)
+
+            # Save Frame
+            cv2.imwrite("Results/{}_{}.png".format(sequence, frameId), result)
+
+            # now we know that this frame has been correctly processed
+            frameCount += 1
+            if len(pupils) > 0:
+                detections += 1
+
+        store.flush()
+
+        # update cumulative detections and frames
+        totalDetections += detections
+        totalFrameCount += frameCount
+        totalStoredCount += storedCount
+        success = float(detections) / float(frameCount) * 100.0
+        print("Got {} detections out of {} frames ({}% success rate), {} frames read from the store".format(detections, frameCount, success, storedCount))
+
+    # report total results
+    totalSuccess = float(totalDetections) / float(totalFrameCount) * 100.0
+    print("--------------------------------------------")
+    print("Total: Frames: {} Detections: {} ({}% success rate)".format(totalFrameCount, totalDetections, totalSuccess))
+    if totalStoredCount > 0:
+        print("{} of the frames were read from the store (earlier runs with the same parameters and detector code), --recompute to detect them again".format(totalStoredCount))
+
+def getCheckImages(randomCount=3):
+    '''
+    Grayscale images used by the checks
+
+    The first picked frame of every test sequence (when the sequences are
+    available) and a few random blurred images, so the checks also run
+    without the sequences
+
+    Params:
+        randomCount (int): number of random images
+
+    Returns:
+        list of (name, grayscale image)
+    '''
+    images = []
+    for sequence, frames in sorted(sequences.items()):
+        if not os.path.exists("Sequences/" + sequence):
             continue
 
-        # We dont want to run iris and glint detection on frames
-        # we've already drawn in so we make a copy for that
-        result = np.copy(frame)
-
-        # detect pupils and draw them
-        pupils = getPupils(frame)
-        result = drawPupils(result, pupils)
-
-        # cant run iris and glints when no pupil was detected
-        if len(pupils) > 0:
-            # get and draw iris
-            iris = getIrisForPupil(frame, pupils[0])
-            result = drawIris(result, iris)
-
-            # get and draw glints
-            glints = getGlints(frame, iris)
-            result = drawGlints(result, glints)
-
-        # Save Frame
-        cv2.imwrite("Results/{}_{}.png".format(sequence, frameId), result)
-
-        # now we know that this frame has been correctly processed
-        frameCount += 1
-        if len(pupils) > 0:
-            detections += 1
-
-    # update cumulative detections and frames
-    totalDetections += detections
-    totalFrameCount += frameCount
-    success = float(detections) / float(frameCount) * 100.0
-    print("Got {} detections out of {} frames ({}% success rate)".format(detections, frameCount, success))
-
-# report total results
-totalSuccess = float(totalDetections) / float(totalFrameCount) * 100.0
-print("--------------------------------------------")
-print("Total: Frames: {} Detections: {} ({}% success rate)".format(totalFrameCount, totalDetections, totalSuccess))
-
+        frame = FrameSource("Sequences/" + sequence).getFrame(frames[0])
+        if frame is not None:
+            images.append(("{}:{}".format(sequence, frames[0]), cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)))
+
+    random = np.random.RandomState(0)
+    for i in range(randomCount):
+        noise = random.randint(0, 256, (120, 160)).astype(np.uint8)
+        images.append(("random{}".format(i), cv2.GaussianBlur(noise, (0, 0), 1.0 + i)))
+
+    return images
+
+# cv2.fastAtan2 is accurate to about 0.3 degrees, so the orientation of the
+# reference loop may differ from cv2.cartToPolar by up to twice that
+orientationTolerance = 1.0 # degrees
+magnitudeTolerance = 1e-3 # relative
+
+def checkOrientationAndMagnitude(images):
+    '''
+    getOrientationAndMagnitude gives the same result as the per-pixel loop
+    it replaced (getOrientationAndMagnitudeLoop)
+
+    Orientations are compared as angles, so 359.9 and 0.1 are 0.2 degrees
+    apart, magnitudes within magnitudeTolerance of the reference
+    '''
+    for name, image in images:
+        orientation, magnitude = getOrientationAndMagnitude(image)
+        expectedOrientation, expectedMagnitude = getOrientationAndMagnitudeLoop(image)
+
+        difference = np.abs(orientation - expectedOrientation) % 360
+        difference = np.minimum(difference, 360 - difference)
+        assert difference.max() <= orientationTolerance, \
+            "{}: orientation differs by {} degrees".format(name, difference.max())
+
+        assert np.allclose(magnitude, expectedMagnitude, rtol=magnitudeTolerance, atol=magnitudeTolerance), \
+            "{}: magnitude differs by {}".format(name, np.abs(magnitude - expectedMagnitude).max())
+
+def checkPupilsPyramid(images):
+    '''
+    getPupilsPyramid only returns pupils that pass the ellipticity filter of
+    full resolution getPupils, at every depth, and finds the same best pupil
+
+    Uses a synthetic frame with a round pupil and an elongated dark blob that
+    is only round enough when the limit is not scaled with the pyramid level
+    '''
+    image = np.full((480, 640, 3), 170, np.uint8)
+    cv2.ellipse(image, ((200, 240), (90, 90), 0), (20, 20, 20), -1)
+    cv2.ellipse(image, ((450, 240), (110, 60), 0), (20, 20, 20), -1)
+    image = cv2.GaussianBlur(image, (5, 5), 0)
+
+    reference = getPupils(FrameContext(image), kmeansMethod="opencv")
+    assert len(reference) == 1, "full resolution: expected one pupil, got {}".format(reference)
+
+    for levels in (1, 2, 3):
+        pupils = getPupilsPyramid(FrameContext(image), levels=levels, kmeansMethod="opencv")
+        assert len(pupils) > 0, "{} levels: no pupil".format(levels)
+
+        for center, axes, angle in pupils:
+            assert abs(axes[0] - axes[1]) <= 15, "{} levels: too elliptical pupil {}".format(levels, (center, axes))
+
+        (x, y), axes, angle = pupils[0]
+        (rx, ry), referenceAxes, referenceAngle = reference[0]
+        assert np.hypot(x - rx, y - ry) <= 2, "{} levels: pupil at {} instead of {}".format(levels, (x, y), (rx, ry))
+
+# a pooled frame may still allocate the fixed size k-means features and
+# the like, but nothing that grows with the frame
+maxPeakGrowthKB = 64
+
+def checkPooledAllocations(images, warmup=5, frames=3):
+    '''
+    After the warmup a pooled frame allocates no frame sized arrays: the
+    BufferPool does not allocate, and (with tracemalloc, Python 3) the peak
+    memory of a pooled frame at 1280x960 is within maxPeakGrowthKB of the
+    peak at 640x480, although the frame is four times bigger
+    '''
+    peaks = []
+    for size in [(640, 480), (1280, 960)]:
+        report = benchmarkAllocations(list(getSyntheticEyeFrames(warmup + frames, size)), warmup)
+        pooled = report['pooled']
+
+        assert pooled['poolAllocations'] == 0, \
+            "{}: the pool allocated {} arrays after the warmup".format(size, pooled['poolAllocations'])
+
+        if report['tracemalloc']:
+            peaks.append(pooled['maxKB'])
+
+    if len(peaks) == 2:
+        assert peaks[1] - peaks[0] <= maxPeakGrowthKB, \
+            "pooled peak grows with the frame: {:.1f} KB at 640x480, {:.1f} KB at 1280x960".format(peaks[0], peaks[1])
+
+def runChecks():
+    images = getCheckImages()
+    checks = [checkOrientationAndMagnitude, checkPupilsPyramid, checkPooledAllocations]
+
+    for check in checks:
+        print("{}...".format(check.__name__), end="")
+        check(images)
+        print(" ok")
+
+    print("{} checks passed on {} images".format(len(checks), len(images)))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the detection on the test frames")
+    parser.add_argument("--checks", action="store_true", help="compare optimized code paths against their reference implementations instead")
+    parser.add_argument("--recompute", action="store_true", help="detect every frame again instead of reading the results of earlier runs from Sequences/Results")
+    args = parser.parse_args()
+
+    if args.checks:
+        runChecks()
+    else:
+        runTests(args.recompute)
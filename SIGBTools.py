@@ -1,9 +1,9 @@
 import cv2
 import numpy as np
+import SIGBCache
+import SIGBTrace
 
 from math import *
-from pylab import *
-from scipy.cluster.vq import *
 # from scipy.misc import imresize
 
 # Various tools for use with the eye tracker
@@ -12,110 +12,351 @@ from scipy.cluster.vq import *
 # I've credited him in the docstrings of the functions that
 # I've copied form him
 
-def getGray(image):
+def getGray(image, dst=None):
     '''
     Wrapper for OpenCV function to convert to grayscale
     
     Params:
         image (numpy array): BGR image as numpy array
+        dst (numpy array): write the result into this array, see BufferPool
         
     Returns:
         (numpy array) grayscale image
     '''
-    return cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    return cv2.cvtColor(image, cv2.COLOR_BGR2GRAY, dst=dst)
 
-def getKMeans(image, featureCount=2, distanceWeight=2, smallSize=(100, 100), show=False):
+def getKMeansFeatures(image, distanceWeight=2, smallSize=(100, 100)):
     '''
-    Calculate k-means for the image
+    Build the feature matrix used for k-means: intensity and position
+    of every pixel of the downsized image
     
     Original Author: Dan Witzner Hansen, IT University
     
     Params:
         image (numpy array): Grayscale image to be used
-        featureCount (int): how many partitions should be created
         distanceWeight (int): > 0 weight of the position parameters
         smallSize (tuple (int, int)): size of the smaller image to perform kmeans on
-        show (bool): Show the kmeans image
+    
+    Returns:
+        (numpy array float32) features, one row (intensity, y, x) per pixel
+    '''
+    small = cv2.resize(image, smallSize)
+
+    features = np.empty((small.size, 3), 'f')
+    features[:, 0] = small.flatten()
+    features[:, 1:] = SIGBCache.getPositionFeatures(tuple(smallSize), distanceWeight)
+
+    return features
+
+def getKMeansScipy(features, featureCount, initial=None):
+    '''
+    k-means backend using scipy.cluster.vq.kmeans, randomly initialized
+    
+    Params:
+        features (numpy array): output of getKMeansFeatures()
+        featureCount (int): how many partitions should be created
+        initial (numpy array): initial centroids (featureCount x 3), random when None
     
     Returns:
         (centroids, variance)
     '''
-    height, width = image.shape
+    # imported on first use, scipy takes longer to import than everything else
+    from scipy.cluster.vq import kmeans
 
-    small = cv2.resize(image, smallSize)
+    if initial is not None:
+        return kmeans(features, np.array(initial, 'f'))
+
+    return kmeans(features, featureCount)
+
+def getKMeansOpenCV(features, featureCount, initial=None, maxIterations=10):
+    '''
+    k-means backend using cv2.kmeans. Deterministic, the initial labels
+    split the pixels by intensity rank into featureCount equally sized groups
+    (or assign them to the closest initial centroid), and the number of
+    iterations is capped
+    
+    Params:
+        features (numpy array): output of getKMeansFeatures()
+        featureCount (int): how many partitions should be created
+        initial (numpy array): initial centroids (featureCount x 3)
+        maxIterations (int): max number of iterations
+    
+    Returns:
+        (centroids, variance)
+    '''
+    if initial is None:
+        ranks = np.empty(len(features), int)
+        ranks[np.argsort(features[:, 0], kind='mergesort')] = np.arange(len(features))
+        labels = ranks * featureCount // len(features)
+    else:
+        labels = getClosestCentroids(features, np.array(initial, 'f'))[0]
+
+    labels = np.array(labels, np.int32).reshape(-1, 1)
+    criteria = (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER, maxIterations, 0.5)
 
-    height, width = small.shape
-    X, Y = np.meshgrid(range(height), range(width))
-    z = small.flatten()
-    x = X.flatten()
-    y = Y.flatten()
+    retval, labels, centroids = cv2.kmeans(data=features, K=featureCount, criteria=criteria, attempts=1,
+                                           flags=cv2.KMEANS_USE_INITIAL_LABELS, bestLabels=labels)
+    SIGBTrace.record("kmeans.compactness", float(retval))
 
-    O = len(x)
+    labels, distances = getClosestCentroids(features, centroids)
 
-    features = np.zeros((O, 3))
-    features[:, 0] = z
-    features[:, 1] = y / distanceWeight
-    features[:, 2] = x / distanceWeight
-    features = np.array(features, 'f')
+    return centroids, distances.mean()
+
+def getKMeansHistogram(features, featureCount, initial=None, maxIterations=20):
+    '''
+    k-means backend clustering only the intensities, using the 256 bin
+    histogram instead of the individual pixels. Deterministic, initialized
+    from the intensity quantiles (or the initial centroids). The position
+    part of the centroids is the mean position of the pixels in the cluster,
+    so the result has the same layout as the other backends
+    
+    Params:
+        features (numpy array): output of getKMeansFeatures()
+        featureCount (int): how many partitions should be created
+        initial (numpy array): initial centroids (featureCount x 3)
+        maxIterations (int): max number of iterations
+    
+    Returns:
+        (centroids, variance)
+    '''
+    intensities = features[:, 0].astype(int)
+    histogram = np.bincount(intensities, minlength=256).astype(float)
+    levels = np.arange(len(histogram), dtype=float)
+
+    if initial is None:
+        cumulative = np.cumsum(histogram) / histogram.sum()
+        quantiles = (np.arange(featureCount) + 0.5) / featureCount
+        centers = levels[np.searchsorted(cumulative, quantiles)]
+    else:
+        centers = np.sort(np.array(initial, float)[:, 0])
+
+    iterations = 0
+    for i in range(maxIterations):
+        iterations += 1
+
+        # in 1D the clusters are intervals between the midpoints of sorted centers
+        bounds = (centers[1:] + centers[:-1]) / 2
+        binLabels = np.searchsorted(bounds, levels)
+
+        counts = np.bincount(binLabels, weights=histogram, minlength=len(centers))
+        sums = np.bincount(binLabels, weights=histogram * levels, minlength=len(centers))
+        newCenters = np.where(counts > 0, sums / np.maximum(counts, 1), centers)
+
+        if np.allclose(newCenters, centers):
+            break
+
+        centers = np.sort(newCenters)
+
+    SIGBTrace.count("kmeans.iterations", iterations)
+
+    bounds = (centers[1:] + centers[:-1]) / 2
+    labels = np.searchsorted(bounds, intensities)
+
+    # drop empty clusters, same as scipy does
+    counts = np.bincount(labels, minlength=len(centers))
+    centroids = np.zeros((len(centers), 3), 'f')
+    for column in range(3):
+        centroids[:, column] = np.bincount(labels, weights=features[:, column], minlength=len(centers)) / np.maximum(counts, 1)
+    centroids = centroids[counts > 0]
+
+    labels, distances = getClosestCentroids(features, centroids)
+
+    return centroids, distances.mean()
+
+def getClosestCentroids(features, centroids):
+    '''
+    Assign every feature to its closest centroid
+    
+    Params:
+        features (numpy array): observations, one per row
+        centroids (numpy array): centroids, one per row
+    
+    Returns:
+        (labels, distances): index of the closest centroid and distance to it for every feature
+    '''
+    # one centroid at a time keeping the closest so far, broadcasting all of
+    # them at once makes a features x centroids x 3 temporary, several times
+    # the size of the frame
+    difference = np.empty(features.shape, np.result_type(features, centroids))
+    distance = np.empty(len(features), difference.dtype)
+    distances = np.empty(len(features), difference.dtype)
+    labels = np.zeros(len(features), int)
+
+    for i, centroid in enumerate(centroids):
+        np.subtract(features, centroid, out=difference)
+        difference **= 2
+        difference.sum(axis=1, out=distance if i > 0 else distances)
+
+        if i > 0:
+            # strictly closer, ties keep the first centroid like argmin
+            closer = distance < distances
+            distances[closer] = distance[closer]
+            labels[closer] = i
+
+    return labels, np.sqrt(distances, out=distances)
+
+def getKMeansHierarchy(features, centroids, minCount=1):
+    '''
+    Derive clusterings with fewer clusters from a k-means result without
+    running k-means again. The two clusters whose merge increases the k-means
+    cost the least (Ward distance) are merged repeatedly until minCount
+    clusters are left
+    
+    Params:
+        features (numpy array): output of getKMeansFeatures()
+        centroids (numpy array): k-means centroids for features
+        minCount (int): smallest number of clusters to derive
+    
+    Returns:
+        list of centroid arrays, the first one is centroids and each next one has one cluster less
+    '''
+    centroids = np.array(centroids, float)
+    labels, distances = getClosestCentroids(features, centroids)
+    counts = np.bincount(labels, minlength=len(centroids)).astype(float)
+
+    # clusters nothing was assigned to can not be merged into anything
+    centroids = centroids[counts > 0]
+    counts = counts[counts > 0]
+
+    hierarchy = [centroids]
+    while len(centroids) > max(1, minCount):
+        bestCost = None
+        for a in range(len(centroids)):
+            for b in range(a + 1, len(centroids)):
+                cost = counts[a] * counts[b] / (counts[a] + counts[b]) * ((centroids[a] - centroids[b]) ** 2).sum()
+                if bestCost is None or cost < bestCost:
+                    bestCost = cost
+                    best = (a, b)
+
+        a, b = best
+        merged = (centroids[a] * counts[a] + centroids[b] * counts[b]) / (counts[a] + counts[b])
+        keep = [i for i in range(len(centroids)) if i != a and i != b]
+
+        centroids = np.vstack([centroids[keep], merged])
+        counts = np.append(counts[keep], counts[a] + counts[b])
+
+        hierarchy.append(centroids)
+
+    return hierarchy
+
+# Available k-means backends for getKMeans(), new backends can be registered
+# here, they have to accept (features, featureCount, initial) and return (centroids, variance)
+kmeansMethods = {
+    "scipy": getKMeansScipy,
+    "opencv": getKMeansOpenCV,
+    "histogram": getKMeansHistogram
+}
+
+def getKMeans(image, featureCount=2, distanceWeight=2, smallSize=(100, 100), show=False, method="scipy", initial=None, features=None):
+    '''
+    Calculate k-means for the image
+    
+    Original Author: Dan Witzner Hansen, IT University
+    
+    Params:
+        image (numpy array): Grayscale image to be used
+        featureCount (int): how many partitions should be created
+        distanceWeight (int): > 0 weight of the position parameters
+        smallSize (tuple (int, int)): size of the smaller image to perform kmeans on
+        show (bool): Show the kmeans image
+        method (string): k-means backend, one of kmeansMethods ("scipy", "opencv", "histogram")
+        initial (numpy array): initial centroids, e.g. from the previous frame
+        features (numpy array): getKMeansFeatures() of the image when already computed
+    
+    Returns:
+        (centroids, variance)
+    '''
+    if features is None:
+        features = getKMeansFeatures(image, distanceWeight=distanceWeight, smallSize=smallSize)
 
-    centroids, variance = kmeans(features, featureCount)
+    centroids, variance = kmeansMethods[method](features, featureCount, initial)
+    SIGBTrace.count("kmeans.calls")
+    SIGBTrace.record("kmeans.method", method)
 
     if show:
-        label, distance = vq(features, centroids)
+        width, height = smallSize
+        label, distance = getClosestCentroids(features, centroids)
         labelIm = np.array(np.reshape(label, (height, width)))
-        f = figure(1)
-        imshow(labelIm)
+        import matplotlib.pyplot as plt
+        f = plt.figure(1)
+        plt.imshow(labelIm)
         f.canvas.draw()
         f.show()
 
     return centroids, variance
 
-def getOrientationAndMagnitude(image, show=False):
+def getOrientationAndMagnitude(image, show=False, buffers=None):
     '''
     Calculate orientation and magnitude of the gradient image
     and return it as vector arrays
     
-    Uses cv2.fastAtan2 for fast orientation calc, cv2.magnitude
-    for fast magnitude calculation
+    Uses cv2.cartToPolar to compute both arrays for the whole image at once,
+    the orientation follows the cv2.fastAtan2(h, v) convention (degrees 0-360)
     
     Params:
         image (numpy array): grayscale image to compute this on
         show (bool): show intermediate steps
+        buffers (BufferPool): compute into the arrays of this pool instead of new ones
     
     Returns:
-        (orientation, magnitude): numpy arrays
+        (orientation, magnitude): float32 numpy arrays
     '''
-    sobelHorizontal = cv2.Sobel(image, cv2.CV_32F, 1, 0)
-    sobelVertical = cv2.Sobel(image, cv2.CV_32F, 0, 1)
+    if buffers is None:
+        buffers = BufferPool.none
+
+    shape = image.shape[:2]
+    sobelHorizontal = cv2.Sobel(image, cv2.CV_32F, 1, 0, dst=buffers.get("sobelHorizontal", shape, np.float32))
+    sobelVertical = cv2.Sobel(image, cv2.CV_32F, 0, 1, dst=buffers.get("sobelVertical", shape, np.float32))
 
     h = sobelHorizontal
     v = sobelVertical
 
+    # passing (v, h) as (x, y) gives atan2(h, v), same as fastAtan2(h, v)
+    magnitude, orientation = cv2.cartToPolar(v, h, magnitude=buffers.get("magnitude", shape, np.float32), angle=buffers.get("orientation", shape, np.float32), angleInDegrees=True)
+
+    if show:
+        import matplotlib.pyplot as plt
+
+        fig = plt.figure()
+        plt.imshow(magnitude)
+        plt.show()
+
+        fig2 = plt.figure()
+        res = 7
+        plt.quiver(h[::res, ::res], -v[::res, ::res])
+        plt.imshow(image[::res, ::res], cmap=plt.gray())
+        plt.show()
+
+    return orientation, magnitude
+
+def getOrientationAndMagnitudeLoop(image):
+    '''
+    Reference version of getOrientationAndMagnitude
+
+    Calls cv2.fastAtan2 for every pixel like the original implementation did,
+    it is very slow and only kept to check the vectorized version against
+
+    Params:
+        image (numpy array): grayscale image to compute this on
+
+    Returns:
+        (orientation, magnitude): numpy arrays
+    '''
+    h = cv2.Sobel(image, cv2.CV_32F, 1, 0)
+    v = cv2.Sobel(image, cv2.CV_32F, 0, 1)
+
     orientation = np.empty(image.shape)
-    magnitude = np.empty(image.shape)
 
     height, width = h.shape
     for y in range(height):
         for x in range(width):
-            orientation[y][x] = cv2.fastAtan2(h[y][x], v[y][x])
+            orientation[y][x] = cv2.fastAtan2(float(h[y][x]), float(v[y][x]))
 
     magnitude = cv2.magnitude(h, v)
 
-    if show:
-
-        fig = figure()
-        imshow(magnitude)
-        matplotlib.pyplot.show()
-
-        fig2 = figure()
-        res = 7
-        quiver(h[::res, ::res], -v[::res, ::res])
-        imshow(image[::res, ::res], cmap=gray())
-        matplotlib.pyplot.show()
-
     return orientation, magnitude
 
-def getClosed(image, size=5):
+def getClosed(image, size=5, dst=None):
     '''
     Morphologically closed image
     
@@ -125,16 +366,17 @@ def getClosed(image, size=5):
     Args:
         image (Numpy Array): input bitmap image
         size (int): kernel size (1,3,5,7)
+        dst (numpy array): write the result into this array, see BufferPool
     
     Returns:
         filtered bitmap
     '''
-    kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (2 * size + 1, 2 * size + 1))
-    image = cv2.morphologyEx(image, cv2.MORPH_CLOSE, kernel)
+    kernel = SIGBCache.getStructuringElement(cv2.MORPH_RECT, (2 * size + 1, 2 * size + 1))
+    image = cv2.morphologyEx(image, cv2.MORPH_CLOSE, kernel, dst=dst)
 
     return image
 
-def getOpen(image, size=5):
+def getOpen(image, size=5, dst=None):
     '''
     Morphologically open image
     
@@ -144,42 +386,195 @@ def getOpen(image, size=5):
     Args:
         image (Numpy Array): input bitmap image
         size (int): kernel size (1,3,5,7)
+        dst (numpy array): write the result into this array, see BufferPool
     
     Returns:
         filtered bitmap
     '''
-    kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (2 * size + 1, 2 * size + 1))
-    image = cv2.morphologyEx(image, cv2.MORPH_OPEN, kernel)
+    kernel = SIGBCache.getStructuringElement(cv2.MORPH_RECT, (2 * size + 1, 2 * size + 1))
+    image = cv2.morphologyEx(image, cv2.MORPH_OPEN, kernel, dst=dst)
 
     return image
 
-def applyGradient(image):
+def applyGradient(image, dst=None):
     '''
     Apply radial gradient (alpha -> white) from the center of the image
     creating a sort of 'vignette' effect to counter black borders of some
     images that were causing false pupil detects...
-    Not used
+    
+    The gradient is cached per resolution (SIGBCache.getGradientMask()) and
+    added with a saturating cv2.add
     
     Params:
         image (numpy array): image to apply the gradient to
+        dst (numpy array): write the result into this array, see BufferPool
     
     Returns:
-        image (numpy array) image with the gradient applied
+        image (numpy array) new grayscale image with the gradient applied
     '''
     if len(image.shape) == 3:
         image = getGray(image)
 
-    height, width = image.shape
+    return cv2.add(image, SIGBCache.getGradientMask(image.shape[:2]), dst=dst)
 
-    center = (width / 2, height / 2)
-    for y, row in enumerate(image):
-        for x, value in enumerate(row):
-            dx = float(x - center[0]) / float(center[0])
-            dy = float(y - center[1]) / float(center[1])
-            weight = sqrt((dx ** 2 + dy ** 2) * 0.5)
-            image[y][x] = min(255, int(image[y][x] + 255 * weight))
+class BufferPool:
+    '''Reusable arrays for the intermediate images of a video
+    
+    Every frame of a video needs the same full size intermediates (grayscale,
+    thresholded, gradients, the image the results are drawn into...). get()
+    returns an array from the memory kept under a name and only allocates
+    when the name is used for the first time or needs more memory than it
+    has (a bigger resolution), the OpenCV functions then write into it with
+    dst=, so a video allocates them once instead of once per frame. Crops of
+    varying size (tracker and iris regions) reserve the size of the whole
+    frame, so they all fit into the same memory.
+    
+    The arrays are overwritten by the next frame, keep a copy of anything
+    that has to outlive the frame. A pool must not be shared between threads
+    
+    BufferPool.none is a pool that never keeps anything, its get() returns
+    None which makes the OpenCV functions allocate as usual
+    
+    Counters:
+        allocations: arrays allocated so far
+    
+    Example:
+        buffers = BufferPool()
+        for frameId, image in source.getFrames():
+            context = FrameContext(image, buffers)
+            eye = getEye(context)
+            result = drawEye(image, eye, buffers.get("result", image.shape))
+    '''
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self.buffers = dict()
+        self.allocations = 0
+
+    def get(self, name, shape, dtype=np.uint8, capacity=None):
+        '''
+        Params:
+            name (string): what the array is used for, one array per name
+            shape (tuple): shape of the array
+            dtype (numpy dtype): type of the array
+            capacity (int): number of elements to reserve when allocating, for
+                            arrays whose shape changes from frame to frame
+        
+        Returns:
+            (numpy array) uninitialized array, None when the pool is disabled
+        '''
+        if not self.enabled:
+            return None
 
-    return image
+        size = int(np.prod(shape))
+        buffer = self.buffers.get(name)
+        if buffer is None or buffer.size < size or buffer.dtype != dtype:
+            buffer = np.empty(max(size, capacity or 0), dtype)
+            self.buffers[name] = buffer
+            self.allocations += 1
+
+        return buffer[:size].reshape(shape)
+
+BufferPool.none = BufferPool(enabled=False)
+
+class FrameContext:
+    '''Per-frame analysis context shared between the detectors
+    
+    Wraps one BGR frame and lazily computes the intermediate images the
+    detectors need. Every intermediate is computed at most once and then
+    memoized, so passing the same context to getPupils, getIrisForPupil and
+    getGlints converts to grayscale only once, etc.
+    
+    The following methods can be used:
+    
+    getGray: grayscale image
+    getEqualized: histogram equalized grayscale image, optionally with applyGradient()
+    getKMeansFeatures: feature matrix of getKMeansFeatures, memoized per parameters
+    getKMeans: centroids and variance of getKMeans, memoized per parameters
+               (initial centroids only count when it runs for the first time)
+    getOrientationAndMagnitude: gradient orientation and magnitude of the grayscale image
+    
+    The memoized arrays are shared, treat them as read only. With a
+    BufferPool the intermediates are computed into its arrays, so they are
+    only valid until the next frame is processed with the same pool
+    
+    Example:
+        context = FrameContext(image)
+        pupils = getPupils(context)
+        iris = getIrisForPupil(context, pupils[0])
+        glints = getGlints(context, iris)
+    '''
+    def __init__(self, image, buffers=None):
+        self.image = image
+        self.buffers = BufferPool.none if buffers is None else buffers
+        self.gray = None
+        self.equalized = None
+        self.vignetted = None
+        self.kmeansFeatures = dict()
+        self.kmeans = dict()
+        self.orientationAndMagnitude = None
+
+    def getGray(self):
+        if self.gray is None:
+            self.gray = getGray(self.image, dst=self.buffers.get("gray", self.image.shape[:2]))
+
+        return self.gray
+
+    def getEqualized(self, vignette=False):
+        if self.equalized is None:
+            gray = self.getGray()
+            self.equalized = cv2.equalizeHist(gray, dst=self.buffers.get("equalized", gray.shape))
+
+        if vignette:
+            if self.vignetted is None:
+                self.vignetted = applyGradient(self.equalized, dst=self.buffers.get("vignetted", self.equalized.shape))
+
+            return self.vignetted
+
+        return self.equalized
+
+    def getKMeansImage(self, equalized=False, vignette=False):
+        if equalized:
+            return self.getEqualized(vignette)
+
+        return self.getGray()
+
+    def getKMeansFeatures(self, distanceWeight=2, smallSize=(100, 100), equalized=False, vignette=False):
+        key = (distanceWeight, tuple(smallSize), equalized, vignette)
+
+        if key not in self.kmeansFeatures:
+            self.kmeansFeatures[key] = getKMeansFeatures(self.getKMeansImage(equalized, vignette), distanceWeight=distanceWeight, smallSize=smallSize)
+
+        return self.kmeansFeatures[key]
+
+    def getKMeans(self, featureCount=2, distanceWeight=2, smallSize=(100, 100), equalized=False, show=False, method="scipy", vignette=False, initial=None):
+        key = (featureCount, distanceWeight, tuple(smallSize), equalized, method, vignette)
+
+        if key not in self.kmeans:
+            features = self.getKMeansFeatures(distanceWeight, smallSize, equalized, vignette)
+            self.kmeans[key] = getKMeans(self.getKMeansImage(equalized, vignette), featureCount=featureCount, distanceWeight=distanceWeight, smallSize=smallSize, show=show, method=method, initial=initial, features=features)
+
+        return self.kmeans[key]
+
+    def getOrientationAndMagnitude(self):
+        if self.orientationAndMagnitude is None:
+            self.orientationAndMagnitude = getOrientationAndMagnitude(self.getGray(), buffers=self.buffers)
+
+        return self.orientationAndMagnitude
+
+def getFrameContext(image):
+    '''
+    Wrap image into a FrameContext unless it already is one
+    
+    Params:
+        image (numpy array or FrameContext): BGR image or existing context
+    
+    Returns:
+        (FrameContext) context for the image
+    '''
+    if isinstance(image, FrameContext):
+        return image
+
+    return FrameContext(image)
 
 class ContourTools:
     '''Class used for getting descriptors of contour-based connected components 
@@ -203,7 +598,7 @@ class ContourTools:
     Returns: Dictionary with key equal to the property name
     
     Example: 
-         contours, hierarchy = cv2.findContours(I, cv2.RETR_LIST, cv2.CHAIN_APPROX_SIMPLE)  
+         contours, hierarchy = cv2.findContours(I, cv2.RETR_LIST, cv2.CHAIN_APPROX_SIMPLE)[-2:]  
          goodContours = []
          for c in contours:
             contour = ContourTools(c)
@@ -252,10 +647,210 @@ class ContourTools:
     def getConvexHull(self):
         return cv2.convexHull(self.contour)
 
+class ContourBatch(object):
+    '''Descriptors of many contours at once, stored as numpy columns
+
+    contours: list of contours found through cv2.findContours
+
+    Every descriptor is computed once, when the batch is created, so the
+    filtering can be done with boolean masks instead of one ContourTools
+    object per contour. Row i of every column belongs to contours[i]
+
+    area: Area within the contour - float array (n,)
+    boundingBox: (topleft.x, topleft.y, width, height) - int array (n, 4)
+    moments: m00, m10, m01 - float array (n, 3)
+    centroid: The center of the contour, (-1, -1) when m00 is 0 - float array (n, 2)
+    extent: Ratio of the area and the area of the bounding box - float array (n,)
+    equivDiameter: sqrt(4*Area/pi) - float array (n,)
+
+    Example:
+         contours, hierarchy = cv2.findContours(I, cv2.RETR_LIST, cv2.CHAIN_APPROX_SIMPLE)[-2:]
+         batch = ContourBatch(contours)
+         goodContours = batch.filter((batch.area > 100) & (batch.area < 200)).contours
+    '''
+    __slots__ = ("contours", "area", "boundingBox", "moments", "centroid", "extent", "equivDiameter")
+    columns = __slots__[1:]
+
+    def __init__(self, contours):
+        n = len(contours)
+
+        self.contours = list(contours)
+        self.area = np.zeros(n)
+        self.boundingBox = np.zeros((n, 4), dtype=int)
+        self.moments = np.zeros((n, 3))
+
+        for i, contour in enumerate(self.contours):
+            m = cv2.moments(contour)
+
+            self.area[i] = cv2.contourArea(contour)
+            self.boundingBox[i] = cv2.boundingRect(contour)
+            self.moments[i] = (m['m00'], m['m10'], m['m01'])
+
+        m00 = self.moments[:, 0]
+        nonZero = m00 != 0
+        self.centroid = np.empty((n, 2))
+        self.centroid.fill(-1)
+        self.centroid[nonZero] = self.moments[nonZero, 1:] / m00[nonZero, np.newaxis]
+
+        boxArea = self.boundingBox[:, 2] * self.boundingBox[:, 3]
+        self.extent = self.area / np.maximum(boxArea, 1)
+        self.equivDiameter = np.sqrt(4 * self.area / np.pi)
+
+    def __len__(self):
+        return len(self.area)
+
+    def filter(self, mask):
+        '''
+        Subset of the batch, without recomputing the descriptors
+
+        Params:
+            mask (numpy array): boolean mask or array of indices into the batch
+
+        Returns:
+            batch of the same type with the selected rows, in the order of mask
+        '''
+        indices = np.arange(len(self))[mask]
+
+        batch = self.__class__.__new__(self.__class__)
+        batch.contours = None if self.contours is None else [self.contours[i] for i in indices]
+        for name in self.columns:
+            setattr(batch, name, getattr(self, name)[indices])
+
+        return batch
+
+    def getCentroidInt(self):
+        return self.centroid.astype(int)
+
+    def getConvexHulls(self):
+        return [cv2.convexHull(contour) for contour in self.getContours()]
+
+    def getContours(self):
+        return self.contours
+
+class ComponentBatch(ContourBatch):
+    '''Same columns as ContourBatch, computed by cv2.connectedComponentsWithStats
+
+    binary: binary image, like the one passed to cv2.findContours
+
+    Area, bounding box and centroid of all the blobs come from one call per
+    polarity, the area being the pixel count of the blob (the contour area of
+    the same blob is a bit smaller). Like cv2.RETR_LIST, the batch has the
+    white blobs (8-connected) and the holes in them: black blobs (4-connected)
+    that do not touch the border of the image. The outer contour of a blob is
+    only traced when getContours() asks for it, so filter the batch first
+
+    holes: True for the rows that are holes - bool array (n,)
+
+    Needs OpenCV 3 or newer, see componentsAvailable
+    '''
+    __slots__ = ("labels", "ids", "holes")
+    columns = ContourBatch.columns + ("ids", "holes")
+
+    def __init__(self, binary):
+        height, width = binary.shape[:2]
+
+        blobCount, blobLabels, blobStats, blobCentroids = cv2.connectedComponentsWithStats(binary, connectivity=8)
+        holeCount, holeLabels, holeStats, holeCentroids = cv2.connectedComponentsWithStats((binary == 0).astype(np.uint8), connectivity=4)
+
+        # label 0 is the background of both, black blobs touching the border are not holes
+        left, top, right, bottom = holeStats[:, 0], holeStats[:, 1], holeStats[:, 0] + holeStats[:, 2], holeStats[:, 1] + holeStats[:, 3]
+        holeIds = np.flatnonzero((left > 0) & (top > 0) & (right < width) & (bottom < height))
+        holeIds = holeIds[holeIds > 0]
+
+        self.labels = (blobLabels, holeLabels)
+        self.ids = np.concatenate((np.arange(1, blobCount), holeIds))
+        self.holes = np.concatenate((np.zeros(blobCount - 1, bool), np.ones(len(holeIds), bool)))
+        self.contours = None
+
+        stats = np.concatenate((blobStats[1:], holeStats[holeIds]))
+        self.area = stats[:, cv2.CC_STAT_AREA].astype(float)
+        self.boundingBox = stats[:, :4].astype(int)
+        self.centroid = np.concatenate((blobCentroids[1:], holeCentroids[holeIds]))
+        self.moments = np.column_stack((self.area, self.centroid * self.area[:, np.newaxis]))
+
+        boxArea = self.boundingBox[:, 2] * self.boundingBox[:, 3]
+        self.extent = self.area / np.maximum(boxArea, 1)
+        self.equivDiameter = np.sqrt(4 * self.area / np.pi)
+
+    def filter(self, mask):
+        batch = ContourBatch.filter(self, mask)
+        batch.labels = self.labels
+
+        return batch
+
+    def getContours(self):
+        if self.contours is None:
+            self.contours = []
+            for label, hole, (x, y, width, height) in zip(self.ids, self.holes, self.boundingBox):
+                labels = self.labels[int(hole)]
+                blob = (labels[y:y + height, x:x + width] == label).astype(np.uint8)
+                # OpenCV 3 returns (image, contours, hierarchy), 2.4 and 4 (contours, hierarchy)
+                contours, hierarchy = cv2.findContours(blob, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE, offset=(int(x), int(y)))[-2:]
+                self.contours.append(max(contours, key=len))
+
+        return self.contours
+
+# cv2.connectedComponentsWithStats is not part of OpenCV 2.4
+componentsAvailable = hasattr(cv2, "connectedComponentsWithStats")
+
+def getContourBatch(binary):
+    # OpenCV 3 returns (image, contours, hierarchy), 2.4 and 4 (contours, hierarchy)
+    contours, hierarchy = cv2.findContours(binary, cv2.RETR_LIST, cv2.CHAIN_APPROX_SIMPLE)[-2:]
+
+    return ContourBatch(contours)
+
+def getComponentBatch(binary):
+    if not componentsAvailable:
+        return getContourBatch(binary)
+
+    return ComponentBatch(binary)
+
+blobMethods = {
+    "contours": getContourBatch,
+    "components": getComponentBatch
+}
+
+def getBlobs(binary, method="contours"):
+    '''
+    Finds the blobs of a binary image along with their descriptors
+
+    Params:
+        binary (numpy array): binary image, may be modified (cv2.findContours)
+        method (string): "contours" for cv2.findContours and ContourBatch,
+                         "components" for cv2.connectedComponentsWithStats and
+                         ComponentBatch, falls back to "contours" when the
+                         OpenCV build does not have it
+
+    Returns:
+        (ContourBatch) one row per blob, use getContours() for the contours
+    '''
+    return blobMethods[method](binary)
+
+def getCircleRegion(center, radius, shape):
+    '''
+    Bounding box of a circle, clipped to the image
+    
+    Params:
+        center (tuple (x, y)): center of the circle
+        radius (float): radius of the circle
+        shape (tuple (height, width)): shape of the image
+    
+    Returns:
+        (x, y, width, height) of the region
+    '''
+    height, width = shape[:2]
+
+    x1 = min(width, max(0, int(center[0] - radius)))
+    y1 = min(height, max(0, int(center[1] - radius)))
+    x2 = min(width, max(0, int(center[0] + radius) + 1))
+    y2 = min(height, max(0, int(center[1] + radius) + 1))
+
+    return (x1, y1, x2 - x1, y2 - y1)
+
 def getCircleSamples(center=(0, 0), radius=1, nPoints=30):
     '''
     Samples a circle with center center = (x,y) , radius =1 and in nPoints on the circle.
-    Returns an array of a tuple containing the points (x,y) on the circle and the curve gradient in the point (dx,dy)
+    Returns an array containing the points (x,y) on the circle and the curve gradient in the point (dx,dy)
     Notice the gradient (dx,dy) has unit length
     
     Original Author: Dan Witzner Hansen, IT University
@@ -266,13 +861,15 @@ def getCircleSamples(center=(0, 0), radius=1, nPoints=30):
         nPoints (int): how many samples do you want
     
     Returns:
-        list of samples (tuple containing the points (x,y) on the circle and the curve gradient in the point (dx,dy))
+        numpy array nPoints x 4, one sample (x, y, dx, dy) per row
     '''
+    directions = SIGBCache.getCircleDirections(nPoints)
 
+    P = np.empty((nPoints, 4))
+    P[:, 0] = radius * directions[:, 0] + center[0]
+    P[:, 1] = radius * directions[:, 1] + center[1]
+    P[:, 2:] = directions
 
-    s = np.linspace(0, 2 * math.pi, nPoints)
-    # points
-    P = [(radius * np.cos(t) + center[0], radius * np.sin(t) + center[1], np.cos(t), np.sin(t)) for t in s ]
     return P
 
 def getLineCoordinates(p1, p2):
@@ -334,3 +931,43 @@ def getLineCoordinates(p1, p2):
 
 
     return retPoints
+
+def getRaySamples(center, innerRadius, outerRadius, nRays=30):
+    '''
+    Sample nRays rays going from a circle with radius innerRadius to a circle
+    with radius outerRadius, both centered at center. All the rays are sampled
+    at once, one sample per pixel along the major axis of each ray (the same
+    density as getLineCoordinates), so the result can be used to index images
+    directly.
+    
+    Params:
+        center (tuple (int x, int y)): center of both circles
+        innerRadius (float): radius where the rays start
+        outerRadius (float): radius where the rays end
+        nRays (int): how many rays to sample
+    
+    Returns:
+        (starts, ends, X, Y, valid):
+            starts, ends (numpy arrays nRays x 2): integer start and end points of the rays
+            X, Y (numpy arrays nRays x nSamples): integer coordinates of the samples
+            valid (numpy array nRays x nSamples): True for samples that lie on the ray,
+                rays shorter than the longest one are padded
+    '''
+    starts = getCircleSamples(center, innerRadius, nRays)[:, :2].astype(int)
+    ends = getCircleSamples(center, outerRadius, nRays)[:, :2].astype(int)
+
+    delta = ends - starts
+    # number of steps along the major axis of each ray
+    lengths = np.abs(delta).max(axis=1)
+
+    steps = np.arange(lengths.max() + 1)
+    valid = steps[np.newaxis, :] <= lengths[:, np.newaxis]
+
+    # position of every sample along its ray in range 0 - 1
+    t = steps[np.newaxis, :] / np.maximum(lengths, 1)[:, np.newaxis].astype(float)
+    t = np.minimum(t, 1.0)
+
+    X = np.floor(starts[:, 0, np.newaxis] + t * delta[:, 0, np.newaxis] + 0.5).astype(int)
+    Y = np.floor(starts[:, 1, np.newaxis] + t * delta[:, 1, np.newaxis] + 0.5).astype(int)
+
+    return starts, ends, X, Y, valid
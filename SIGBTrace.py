@@ -0,0 +1,151 @@
+import csv
+import json
+import time
+import threading
+from contextlib import contextmanager
+
+# Instrumentation for the detection pipeline
+#
+# The detectors report what happened inside them (number of contours, candidates,
+# thresholds tried, ...) through count() and record(). Nothing is collected unless
+# a Tracer is active in the current thread, in which case the values are stored
+# per frame and can be exported to CSV or JSON to find out which stage blew up
+# on slow frames.
+#
+# Example:
+#    with Tracer() as tracer:
+#        for frameId, image in source.getFrames():
+#            with tracer.frame(frameId):
+#                getEye(image)
+#    tracer.writeCSV("trace.csv")
+
+# the active tracer is per thread, so concurrent pipelines don't mix their frames
+state = threading.local()
+
+def getTracer():
+    '''
+    Returns:
+        (Tracer) tracer active in this thread or None
+    '''
+    return getattr(state, 'tracer', None)
+
+def count(name, value=1):
+    '''
+    Add value to the counter name of the current frame, does nothing when
+    no tracer is active
+    
+    Params:
+        name (string): counter name, e.g. "pupils.contours"
+        value (number): how much to add
+    '''
+    tracer = getattr(state, 'tracer', None)
+    if tracer is not None:
+        tracer.count(name, value)
+
+def record(name, value):
+    '''
+    Set the value name of the current frame, does nothing when no tracer
+    is active
+    
+    Params:
+        name (string): value name, e.g. "kmeans.method"
+        value: anything that can be written to CSV/JSON
+    '''
+    tracer = getattr(state, 'tracer', None)
+    if tracer is not None:
+        tracer.record(name, value)
+
+class Tracer:
+    '''Collects the values reported by the detectors, per frame
+    
+    Activate it using the with statement, only the thread that activated it
+    reports into it. Values reported outside of frame() go to an implicit
+    frame with frameId None.
+    
+    Every frame is a dict: frame -> frameId, time -> ms spent in frame(),
+    and the reported counters/values
+    '''
+    def __init__(self):
+        self.frames = []
+        self.current = None
+        self.previous = None
+
+    def __enter__(self):
+        self.previous = getTracer()
+        state.tracer = self
+        return self
+
+    def __exit__(self, type, value, traceback):
+        state.tracer = self.previous
+        self.previous = None
+
+    @contextmanager
+    def frame(self, frameId):
+        '''
+        Everything reported inside the with block belongs to frame frameId
+        
+        Params:
+            frameId: frame identifier, written to the "frame" column
+        '''
+        self.current = {'frame': frameId}
+        self.frames.append(self.current)
+
+        start = time.time()
+        try:
+            yield self.current
+        finally:
+            self.current['time'] = (time.time() - start) * 1000.0
+            self.current = None
+
+    def getCurrentFrame(self):
+        if self.current is None:
+            self.current = {'frame': None}
+            self.frames.append(self.current)
+
+        return self.current
+
+    def count(self, name, value=1):
+        frame = self.getCurrentFrame()
+        frame[name] = frame.get(name, 0) + value
+
+    def record(self, name, value):
+        self.getCurrentFrame()[name] = value
+
+    def getColumns(self):
+        '''
+        Returns:
+            list of all value names reported in any frame, frame and time first
+        '''
+        names = set()
+        for frame in self.frames:
+            names.update(frame.keys())
+
+        names.discard('frame')
+        names.discard('time')
+
+        return ['frame', 'time'] + sorted(names)
+
+    def writeCSV(self, filename):
+        '''
+        Write one row per frame, values not reported in a frame are empty
+        
+        Params:
+            filename (string): path of the CSV file
+        '''
+        columns = self.getColumns()
+
+        with open(filename, 'w') as f:
+            writer = csv.writer(f)
+            writer.writerow(columns)
+            for frame in self.frames:
+                writer.writerow([frame.get(column, '') for column in columns])
+
+    def writeJSON(self, filename):
+        '''
+        Write list of frames as JSON
+        
+        Params:
+            filename (string): path of the JSON file
+        '''
+        with open(filename, 'w') as f:
+            json.dump(self.frames, f, indent=2)
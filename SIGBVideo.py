@@ -0,0 +1,144 @@
+import cv2
+import numpy as np
+from collections import OrderedDict
+from SIGBCompat import CAP_PROP_FRAME_COUNT, CAP_PROP_POS_FRAMES
+
+class FrameSource:
+    '''Frame reader for video files that avoids seeking
+    
+    cv2.VideoCapture.set(CV_CAP_PROP_POS_FRAMES) has to decode the video
+    again from the nearest keyframe with inter-frame codecs (XVID), so
+    seeking before every read makes even linear reading slow. FrameSource
+    keeps track of the position of the capture and only seeks when it has to:
+    
+    getFrames: generator decoding a range of frames sequentially, never seeks
+               more than once
+    getFrame: random access to one frame, reads forward when the frame is
+              close ahead of the current position, seeks otherwise. Decoded
+              frames are kept in an LRU cache, so scrubbing back and forth
+              around the same position does not decode anything
+    
+    Example:
+        source = FrameSource("Sequences/eye1.avi")
+        for frameId, image in source.getFrames():
+            ...
+        image = source.getFrame(120)
+    '''
+    def __init__(self, videoFile, cacheSize=64, maxSkip=100):
+        '''
+        Params:
+            videoFile (string): path to the video
+            cacheSize (int): how many decoded frames getFrame() keeps
+            maxSkip (int): read forward instead of seeking when the requested
+                           frame is at most this many frames ahead
+        '''
+        self.videoFile = videoFile
+        self.video = cv2.VideoCapture(videoFile)
+        self.cacheSize = cacheSize
+        self.maxSkip = maxSkip
+
+        # index of the frame the next read() of the capture will return, None when unknown
+        self.position = 0
+        self.cache = OrderedDict()
+
+        self.seekCount = 0
+        self.decodeCount = 0
+
+    def getFrameCount(self):
+        '''
+        Returns:
+            (int) number of frames in the video
+        '''
+        return int(self.video.get(CAP_PROP_FRAME_COUNT))
+
+    def getFrame(self, frameIndex):
+        '''
+        Random access to one frame of the video
+        
+        Params:
+            frameIndex (int): frame number in the video
+        
+        Returns:
+            (numpy array) the frame, it is a copy and can be drawn into, None
+            when the frame could not be read
+        '''
+        if frameIndex in self.cache:
+            image = self.cache.pop(frameIndex)
+        else:
+            image = self.decode(frameIndex)
+            if image is None:
+                return None
+
+        self.cache[frameIndex] = image
+        while len(self.cache) > self.cacheSize:
+            self.cache.popitem(last=False)
+
+        return np.copy(image)
+
+    def getFrames(self, start=0, stop=None, reuse=False):
+        '''
+        Generator decoding frames sequentially, the frames are not cached
+        
+        Params:
+            start (int): first frame
+            stop (int): frame to stop before, end of the video when None
+            reuse (bool): decode every frame into the same array, a frame is
+                          only valid until the next one is read
+        
+        Returns:
+            generator of (frameIndex, image), stops at the first frame that could not be read
+        '''
+        if stop is None:
+            stop = self.getFrameCount()
+
+        image = None
+        for frameIndex in range(start, stop):
+            image = self.decode(frameIndex, image if reuse else None)
+            if image is None:
+                return
+
+            yield frameIndex, image
+
+    def decode(self, frameIndex, image=None):
+        '''
+        Decode frame frameIndex, seek only when the frame is behind or far
+        ahead of the current position
+        
+        Params:
+            frameIndex (int): frame number in the video
+            image (numpy array): decode into this array, a new one when None
+        
+        Returns:
+            (numpy array) the frame or None
+        '''
+        if self.position is None or frameIndex < self.position or frameIndex - self.position > self.maxSkip:
+            self.video.set(CAP_PROP_POS_FRAMES, frameIndex)
+            self.position = frameIndex
+            self.seekCount += 1
+
+        while self.position < frameIndex:
+            if not self.video.grab():
+                # position is unknown now, seek next time
+                self.position = None
+                return None
+            self.position += 1
+
+        if image is None:
+            retval, image = self.video.read()
+        else:
+            retval, image = self.video.read(image)
+        if not retval:
+            self.position = None
+            return None
+
+        self.position += 1
+        self.decodeCount += 1
+
+        return image
+
+    def release(self):
+        '''
+        Release the video and the cached frames
+        '''
+        self.video.release()
+        self.cache.clear()
@@ -1,5 +1,10 @@
 import cv2
+import threading
 import numpy as np
+from collections import OrderedDict
+from SIGBCompat import CAP_PROP_FPS, CAP_PROP_FRAME_COUNT, CAP_PROP_FRAME_HEIGHT, CAP_PROP_FRAME_WIDTH, getFourCC
+from SIGBVideo import FrameSource
+from SIGBLive import FrameQueue, LivePipeline, printStats
 
 class SIGBWindows:
     '''
@@ -10,30 +15,67 @@ class SIGBWindows:
     Settings window is used to show sliders (trackbars)
     Results window is used to show total results (not really used)
     Temp window is used to show temporary results
+    
+    In headless mode no windows are created, sliders keep their starting
+    values, so the input handling can be used on machines without a display
+    
+    Slider changes don't run the callbacks on the GUI thread, see update(),
+    unless a callback was registered with background=False because it shows
+    windows or plots itself (OpenCV and matplotlib want those on one thread)
+    
+    Counters:
+        cacheHits: updates shown from the cache of rendered results
+        abandonedCount: computations dropped because the sliders moved on
     '''
-    def __init__(self, mode="video"):
+    def __init__(self, mode="video", headless=False, cacheSize=32):
         '''
         Creates the windows, registers mode
         
         Parameters:
             mode: ("video", "image", "cam") selects input to be used
+            headless (bool): do not create any windows or trackbars
+            cacheSize (int): how many rendered results (frame and slider values) to keep
         
         Returns:
             class instance
         '''
         self.updateCallbacks = dict()
         self.sliders = []
+        self.sliderValues = dict()
         self.mode = mode
-        cv2.namedWindow("Settings")
-        cv2.namedWindow("Results")
-        cv2.namedWindow("Temp")
+        self.headless = headless
+        self.image = None
+        self.capture = None
+
+        # background recompute, see update()
+        self.condition = threading.Condition()
+        self.frameLock = threading.Lock()
+        self.cacheLock = threading.Lock()
+        self.worker = None
+        self.running = False
+        self.generation = 0
+        self.pending = None
+        self.results = FrameQueue(1)
+        self.cache = OrderedDict()
+        self.cacheSize = cacheSize
+        self.cacheHits = 0
+        self.abandonedCount = 0
+
+        if not headless:
+            cv2.namedWindow("Settings")
+            cv2.namedWindow("Results")
+            cv2.namedWindow("Temp")
 
     def show(self):
         '''
         Shows all the windows with the right size and position
         Initiates the cam, etc.
         
+        Does nothing in headless mode
         '''
+        if self.headless:
+            return
+
         cv2.resizeWindow("Settings", 1000, 450)
         cv2.moveWindow("Settings", 300, 540)
 
@@ -44,24 +86,76 @@ class SIGBWindows:
         cv2.moveWindow("Temp", 1030, 0)
 
         if self.mode == "cam":
-            while True:
-                key = cv2.waitKey(1)
-
-                self.image = self.getVideoStreamCam()
-                self.update()
-
-                if key == 0:
-                    break
+            self.showLive()
         else:
             cv2.setTrackbarPos("video_position", "Settings", 1)
-            sliderValues = self.getSliderValues()
-            self.image = self.getVideoFrame(sliderValues['video_position'])
             self.update()
-            key = cv2.waitKey(0)
+
+            # the results come from the background worker, any key quits
+            while True:
+                key = cv2.waitKey(20)
+                self.poll()
+
+                if key != -1:
+                    break
+
+            self.stopWorker()
 
         cv2.destroyAllWindows()
 
 
+    def showLive(self, outputFile=None):
+        '''
+        Shows the cam stream, capture and detection run in their own threads
+        (see SIGBLive), this thread only reads the sliders and shows and
+        records the results. Prints the latency and dropped frames at the end
+        
+        Params:
+            outputFile (string): record the result of the last registered callback into this video
+        '''
+        # callbacks that show things themselves run here instead of on the worker
+        background = self.isBackgroundSafe()
+        if background:
+            live = LivePipeline(self.getCamCapture(), self.process)
+        else:
+            live = LivePipeline(self.getCamCapture(), lambda image, params: None)
+        live.setParams(self.getSliderValues())
+        writer = None
+
+        live.start()
+        while not live.isFinished():
+            item = live.getResult(0.05)
+
+            if item is not None:
+                frameId, captureTime, image, results = item
+                if not background:
+                    results = self.process(image, self.getSliderValues())
+                self.image = image
+                self.display(image, results)
+
+                if outputFile is not None and len(results) > 0:
+                    result = results[-1][1]
+                    if len(result.shape) == 2:
+                        result = cv2.cvtColor(result, cv2.COLOR_GRAY2BGR)
+                    if writer is None:
+                        writer = cv2.VideoWriter(outputFile, getFourCC("XVID"), 30, (result.shape[1], result.shape[0]))
+                    writer.write(result)
+
+                live.displayed(captureTime)
+
+            key = cv2.waitKey(1)
+            live.setParams(self.getSliderValues())
+
+            if key == 0 or key == 27:
+                break
+
+        live.stop()
+        if writer is not None:
+            writer.release()
+
+        printStats(live.getStats())
+        live.raiseError()
+
     def showCam(self):
         '''
         Shows the cam windows
@@ -75,28 +169,175 @@ class SIGBWindows:
         cv2.resizeWindow("Temp", 640, 480)
         cv2.moveWindow("Temp", 1030, 0)
 
-
-        self.update()
-
-        key = cv2.waitKey(0)
+        self.showLive()
 
     def update(self, trackbarPos=None):
         '''
         This gets called when trackbars get changed or the windows need to be redrawn
         
+        Only reads the sliders. When the frame and slider values have been
+        rendered before, the result is shown right away from the cache,
+        otherwise they replace whatever was waiting for the background worker
+        (see recompute()), so a dragged slider only gets its latest position
+        computed. The result is shown by poll()
+        
+        When a callback can not run in the background (see
+        registerOnUpdateCallback()) the callbacks run here, on the GUI thread
         '''
+        # in cam mode the live pipeline updates the windows
+        if self.mode == "cam" or self.headless:
+            return
+
         sliderValues = self.getSliderValues()
+        frameIndex = sliderValues['video_position'] if self.mode == "video" else None
+        key = (frameIndex, tuple(sorted(sliderValues.items())))
 
-        if self.mode == "video":
-            sliderValues = self.getSliderValues()
-            self.image = self.getVideoFrame(sliderValues['video_position'])
+        cached = self.getCachedResult(key)
+        hit = cached is not None
 
-        image = np.copy(self.image)
+        if cached is None and not self.isBackgroundSafe():
+            image = self.getVideoFrame(frameIndex) if frameIndex is not None else self.image
+            if image is None:
+                return
 
-        cv2.imshow("Results", image)
-        cv2.imshow("Temp", image)
+            cached = (image, self.process(image, sliderValues))
+            self.setCachedResult(key, cached)
+
+        with self.condition:
+            self.generation += 1
+
+            if cached is None:
+                self.pending = (self.generation, key, frameIndex, sliderValues)
+                self.startWorker()
+                self.condition.notify()
+            else:
+                self.pending = None
+
+        if cached is not None:
+            if hit:
+                self.cacheHits += 1
+            self.image, results = cached
+            self.display(self.image, results)
+
+    def poll(self):
+        '''
+        Show the result of the background worker, if there is a new one.
+        Has to be called from the GUI thread, e.g. in the waitKey() loop
+        
+        Returns:
+            (bool) was anything shown
+        '''
+        item = self.results.get(0)
+        if item is None:
+            return False
+
+        generation, image, results = item
+
+        # the sliders have moved since, the next result is on its way
+        if generation != self.generation:
+            return False
+
+        self.image = image
+        self.display(image, results)
+
+        return True
+
+    def startWorker(self):
+        if self.worker is None:
+            self.running = True
+            self.worker = threading.Thread(target=self.recompute)
+            self.worker.daemon = True
+            self.worker.start()
+
+    def stopWorker(self):
+        with self.condition:
+            self.running = False
+            self.condition.notify()
+
+        if self.worker is not None:
+            self.worker.join()
+            self.worker = None
+
+    def recompute(self):
+        '''
+        Background worker, reads the frame and runs the callbacks for the
+        latest update(). Work for slider values that are no longer the latest
+        is abandoned between the callbacks, finished results are cached and
+        posted to poll()
+        '''
+        while True:
+            with self.condition:
+                while self.pending is None and self.running:
+                    self.condition.wait()
+
+                if not self.running:
+                    return
+
+                generation, key, frameIndex, sliderValues = self.pending
+                self.pending = None
+
+            if frameIndex is not None:
+                image = self.getVideoFrame(frameIndex)
+            else:
+                image = self.image
+
+            if image is None:
+                continue
+
+            results = self.process(image, sliderValues, generation)
+            if results is None:
+                self.abandonedCount += 1
+                continue
+
+            self.setCachedResult(key, (image, results))
+            self.results.put((generation, image, results))
+
+    def getCachedResult(self, key):
+        with self.cacheLock:
+            if key not in self.cache:
+                return None
+
+            value = self.cache.pop(key)
+            self.cache[key] = value
+
+            return value
+
+    def setCachedResult(self, key, value):
+        with self.cacheLock:
+            self.cache[key] = value
+
+            while len(self.cache) > self.cacheSize:
+                self.cache.popitem(last=False)
+
+    def isBackgroundSafe(self):
+        '''
+        Returns:
+            (bool) none of the callbacks show anything themselves, so process()
+            can run outside the GUI thread
+        '''
+        return all(callback['background'] for callback in self.updateCallbacks.values())
+
+    def process(self, image, sliderValues, generation=None):
+        '''
+        Run the registered callbacks on image, does not touch the windows
+        itself, so it can run outside the GUI thread when isBackgroundSafe()
+        
+        Params:
+            image (numpy array): image to process, is not modified
+            sliderValues (dict): slider name -> value, see getSliderValues()
+            generation (int): update() this is computed for, the computation is
+                              abandoned when a newer update() comes in
+        
+        Returns:
+            list of (window, result) for every callback, None when abandoned
+        '''
+        image = np.copy(image)
+        results = []
 
         for callbackName in self.updateCallbacks:
+            if generation is not None and generation != self.generation:
+                return None
+
             callback = self.updateCallbacks[callbackName]
             func = callback['function']
             window = callback['window']
@@ -110,6 +351,22 @@ class SIGBWindows:
                 cv2.putText(result, value, (x, y), cv2.FONT_HERSHEY_PLAIN, 1, (255, 255, 255))
                 y = y + 20
 
+            results.append((window, result))
+
+        return results
+
+    def display(self, image, results):
+        '''
+        Show the image and the output of process() in the windows
+        
+        Params:
+            image (numpy array): the processed image
+            results (list): output of process()
+        '''
+        cv2.imshow("Results", image)
+        cv2.imshow("Temp", image)
+
+        for window, result in results:
             cv2.imshow(window, result)
 
     def registerSlider(self, name, startingValue, maxValue):
@@ -125,7 +382,10 @@ class SIGBWindows:
             maxValue (int): the max value of the slider
         '''
         self.sliders.append(name)
-        cv2.createTrackbar(name, "Settings", startingValue, maxValue, self.update)
+        self.sliderValues[name] = startingValue
+
+        if not self.headless:
+            cv2.createTrackbar(name, "Settings", startingValue, maxValue, self.update)
 
     def deregisterSlider(self, name):
         '''
@@ -145,10 +405,13 @@ class SIGBWindows:
         '''
         values = dict()
         for slider in self.sliders:
-            values[slider] = cv2.getTrackbarPos(slider, "Settings")
+            if self.headless:
+                values[slider] = self.sliderValues[slider]
+            else:
+                values[slider] = cv2.getTrackbarPos(slider, "Settings")
         return values
 
-    def registerOnUpdateCallback(self, name, function, window="Results"):
+    def registerOnUpdateCallback(self, name, function, window="Results", background=True):
         '''
         Registers a callback function to be called when sliders get updated
         
@@ -156,12 +419,20 @@ class SIGBWindows:
             name (string): name of the callback function
             function (function): the callback (should accept one param, a dict of slider name -> value pairs)
             window (string): which window name it should show up in
+            background (bool): False when the callback shows windows or plots
+                               itself (cv2.imshow, show=True, matplotlib), then
+                               the callbacks run on the GUI thread
         '''
         self.updateCallbacks[name] = {
                                       'function': function,
-                                      'window': window
+                                      'window': window,
+                                      'background': background
                                       }
 
+        # the rendered results do not have this callback yet
+        with self.cacheLock:
+            self.cache.clear()
+
     def openVideo(self, videoFile):
         '''
         Opens video for reading
@@ -170,7 +441,8 @@ class SIGBWindows:
             videoFile (string): path to video file to be open
         '''
         self.videoFile = videoFile
-        self.video = cv2.VideoCapture(videoFile)
+        self.frameSource = FrameSource(videoFile)
+        self.video = self.frameSource.video
         self.registerSlider("video_position", 2, self.getTotalVideoFrames())
 
     def openImage(self, imageFile):
@@ -193,10 +465,36 @@ class SIGBWindows:
         Returns:
             image read from the video (numpy array)
         '''
-        frameIndex = min(frameIndex, self.getTotalVideoFrames() - 1)
-        self.video.set(cv2.cv.CV_CAP_PROP_POS_FRAMES, frameIndex)
-        retval, image = self.video.read()
-        return image
+        # the background worker reads frames too
+        with self.frameLock:
+            frameIndex = min(frameIndex, self.getTotalVideoFrames() - 1)
+            return self.frameSource.getFrame(frameIndex)
+
+    def getVideoFrames(self, reuse=False):
+        '''
+        Iterate over all frames of the currently open video, decodes
+        sequentially without seeking
+        
+        Params:
+            reuse (bool): decode into the same array, see FrameSource.getFrames()
+        
+        Returns:
+            generator of (frameIndex, image)
+        '''
+        return self.frameSource.getFrames(reuse=reuse)
+
+    def getCamCapture(self):
+        '''
+        The cam capture, opened on first use and kept open
+        
+        Returns:
+            (cv2.VideoCapture) capture of the cam
+        '''
+        if self.capture is None:
+            self.capture = cv2.VideoCapture(1)
+            self.video = self.capture
+
+        return self.capture
 
     def getVideoStreamCam(self):
         '''
@@ -205,8 +503,7 @@ class SIGBWindows:
         Returns:
             (numpy array) image from cam
         '''
-        self.video = cv2.VideoCapture(1)
-        retval, image = self.video.read()
+        retval, image = self.getCamCapture().read()
         return image
 
     def getTotalVideoFrames(self):
@@ -216,12 +513,12 @@ class SIGBWindows:
         Returns:
             (int) frame count
         '''
-        return int(self.video.get(cv2.cv.CV_CAP_PROP_FRAME_COUNT))
+        return int(self.video.get(CAP_PROP_FRAME_COUNT))
 
     def getVideoWriter(self, filename):
-        size = (int(self.video.get(cv2.cv.CV_CAP_PROP_FRAME_WIDTH)), int(self.video.get(cv2.cv.CV_CAP_PROP_FRAME_HEIGHT)))
-        fps = self.video.get(cv2.cv.CV_CAP_PROP_FPS)
-        self.videoWriter = cv2.VideoWriter(filename, cv2.cv.FOURCC("X", "V", "I", "D"), fps, size)
+        size = (int(self.video.get(CAP_PROP_FRAME_WIDTH)), int(self.video.get(CAP_PROP_FRAME_HEIGHT)))
+        fps = self.video.get(CAP_PROP_FPS)
+        self.videoWriter = cv2.VideoWriter(filename, getFourCC("XVID"), fps, size)
 
         return self.videoWriter
 
@@ -1,49 +1,95 @@
 import cv2
+import argparse
 from SIGBWindows import SIGBWindows
 from SIGBAssignments import *
 
-# Initialize windows for the Eye tracking lab
-# I use monitor with resolution of 1680x1050, so the layout has been optimized for this resolution
-# You can change video to either "image" to load a static image, or "cam" to use a webcam
-# these haven't been extensively tested, so bugs might occur...
-windows = SIGBWindows(mode="video")
+# Run without arguments to open the GUI, or give it a video to process it
+# headless (no windows at all), e.g. on a machine without a display:
+#    > python sigb.py Sequences/eye1.avi -o Sequences/Processed/eye1.avi
+#    > python sigb.py Sequences/eye1.avi --processes 4
+#    > python sigb.py Sequences/eye1.avi --gate 2.0 --max-skip 15
 
-# loads video
-windows.openVideo("Sequences/eye8.avi")
+def runGUI():
+    # Initialize windows for the Eye tracking lab
+    # I use monitor with resolution of 1680x1050, so the layout has been optimized for this resolution
+    # You can change video to either "image" to load a static image, or "cam" to use a webcam
+    # these haven't been extensively tested, so bugs might occur...
+    windows = SIGBWindows(mode="video")
 
-# loads an image
-windows.openImage("Sequences/hough2.png")
+    # loads video
+    windows.openVideo("Sequences/eye8.avi")
 
-# the following functions are defined in SIGBAssignments.py
-# their purpose is to register and evaluate sliders and pass the
-# parameters to a particular function that can accept it
+    # loads an image
+    windows.openImage("Sequences/hough2.png")
 
+    # the following functions are defined in SIGBAssignments.py
+    # their purpose is to register and evaluate sliders and pass the
+    # parameters to a particular function that can accept it
 
-processSequence(windows)
 
-# this will load all of the detectors, pupil, iris and glint all at the same time
-# allTogether(windows)
+    processSequence(windows)
 
-# load glint detector with parameters
-# glints(windows)
+    # this will load all of the detectors, pupil, iris and glint all at the same time
+    # allTogether(windows)
 
-# load iris detector using gradient images
-# irisUsingVectors(windows)
+    # load glint detector with parameters
+    # glints(windows)
 
-# detect pupil using kmeans
-# pupilUsingKmeans(windows)
+    # load iris detector using gradient images
+    # irisUsingVectors(windows)
 
-# canny fitting experiment (not used)
-# cannyFitting(windows)
+    # detect pupil using kmeans
+    # pupilUsingKmeans(windows)
 
-# gradient experiments, used in irisUsingVectors()
-# gradient(windows)
+    # canny fitting experiment (not used)
+    # cannyFitting(windows)
 
-# hough experiments, not used, too volatile
-# hough(windows)
+    # gradient experiments, used in irisUsingVectors()
+    # gradient(windows)
 
-# just show the image without modification (kind of a template code)
-# simpleShow(windows)
+    # hough experiments, not used, too volatile
+    # hough(windows)
 
-# start the show
-windows.show()
+    # just show the image without modification (kind of a template code)
+    # simpleShow(windows)
+
+    # start the show, processSequence() has already gone through the whole video
+    if len(windows.updateCallbacks) > 0:
+        windows.show()
+
+def runHeadless(args):
+    windows = SIGBWindows(mode="video", headless=True)
+    windows.openVideo(args.input)
+
+    if args.processes is not None:
+        processSequenceBatch(windows, args.output, processes=args.processes)
+    else:
+        gate = None
+        if args.gate is not None:
+            gate = {'threshold': args.gate, 'maxSkip': args.max_skip or 15}
+
+        processSequence(windows, args.output, show=args.show, storeDirectory=args.store or "Sequences/Results", gate=gate, interpolate=args.interpolate)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="SIGB eye tracker, opens the GUI when no input is given")
+    parser.add_argument("input", nargs="?", default=None, help="video to process without the GUI")
+    parser.add_argument("-o", "--output", default=None, help="video to write the results to (default: Sequences/Processed/<input>)")
+    parser.add_argument("-p", "--processes", type=int, default=None, help="process on this many worker processes (see SIGBBatch)")
+    parser.add_argument("-s", "--store", default=None, help="where the results are kept between runs (default: Sequences/Results, see SIGBStore)")
+    parser.add_argument("--show", action="store_true", help="show the frames while processing")
+    parser.add_argument("-g", "--gate", type=float, default=None, help="only detect on frames that changed more than this (mean gray levels) around the eye, see MotionGate")
+    parser.add_argument("--max-skip", type=int, default=None, help="detect at least every this many frames with --gate (default: 15)")
+    parser.add_argument("--interpolate", action="store_true", help="interpolate the eyes of the skipped frames into the interpolated columns of the store")
+    args = parser.parse_args()
+
+    # SIGBBatch detects every frame on its own, without the store, gate or windows
+    if args.processes is not None:
+        ignored = [name for name, given in [("--store", args.store is not None), ("--show", args.show), ("--gate", args.gate is not None),
+                                            ("--max-skip", args.max_skip is not None), ("--interpolate", args.interpolate)] if given]
+        if len(ignored) > 0:
+            parser.error("{} can not be combined with --processes".format(", ".join(ignored)))
+
+    if args.input is None:
+        runGUI()
+    else:
+        runHeadless(args)